@@ -1,57 +1,259 @@
 #!/usr/bin/env python
+"""
+Benchmark scenarios for geventredis.
 
+    python benchmark.py --fake                     # in-process fake server
+    python benchmark.py --port 6379 -o run.json    # a local redis-server
+    python benchmark.py --fake --compare run.json  # against a previous run
+
+Each scenario runs a number of operations from ``concurrency`` greenlets and
+records the latency of every operation in a LatencyHistogram.  The results
+(ops/s, p50/p99/p999, objects retained per op...) are printed and written as
+JSON with ``--output``, so that two runs can be compared with ``--compare``.
+"""
+
+import gc
+import json
+import optparse
+import sys
 import time
 
-CONNECTIONS = 10
-INCR_NUMBER = 100
-
-def test_redispy():
-    import threading, redis
-    import gevent.monkey
-    gevent.monkey.patch_all()
-    redis_client = redis.Redis()
-    redis_client.delete('test')
-    del redis_client
-    time_begin = time.time()
-    print 'test_redispy begin', time_begin
-    def worker():
-        redis_client = redis.Redis()
-        for i in xrange(INCR_NUMBER):
-            redis_client.lpush('test', i)
-            redis_client.lrange('test', 0, -1)
-    jobs = [threading.Thread(target=worker) for i in xrange(CONNECTIONS)]
-    for job in jobs:
-        job.start()
-    for job in jobs:
-        job.join()
-    time_end = time.time()
-    print 'test_redispy end', time_end
-    print 'test_redispy total', time_end - time_begin
-
-def test_geventredis():
-    import gevent, geventredis
-    redis_client = geventredis.connect()
-    redis_client.delete('test')
-    del redis_client
-    time_begin = time.time()
-    print 'test_geventredis begin', time_begin
+import gevent
+
+import geventredis
+from geventredis.fakeserver import FakeRedisServer
+
+
+class LatencyHistogram(object):
+    """Log-linear histogram of latencies in microseconds, in the manner of
+    HdrHistogram: values under 64us are exact, larger ones are kept with 32
+    buckets per power of two, about 3% of precision."""
+
+    SUB_BUCKETS = 32
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def _index(self, value):
+        if value < 2 * self.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - 6
+        return 2 * self.SUB_BUCKETS + (shift - 1) * self.SUB_BUCKETS + \
+            (value >> shift) - self.SUB_BUCKETS
+
+    def _value(self, index):
+        """The highest value counted in the bucket ``index``"""
+        if index < 2 * self.SUB_BUCKETS:
+            return index
+        shift, top = divmod(index - 2 * self.SUB_BUCKETS, self.SUB_BUCKETS)
+        shift += 1
+        return ((top + self.SUB_BUCKETS + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = int(seconds * 1000000)
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        wanted = self.count * percent / 100.0
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= wanted:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count if self.count else 0,
+            'p50_us': self.percentile(50),
+            'p99_us': self.percentile(99),
+            'p999_us': self.percentile(99.9),
+            'max_us': self.max,
+        }
+
+
+def run(name, operation, operations, concurrency=1, commands_per_operation=1):
+    """
+    Call ``operation`` ``operations`` times from ``concurrency`` greenlets
+    and return the measures as a dict
+    """
+    histogram = LatencyHistogram()
+    remaining = [operations]
     def worker():
-        redis_client = geventredis.connect()
-        for i in xrange(INCR_NUMBER):
-            redis_client.lpush('test', i)
-            redis_client.lrange('test', 0, -1)
-    jobs = [gevent.spawn(worker) for i in xrange(CONNECTIONS)]
-    gevent.joinall(jobs)
-    time_end = time.time()
-    print 'test_geventredis end', time_end
-    print 'test_geventredis total', time_end - time_begin
-
-def test():
-    print '-----------------------------'
-    test_geventredis()
-    print '-----------------------------'
-    test_redispy()
-    print '-----------------------------'
+        clock = time.time
+        record = histogram.record
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = clock()
+            operation()
+            record(clock() - start)
+    # The collector is paused so that it does not add to the latencies, and
+    # the gc-tracked objects still alive afterwards show what each operation
+    # retains.  That is not a count of allocations, which CPython 2 does not
+    # keep, and objects freed during the run can make it negative, so it is
+    # clamped at zero.
+    gc.collect()
+    gc.disable()
+    objects = len(gc.get_objects())
+    begin = time.time()
+    gevent.joinall([gevent.spawn(worker) for _ in xrange(concurrency)], raise_error=True)
+    elapsed = time.time() - begin
+    retained = len(gc.get_objects()) - objects
+    gc.enable()
+    result = {
+        'name': name,
+        'operations': operations,
+        'concurrency': concurrency,
+        'elapsed': elapsed,
+        'ops_per_sec': operations / elapsed,
+        'commands_per_sec': operations * commands_per_operation / elapsed,
+        'retained_objects_per_op': float(max(retained, 0)) / operations,
+        'latency': histogram.to_dict(),
+    }
+    return result
+
+
+def scenario_values(options):
+    client = geventredis.connect(options.host, options.port)
+    for size in (16, 1024, 16 * 1024, 256 * 1024, 1024 * 1024):
+        value = 'x' * size
+        operations = max(options.operations * 16 // size, 50) if size > 1024 else options.operations
+        yield run('set_%d' % size, lambda: client.set('bench:value', value), operations)
+        yield run('get_%d' % size, lambda: client.get('bench:value'), operations)
+
+def scenario_multibulk(options):
+    client = geventredis.connect(options.host, options.port)
+    for length in (100, 10000):
+        client.delete('bench:list')
+        pipe = client.pipeline()
+        for start in xrange(0, length, 1000):
+            pipe.rpush('bench:list', *['item:%d' % i for i in xrange(start, min(start + 1000, length))])
+        pipe.execute()
+        operations = max(options.operations * 10 // length, 20)
+        yield run('lrange_%d' % length, lambda: client.lrange('bench:list', 0, -1), operations)
+        yield run('lrange_iter_%d' % length,
+                  lambda: sum(1 for _ in client.lrange_iter('bench:list')), operations)
+
+def scenario_pipeline(options):
+    client = geventredis.connect(options.host, options.port)
+    yield run('sequential_set', lambda: client.set('bench:pipe', 'x'), options.operations)
+    for depth in (10, 100, 1000):
+        def operation():
+            pipe = client.pipeline()
+            for _ in xrange(depth):
+                pipe.set('bench:pipe', 'x')
+            pipe.execute()
+        yield run('pipeline_%d' % depth, operation, max(options.operations // depth, 10),
+                  commands_per_operation=depth)
+
+def scenario_concurrency(options):
+    for connections in (1, 10, 50):
+        client = geventredis.connect(options.host, options.port, max_connections=connections)
+        yield run('pool_%d_connections' % connections, lambda: client.get('bench:key'),
+                  options.operations, concurrency=100)
+    client = geventredis.connect(options.host, options.port, multiplex=True)
+    yield run('multiplexed', lambda: client.get('bench:key'), options.operations, concurrency=100)
+
+def scenario_pubsub(options):
+    client = geventredis.connect(options.host, options.port, max_connections=10)
+    pubsub = client.pubsub()
+    pubsub.subscribe('bench:channel')
+    # wait for the confirmation before publishing
+    pubsub.get_messages()
+    latency = LatencyHistogram()
+    received = [0]
+    def subscriber():
+        for message in pubsub.listen():
+            if message.type == 'message':
+                latency.record(time.time() - float(message.data))
+                received[0] += 1
+    reader = gevent.spawn(subscriber)
+    result = run('pubsub_fanin_10_publishers',
+                 lambda: client.publish('bench:channel', repr(time.time())),
+                 options.operations, concurrency=10)
+    while received[0] < options.operations:
+        gevent.sleep(0.01)
+    pubsub.close()
+    reader.kill()
+    # the interesting latency is from publishing to delivery
+    result['latency'] = latency.to_dict()
+    yield result
+
+SCENARIOS = [
+    ('values', scenario_values),
+    ('multibulk', scenario_multibulk),
+    ('pipeline', scenario_pipeline),
+    ('concurrency', scenario_concurrency),
+    ('pubsub', scenario_pubsub),
+]
+
+
+def compare(results, path):
+    previous = dict((result['name'], result) for result in json.load(open(path))['results'])
+    print
+    print '%-28s %12s %12s %8s' % ('compared to ' + path, 'ops/s', 'p99 us', 'change')
+    for result in results:
+        old = previous.get(result['name'])
+        if old is None:
+            continue
+        change = result['ops_per_sec'] / old['ops_per_sec'] - 1
+        print '%-28s %12.0f %12d %+7.1f%%' % (result['name'], result['ops_per_sec'],
+                                               result['latency']['p99_us'], change * 100)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [scenario...]')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=6379)
+    parser.add_option('--fake', action='store_true',
+                      help='run against an in-process FakeRedisServer')
+    parser.add_option('-n', '--operations', type='int', default=10000,
+                      help='operations per scenario, scaled down for large ones')
+    parser.add_option('-o', '--output', help='write the results as JSON to this file')
+    parser.add_option('--compare', help='compare with the JSON results of a previous run')
+    options, names = parser.parse_args()
+    server = None
+    if options.fake:
+        server = FakeRedisServer(options.host)
+        server.start()
+        options.port = server.port
+    results = []
+    print '%-28s %10s %12s %8s %8s %8s %10s' % (
+        'scenario', 'ops', 'ops/s', 'p50 us', 'p99 us', 'p999 us', 'kept/op')
+    for name, scenario in SCENARIOS:
+        if names and name not in names:
+            continue
+        for result in scenario(options):
+            latency = result['latency']
+            print '%-28s %10d %12.0f %8d %8d %8d %10.2f' % (
+                result['name'], result['operations'], result['ops_per_sec'],
+                latency['p50_us'], latency['p99_us'], latency['p999_us'],
+                result['retained_objects_per_op'])
+            sys.stdout.flush()
+            results.append(result)
+    if options.output:
+        document = {
+            'time': time.time(),
+            'server': 'fake' if options.fake else '%s:%d' % (options.host, options.port),
+            'python': sys.version.split()[0],
+            'results': results,
+        }
+        json.dump(document, open(options.output, 'w'), indent=2, sort_keys=True)
+    if options.compare:
+        compare(results, options.compare)
+    if server is not None:
+        server.stop()
 
 if __name__ == '__main__':
-    test()
+    main()
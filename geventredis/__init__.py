@@ -1,2 +1,16 @@
-from geventredis.client import RedisClient, connect
-from geventredis.wire_protocol import RedisError
+from geventredis.bulk import BulkLoader
+from geventredis.cache import CachingClient
+from geventredis.client import RedisClient, Pipeline, connect
+from geventredis.cluster import RedisClusterClient, key_slot
+from geventredis.codec import Codec, CompressedCodec, JSONCodec, MarshalCodec, PickleCodec
+from geventredis.commands import COMMANDS, Command
+from geventredis.instrumentation import CommandEvent, Instrumentation
+from geventredis.monitor import MonitorAnalyzer, MonitorEvent, SpaceSaving, parse_monitor_line
+from geventredis.multiplex import MultiplexedConnection, MultiplexedConnectionPool
+from geventredis.pool import ConnectionPool
+from geventredis.pubsub import Message, PubSub
+from geventredis.replica import ReplicatedRedisClient
+from geventredis.scripting import Script
+from geventredis.sharded import HashRing, ShardedRedisClient
+from geventredis.wire_protocol import HiredisReader, PythonReader, RedisError, RedisTimeoutError, WatchError
+from geventredis.zset import ScoredMembers
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Mass insertion of commands over one connection, like redis-cli --pipe"""
+
+import time
+
+import gevent
+from gevent.event import Event
+
+from geventredis.commands import lookup_command
+from geventredis.wire_protocol import RedisError
+
+
+class BulkLoader(object):
+    """Streams a large number of commands without waiting for replies.
+
+    Example usage::
+
+        loader = BulkLoader(redis_client, window=10000)
+        commands = (('SET', 'key:%d' % i, i) for i in xrange(10000000))
+        result = loader.load(commands)
+        print result['rate'], result['errors'][:10]
+
+    ``load`` takes any iterable of commands, each a sequence of the
+    command name and its arguments, and sends them on a dedicated
+    connection in writes of ``batch_size`` commands.  A reader greenlet
+    drains the replies meanwhile, every reply already received at once,
+    and the writer only waits when ``window`` replies are outstanding, so
+    memory stays bounded however many commands are sent.
+
+    Replies are checked but not kept: ``load`` returns a dict with the
+    number of commands, elapsed seconds, commands per second, the count of
+    error replies and the first ``max_errors`` of them as (index, error).
+    A socket error aborts the load and is raised.  A BulkLoader runs one
+    load at a time.
+    """
+
+    def __init__(self, redis_client, window=10000, batch_size=1000, max_errors=1000):
+        self.connection_pool = redis_client.connection_pool
+        self.window = window
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+
+    def load(self, commands):
+        """Send every command of ``commands`` and return the statistics"""
+        self.sent = 0
+        self.received = 0
+        self.errors = []
+        self.error_count = 0
+        self._done = False
+        self._can_send = Event()
+        self._pending = Event()
+        start = time.time()
+        connection = self.connection_pool.make_connection()
+        reader = gevent.spawn(self._read_loop, connection)
+        try:
+            self._write_loop(connection, commands, reader)
+            self._done = True
+            self._pending.set()
+            reader.get()
+        finally:
+            reader.kill()
+            connection.close()
+        elapsed = time.time() - start
+        return {
+            'commands': self.sent,
+            'elapsed': elapsed,
+            'rate': self.sent / elapsed if elapsed else None,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def _write_loop(self, connection, commands, reader):
+        send_packed = connection._send_packed
+        batch_size = self.batch_size
+        window = self.window
+        can_send = self._can_send
+        buffers = []
+        batched = 0
+        for args in commands:
+            buffers.extend(lookup_command(args[0]).pack(args[1:]))
+            batched += 1
+            if batched < batch_size:
+                continue
+            # something must be outstanding for a reply to free the window
+            while self.sent > self.received and \
+                    self.sent - self.received + batched > window:
+                if reader.ready():
+                    reader.get()
+                can_send.clear()
+                can_send.wait()
+            send_packed(buffers)
+            self.sent += batched
+            self._pending.set()
+            buffers = []
+            batched = 0
+        if batched:
+            send_packed(buffers)
+            self.sent += batched
+            self._pending.set()
+
+    def _read_loop(self, connection):
+        read_responses = connection._read_responses
+        pending = self._pending
+        try:
+            while True:
+                while self.received == self.sent:
+                    if self._done:
+                        return
+                    pending.clear()
+                    pending.wait()
+                index = self.received
+                for reply in read_responses():
+                    if isinstance(reply, RedisError):
+                        self.error_count += 1
+                        if len(self.errors) < self.max_errors:
+                            self.errors.append((index, reply))
+                    index += 1
+                self.received = index
+                self._can_send.set()
+        finally:
+            # never leave the writer waiting on a dead reader
+            self._can_send.set()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""In-process cache of read commands kept fresh by keyspace notifications"""
+
+import time
+from collections import OrderedDict
+
+import gevent
+
+from geventredis.client import RedisCommands
+from geventredis.wire_protocol import RedisError, encode
+
+KEYSPACE_PATTERN = '__keyspace@*__:*'
+
+
+def reply_size(reply):
+    """Estimate the number of bytes held by a reply"""
+    if isinstance(reply, basestring):
+        return len(reply)
+    if isinstance(reply, (list, tuple)):
+        return sum([reply_size(item) for item in reply])
+    if isinstance(reply, dict):
+        return sum([len(key) + reply_size(value) for key, value in reply.iteritems()])
+    return 8
+
+
+class CachingClient(RedisCommands):
+    """Serves read commands from an in-process LRU cache.
+
+    Example usage::
+
+        redis_client = geventredis.connect('127.0.0.1', 6379)
+        cached = CachingClient(redis_client, max_entries=10000)
+        cached.get('foo')   # miss, read from the server
+        cached.get('foo')   # hit
+        print cached.stats()
+
+    The replies of ``cached_commands`` are kept until ``max_entries`` or
+    ``max_bytes`` forces the least recently used ones out, or until they
+    are older than ``ttl`` seconds.  Every other command goes to
+    ``redis_client``, and writes issued through this object evict the keys
+    they touch right away.
+
+    Writes from other clients are seen through keyspace notifications,
+    which the server must publish (``notify-keyspace-events`` including
+    ``K`` and the events of the cached types, e.g. ``KA``).  A greenlet
+    keeps a PSUBSCRIBE to ``__keyspace@*__:*`` on a dedicated connection;
+    replies are only cached while that subscription is up, and the whole
+    cache is dropped whenever it is lost, since notifications may have
+    been missed.  Cached replies are shared between callers and must not
+    be modified.
+    """
+
+    def __init__(self, redis_client, max_entries=10000, max_bytes=64 * 1024 * 1024,
+                 ttl=None, cached_commands=('GET', 'HGET', 'HGETALL'),
+                 retry_interval=1):
+        self.redis_client = redis_client
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cached_commands = frozenset(cached_commands)
+        self.retry_interval = retry_interval
+        # (command name, args, options) -> (reply, size, expiry time, keys)
+        self._entries = OrderedDict()
+        # bytes of a redis key -> set of the entries caching it
+        self._entries_by_key = {}
+        self._bytes = 0
+        # bumped by every invalidation, so a reply read while one of them
+        # happened is not cached
+        self._generation = 0
+        self._listening = False
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._listener = gevent.spawn(self._listen)
+
+    def close(self):
+        """Stop listening for notifications and drop the cache"""
+        self._listener.kill()
+        self._listening = False
+        self.clear()
+
+    def pipeline(self, transaction=False):
+        """Pipelines are not cached, they go straight to the server"""
+        return self.redis_client.pipeline(transaction)
+
+    def stats(self):
+        """Return the cache statistics as a dict"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'listening': self._listening,
+        }
+
+    def clear(self):
+        """Drop every cached reply"""
+        self._generation += 1
+        self._entries.clear()
+        self._entries_by_key.clear()
+        self._bytes = 0
+
+    def invalidate(self, key):
+        """Drop the cached replies of the redis key ``key``"""
+        self._generation += 1
+        entries = self._entries_by_key.pop(encode(key), None)
+        if entries:
+            self.invalidations += len(entries)
+            for entry_key in entries:
+                self._forget(entry_key)
+
+    def _execute(self, command, args, **options):
+        name = command.name
+        if name not in self.cached_commands:
+            result = self.redis_client._execute(command, args, **options)
+            if 'readonly' not in command.flags:
+                if 'admin' in command.flags or 'movablekeys' in command.flags:
+                    self.clear()
+                else:
+                    for key in command.keys(args):
+                        self.invalidate(key)
+            return result
+        entry_key = (name, args, tuple(sorted(options.iteritems())))
+        entry = self._entries.get(entry_key)
+        if entry is not None:
+            reply, _, expires, _ = entry
+            if expires is None or expires > time.time():
+                self.hits += 1
+                # move to the most recently used end
+                del self._entries[entry_key]
+                self._entries[entry_key] = entry
+                return reply
+            self._forget(entry_key)
+        self.misses += 1
+        generation = self._generation
+        reply = self.redis_client._execute(command, args, **options)
+        if self._listening and generation == self._generation \
+                and not isinstance(reply, RedisError):
+            # indexed by the bytes of the keys, as named by notifications
+            self._store(entry_key, [encode(key) for key in command.keys(args)], reply)
+        return reply
+
+    def _execute_iter_command(self, *args):
+        return self.redis_client._execute_iter_command(*args)
+
+    def _execute_yield_command(self, *args):
+        return self.redis_client._execute_yield_command(*args)
+
+    def _store(self, entry_key, keys, reply):
+        size = reply_size(reply)
+        if size > self.max_bytes:
+            return
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+        self._entries[entry_key] = (reply, size, expires, keys)
+        self._bytes += size
+        entries_by_key = self._entries_by_key
+        for key in keys:
+            entries_by_key.setdefault(key, set()).add(entry_key)
+        entries = self._entries
+        while len(entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(entries))
+            self._forget(oldest)
+            self.evictions += 1
+
+    def _forget(self, entry_key):
+        entry = self._entries.pop(entry_key, None)
+        if entry is None:
+            return
+        _, size, _, keys = entry
+        self._bytes -= size
+        for key in keys:
+            entries = self._entries_by_key.get(key)
+            if entries is not None:
+                entries.discard(entry_key)
+                if not entries:
+                    del self._entries_by_key[key]
+
+    def _listen(self):
+        while True:
+            try:
+                for message in self.redis_client.psubscribe(KEYSPACE_PATTERN):
+                    kind = message[0]
+                    if kind == 'pmessage':
+                        self.invalidate(message[2].split(':', 1)[1])
+                    elif kind == 'psubscribe':
+                        self._listening = True
+            except Exception:
+                pass
+            self._listening = False
+            self.clear()
+            gevent.sleep(self.retry_interval)
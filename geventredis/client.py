@@ -16,9 +16,29 @@
 
 """Redis client implementations using gevent.socket"""
 
-import core
-
-def connect(host='localhost', port=6379, timeout=None):
+import copy
+import datetime
+import random
+import sys
+import time
+import warnings
+from itertools import izip
+
+import gevent
+from gevent.socket import error
+
+from geventredis.commands import COMMANDS, add_command_methods, lookup_command
+from geventredis.multiplex import MultiplexedConnectionPool
+from geventredis.pool import ConnectionPool
+from geventredis.pubsub import PubSub
+from geventredis.scripting import Script
+from geventredis.wire_protocol import RedisError, RedisTimeoutError, WatchError, pack_command
+from geventredis.zset import ScoredMembers
+
+MULTI = pack_command('MULTI')
+EXEC = pack_command('EXEC')
+
+def connect(host='localhost', port=6379, timeout=None, **pool_options):
     """Create gevent Redis client.
 
     Example usage::
@@ -33,12 +53,46 @@ def connect(host='localhost', port=6379, timeout=None):
     It does not currently implement all applicable parts of the Redis
     specification, but it does enough to work with major redis server APIs
     (mostly tested against the LIST/HASH/PUBSUB API so far).
+
+    The client is backed by a ConnectionPool, so it can be shared by any
+    number of greenlets; ``pool_options`` (``max_connections``,
+    ``checkout_timeout``, ``idle_timeout``, ``reader_class``...) are passed
+    to the pool.
+    The first connection is opened right away so that an unreachable
+    server is reported by ``connect`` itself.
+
+    With ``multiplex=True`` all the greenlets share a single connection
+    instead, and the commands they issue concurrently are pipelined
+    automatically (see MultiplexedConnection).
     """
-    redis_client = RedisClient()
-    redis_client.timeout = timeout
-    redis_client.connect((host, port))
+    redis_client = RedisClient(host, port, timeout, **pool_options)
+    pool = redis_client.connection_pool
+    pool.release(pool.get_connection())
     return redis_client
 
+def parse_reply(command, reply, options, codec=None):
+    """
+    Decode the values of the reply with ``codec``, then apply the reply
+    callback of ``command``, error replies excepted, and unless the ``raw``
+    option is set
+    """
+    if isinstance(reply, RedisError) or options.get('raw'):
+        return reply
+    if codec is not None:
+        reply = codec.decode_reply(command, reply)
+    callback = command.callback
+    if callback is None:
+        return reply
+    return callback(reply, **options)
+
+def scan_arguments(pieces, match, count):
+    """Append the MATCH and COUNT options of the SCAN commands to ``pieces``"""
+    if match is not None:
+        pieces.extend(['MATCH', match])
+    if count is not None:
+        pieces.extend(['COUNT', count])
+    return pieces
+
 def list_or_args(keys, args):
     # returns a single list combining keys and args
     try:
@@ -54,87 +108,38 @@ def list_or_args(keys, args):
     return keys
 
 
-class RedisClient(core.RedisSocket):
-    """An gevent Redis client.
-
-    Example usage::
+@add_command_methods
+class RedisCommands(object):
+    """The Redis command methods shared by RedisClient and Pipeline.
 
-        import geventredis
-
-        redis_client = geventredis.RedisClient('127.0.0.1', 6379)
-        redis_client.connect('127.0.0.1', 6379)
-        result = redis_client.get('foo')
-        print result
+    The methods of the commands whose arguments are passed through as they
+    are, like ``get`` or ``lpush``, are generated from the command table in
+    geventredis.commands; the ones below prepare their arguments first.
+    Every method ends up in ``_execute(command, args)``, which a subclass
+    implements to decide how the command is sent.
 
-    This class implements a Redis client on top of Gevent Socket.
-    It does not currently implement all applicable parts of the Redis
-    specification, but it does enough to work with major redis server APIs
-    (mostly tested against the LIST/HASH/PUBSUB API so far).
+    Replies are converted by the callback of their command: HGETALL and
+    CONFIG GET return dicts, INFO a dict of numbers, ZRANGE and the like
+    (member, score) pairs ``withscores``.  The generated methods pass
+    their keyword arguments to the callback, so ``raw=True`` returns the
+    reply as received and ``lazy=True`` defers building the dict of
+    HGETALL, CONFIG GET or INFO to its first access; an argument the
+    callback does not take raises TypeError before anything is sent.
     """
 
-    #### SERVER INFORMATION ####
-    def bgrewriteaof(self):
-        "Tell the Redis server to rewrite the AOF file from data in memory."
-        return self._execute_command_1('BGREWRITEAOF')
-
-    def bgsave(self):
-        """
-        Tell the Redis server to save its data to disk.  Unlike save(),
-        this method is asynchronous and returns immediately.
-        """
-        return self._execute_command_1('BGSAVE')
-
-    def config_get(self, pattern="*"):
-        """Return a dictionary of configuration based on the ``pattern``"""
-        return self._execute_command_3('CONFIG', 'GET', pattern, parse='GET')
-
-    def config_set(self, name, value):
-        """Set config item ``name`` with ``value``"""
-        return self._execute_command_4('CONFIG', 'SET', name, value, parse='SET')
-
-    def dbsize(self):
-        """Returns the number of keys in the current database"""
-        return self._execute_command_1('DBSIZE')
-
-    def delete(self, *names):
-        """Delete one or more keys specified by ``names``"""
-        return self._execute_command('DEL', *names)
-
-    def flushall(self):
-        """Delete all keys in all databases on the current host"""
-        return self._execute_command_1('FLUSHALL')
-
-    def flushdb(self):
-        """Delete all keys in the current database"""
-        return self._execute_command_1('FLUSHDB')
-
-    def info(self):
-        """Returns a dictionary containing information about the Redis server"""
-        return self._execute_command_1('INFO')
-
-    def lastsave(self):
-        """
-        Return a Python datetime object representing the last time the
-        Redis database was saved to disk
-        """
-        return self._execute_command_1('LASTSAVE')
-
-    def ping(self):
-        """Ping the Redis server"""
-        return self._execute_command_1('PING')
-
-    def save(self):
-        """
-        Tell the Redis server to save its data to disk,
-        blocking until the save is complete
-        """
-        return self._execute_command_1('SAVE')
+    def _execute_command(self, *args, **options):
+        """Execute the command named by the first of ``args``"""
+        command = lookup_command(args[0])
+        if options:
+            command.check_options(options)
+        return self._execute(command, args[1:], **options)
 
+    #### SERVER INFORMATION ####
     def shutdown(self):
         """Shutdown the server"""
         try:
-            self._execute_command_1('SHUTDOWN')
-        except socket.error:
+            self._execute_command('SHUTDOWN')
+        except error:
             # a socket.error here is expected
             return
         raise RedisError("SHUTDOWN seems to have failed.")
@@ -146,32 +151,18 @@ class RedisClient(core.RedisSocket):
         instance is promoted to a master instead.
         """
         if host is None and port is None:
-            return self._execute_command_3("SLAVEOF", "NO", "ONE")
-        return self._execute_command__3("SLAVEOF", host, port)
+            return self._execute_command('SLAVEOF', 'NO', 'ONE')
+        return self._execute_command('SLAVEOF', host, port)
 
     #### BASIC KEY COMMANDS ####
-    def append(self, key, value):
-        """
-        Appends the string ``value`` to the value at ``key``. If ``key``
-        doesn't already exist, create it with a value of ``value``.
-        Returns the new length of the value at ``key``.
-        """
-        return self._execute_command_3('APPEND', key, value)
-
-    def decr(self, name, amount=1):
+    def exists(self, *names, **options):
         """
-        Decrements the value of ``key`` by ``amount``.  If no key exists,
-        the value will be initialized as 0 - ``amount``
+        Returns a boolean indicating whether key ``name`` exists, or the
+        number of ``names`` that exist when several are given or ``count``
         """
-        return self._execute_command_3('DECRBY', name, amount)
-
-    def exists(self, name):
-        """Returns a boolean indicating whether key ``name`` exists"""
-        return self._execute_command_2('EXISTS', name)
-
-    def expire(self, name, time):
-        """Set an expire flag on key ``name`` for ``time`` seconds"""
-        return self._execute_command_3('EXPIRE', name, time)
+        if len(names) > 1:
+            options['count'] = True
+        return self._execute_command('EXISTS', *names, **options)
 
     def expireat(self, name, when):
         """
@@ -180,42 +171,14 @@ class RedisClient(core.RedisSocket):
         """
         if isinstance(when, datetime.datetime):
             when = int(time.mktime(when.timetuple()))
-        return self._execute_command_3('EXPIREAT', name, when)
-
-    def get(self, name):
-        """
-        Return the value at key ``name``, or None if the key doesn't exist
-        """
-        return self._execute_command_3('GET', name)
-
-    def getbit(self, name, offset):
-        """Returns a boolean indicating the value of ``offset`` in ``name``"""
-        return self._execute_command_3('GETBIT', name, offset)
-
-    def getset(self, name, value):
-        """
-        Set the value at key ``name`` to ``value`` if key doesn't exist
-        Return the value at key ``name`` atomically
-        """
-        return self._execute_command_3('GETSET', name, value)
-
-    def incr(self, name, amount=1):
-        """
-        Increments the value of ``key`` by ``amount``.  If no key exists,
-        the value will be initialized as ``amount``
-        """
-        return self._execute_command_3('INCRBY', name, amount)
-
-    def keys(self, pattern='*'):
-        """Returns a list of keys matching ``pattern``"""
-        return self._execute_command_3('KEYS', pattern)
+        return self._execute_command('EXPIREAT', name, when)
 
     def mget(self, keys, *args):
         """
         Returns a list of values ordered identically to ``keys``
         """
         keys = list_or_args(keys, args)
-        return self.execute_command('MGET', *keys)
+        return self._execute_command('MGET', *keys)
 
     def mset(self, mapping):
         """Sets each key in the ``mapping`` dict to its corresponding value"""
@@ -234,82 +197,63 @@ class RedisClient(core.RedisSocket):
             items.extend(pair)
         return self._execute_command('MSETNX', *items)
 
-    def move(self, name, db):
-        """Moves the key ``name`` to a different Redis database ``db``"""
-        return self._execute_command_3('MOVE', name, db)
-
-    def persist(self, name):
-        """Removes an expiration on ``name``"""
-        return self._execute_command_2('PERSIST', name)
-
-    def randomkey(self):
-        """Returns the name of a random key"""
-        return self._execute_command_1('RANDOMKEY')
-
-    def rename(self, src, dst):
-        """
-        Rename key ``src`` to ``dst``
-        """
-        return self._execute_command_3('RENAME', src, dst)
-
-    def renamenx(self, src, dst):
-        """Rename key ``src`` to ``dst`` if ``dst`` doesn't already exist"""
-        return self._execute_command_3('RENAMENX', src, dst)
-
-    def set(self, name, value):
-        """Set the value at key ``name`` to ``value``"""
-        return self._execute_command_3('SET', name, value)
-
     def setbit(self, name, offset, value):
         """
         Flag the ``offset`` in ``name`` as ``value``. Returns a boolean
         indicating the previous value of ``offset``.
         """
         value = value and 1 or 0
-        return self._execute_command_4('SETBIT', name, offset, value)
+        return self._execute_command('SETBIT', name, offset, value)
 
     def setex(self, name, value, time):
         """
         Set the value of key ``name`` to ``value``
         that expires in ``time`` seconds
         """
-        return self._execute_command_4('SETEX', name, time, value)
-
-    def setnx(self, name, value):
-        """Set the value of key ``name`` to ``value`` if key doesn't exist"""
-        return self._execute_command_4('SETNX', name, value)
+        return self._execute_command('SETEX', name, time, value)
 
-    def setrange(self, name, offset, value):
+    def scan(self, cursor=0, match=None, count=None):
         """
-        Overwrite bytes in the value of ``name`` starting at ``offset`` with
-        ``value``. If ``offset`` plus the length of ``value`` exceeds the
-        length of the original value, the new value will be larger than before.
-        If ``offset`` exceeds the length of the original value, null bytes
-        will be used to pad between the end of the previous value and the start
-        of what's being injected.
-
-        Returns the length of the new string.
+        Return the next cursor and a page of the keys matching ``match``,
+        about ``count`` of them
         """
-        return self._execute_command_4('SETRANGE', name, offset, value)
-
-    def strlen(self, name):
-        """Return the number of bytes stored in the value of ``name``"""
-        return self._execute_command_2('STRLEN', name)
+        pieces = scan_arguments(['SCAN', cursor], match, count)
+        return self._execute_command(*pieces)
 
-    def substr(self, name, start, end=-1):
+    def scan_iter(self, match=None, count=None, prefetch=False):
         """
-        Return a substring of the string at key ``name``. ``start`` and ``end``
-        are 0-based integers specifying the portion of the string to return.
+        Yield the keys matching ``match`` a page of about ``count`` at a
+        time, without blocking the server like ``keys``.  With
+        ``prefetch`` the next page is requested while the current one is
+        being consumed.  A key may be yielded more than once.
         """
-        return self._execute_command_4('SUBSTR', name, start, end)
-
-    def ttl(self, name):
-        """Returns the number of seconds until the key ``name`` will expire"""
-        return self._execute_command_2('TTL', name)
+        return self._scan_iter(self.scan, (), match, count, prefetch)
 
-    def type(self, name):
-        """Returns the type of key ``name``"""
-        return self._execute_command_2('TYPE', name)
+    def _scan_iter(self, scan, args, match, count, prefetch):
+        cursor = 0
+        pending = None
+        try:
+            while True:
+                if pending is not None:
+                    reply = pending.get()
+                    pending = None
+                else:
+                    reply = scan(*args, cursor=cursor, match=match, count=count)
+                if isinstance(reply, RedisError):
+                    raise reply
+                cursor, items = reply
+                if prefetch and cursor:
+                    pending = gevent.spawn(scan, *args, cursor=cursor,
+                                           match=match, count=count)
+                if isinstance(items, dict):
+                    items = items.iteritems()
+                for item in items:
+                    yield item
+                if not cursor:
+                    return
+        finally:
+            if pending is not None:
+                pending.kill(block=False)
 
     def watch(self, *names):
         """
@@ -375,54 +319,14 @@ class RedisClient(core.RedisSocket):
         """
         if timeout is None:
             timeout = 0
-        return self._execute_command_4('BRPOPLPUSH', src, dst, timeout)
-
-    def lindex(self, name, index):
-        """
-        Return the item from list ``name`` at position ``index``
+        return self._execute_command('BRPOPLPUSH', src, dst, timeout)
 
-        Negative indexes are supported and will return an item at the
-        end of the list
+    def lrange_iter(self, name, start=0, end=-1):
         """
-        return self._execute_command_3('LINDEX', name, index)
-
-    def linsert(self, name, where, refvalue, value):
-        """
-        Insert ``value`` in list ``name`` either immediately before or after
-        [``where``] ``refvalue``
-
-        Returns the new length of the list on success or -1 if ``refvalue``
-        is not in the list.
+        Like ``lrange`` but yield the items as they are received, so that
+        huge lists never have to be held in memory at once
         """
-        return self._execute_command('LINSERT', name, where, refvalue, value)
-
-    def llen(self, name):
-        """Return the length of the list ``name``"""
-        return self._execute_command_2('LLEN', name)
-
-    def lpop(self, name):
-        """Remove and return the first item of the list ``name``"""
-        return self._execute_command_2('LPOP', name)
-
-    def lpush(self, name, *values):
-        """Push ``values`` onto the head of the list ``name``"""
-        return self._execute_command('LPUSH', name, *values)
-
-    def lpushx(self, name, value):
-        """
-        Push ``value`` onto the head of the list ``name`` if ``name`` exists
-        """
-        return self._execute_command_3('LPUSHX', name, value)
-
-    def lrange(self, name, start, end):
-        """
-        Return a slice of the list ``name`` between
-        position ``start`` and ``end``
-
-        ``start`` and ``end`` can be negative numbers just like
-        Python slicing notation
-        """
-        return self._execute_command_4('LRANGE', name, start, end)
+        return self._execute_iter_command('LRANGE', name, start, end)
 
     def lrem(self, name, value, num=0):
         """
@@ -430,42 +334,7 @@ class RedisClient(core.RedisSocket):
 
         If ``num`` is 0, then all occurrences will be removed
         """
-        return self._execute_command_4('LREM', name, num, value)
-
-    def lset(self, name, index, value):
-        """Set ``position`` of list ``name`` to ``value``"""
-        return self._execute_command_4('LSET', name, index, value)
-
-    def ltrim(self, name, start, end):
-        """
-        Trim the list ``name``, removing all values not within the slice
-        between ``start`` and ``end``
-
-        ``start`` and ``end`` can be negative numbers just like
-        Python slicing notation
-        """
-        return self._execute_command_4('LTRIM', name, start, end)
-
-    def rpop(self, name):
-        """Remove and return the last item of the list ``name``"""
-        return self._execute_command_2('RPOP', name)
-
-    def rpoplpush(self, src, dst):
-        """
-        RPOP a value off of the ``src`` list and atomically LPUSH it
-        on to the ``dst`` list.  Returns the value.
-        """
-        return self._execute_command_3('RPOPLPUSH', src, dst)
-
-    def rpush(self, name, *values):
-        """Push ``values`` onto the tail of the list ``name``"""
-        return self._execute_command('RPUSH', name, *values)
-
-    def rpushx(self, name, value):
-        """
-        Push ``value`` onto the tail of the list ``name`` if ``name`` exists
-        """
-        return self._execute_command_3('RPUSHX', name, value)
+        return self._execute_command('LREM', name, num, value)
 
     def sort(self, name, start=None, num=None, by=None, get=None,
              desc=False, alpha=False, store=None):
@@ -523,14 +392,6 @@ class RedisClient(core.RedisSocket):
 
 
     #### SET COMMANDS ####
-    def sadd(self, name, *values):
-        """Add ``value(s)`` to set ``name``"""
-        return self._execute_command('SADD', name, *values)
-
-    def scard(self, name):
-        """Return the number of elements in set ``name``"""
-        return self._execute_command_2('SCARD', name)
-
     def sdiff(self, keys, *args):
         """Return the difference of sets specified by ``keys``"""
         keys = list_or_args(keys, args)
@@ -557,31 +418,24 @@ class RedisClient(core.RedisSocket):
         keys = list_or_args(keys, args)
         return self._execute_command('SINTERSTORE', dest, *keys)
 
-    def sismember(self, name, value):
+    def smembers_iter(self, name):
+        """Yield the members of the set ``name`` as they are received"""
+        return self._execute_iter_command('SMEMBERS', name)
+
+    def sscan(self, name, cursor=0, match=None, count=None):
         """
-        Return a boolean indicating if ``value`` is a member of set ``name``
+        Return the next cursor and a page of the members of the set
+        ``name`` matching ``match``
         """
-        return self._execute_command_3('SISMEMBER', name, value)
-
-    def smembers(self, name):
-        """Return all members of the set ``name``"""
-        return self._execute_command_2('SMEMBERS', name)
-
-    def smove(self, src, dst, value):
-        """Move ``value`` from set ``src`` to set ``dst`` atomically"""
-        return self._execute_command_4('SMOVE', src, dst, value)
-
-    def spop(self, name):
-        """Remove and return a random member of set ``name``"""
-        return self._execute_command_2('SPOP', name)
-
-    def srandmember(self, name):
-        """Return a random member of set ``name``"""
-        return self._execute_command_2('SRANDMEMBER', name)
+        pieces = scan_arguments(['SSCAN', name, cursor], match, count)
+        return self._execute_command(*pieces)
 
-    def srem(self, name, *values):
-        """Remove ``values`` from set ``name``"""
-        return self._execute_command('SREM', name, *values)
+    def sscan_iter(self, name, match=None, count=None, prefetch=False):
+        """
+        Yield the members of the set ``name`` matching ``match``, a page at
+        a time (see ``scan_iter``)
+        """
+        return self._scan_iter(self.sscan, (name,), match, count, prefetch)
 
     def sunion(self, keys, *args):
         """Return the union of sets specifiued by ``keys``"""
@@ -603,10 +457,13 @@ class RedisClient(core.RedisSocket):
         For each kwarg in ``pairs``, add that item and it's score to the
         sorted set ``name``.
 
-        The ``value`` and ``score`` arguments are deprecated.
+        ``value`` may also be ScoredMembers, all added at once.  The
+        ``value`` and ``score`` arguments are otherwise deprecated.
         """
         all_pairs = []
-        if value is not None or score is not None:
+        if isinstance(value, ScoredMembers):
+            all_pairs = value.zadd_arguments()
+        elif value is not None or score is not None:
             if value is None or score is None:
                 raise RedisError("Both 'value' and 'score' must be specified " \
                                  "to ZADD")
@@ -620,18 +477,11 @@ class RedisClient(core.RedisSocket):
             all_pairs.append(pair[0])
         return self._execute_command('ZADD', name, *all_pairs)
 
-    def zcard(self, name):
-        """Return the number of elements in the sorted set ``name``"""
-        return self._execute_command_2('ZCARD', name)
-
-    def zcount(self, name, min, max):
-        return self._execute_command_4('ZCOUNT', name, min, max)
-
     def zincrby(self, name, value, amount=1):
         """
         Increment the score of ``value`` in sorted set ``name`` by ``amount``
         """
-        return self._execute_command_4('ZINCRBY', name, amount, value)
+        return self._execute_command('ZINCRBY', name, amount, value)
 
     def zinterstore(self, dest, keys, aggregate=None):
         """
@@ -642,7 +492,7 @@ class RedisClient(core.RedisSocket):
         return self._zaggregate('ZINTERSTORE', dest, keys, aggregate)
 
     def zrange(self, name, start, end, desc=False, withscores=False,
-               score_cast_func=float):
+               score_cast_func=float, compact=False):
         """
         Return a range of values from sorted set ``name`` between
         ``start`` and ``end`` sorted in ascending order.
@@ -655,17 +505,21 @@ class RedisClient(core.RedisSocket):
         The return type is a list of (value, score) pairs
 
         ``score_cast_func`` a callable used to cast the score return value
+
+        ``compact`` returns the values and their scores as ScoredMembers
         """
         if desc:
-            return self.zrevrange(name, start, end, withscores)
+            return self.zrevrange(name, start, end, withscores, score_cast_func, compact)
         pieces = ['ZRANGE', name, start, end]
-        if withscores:
+        if withscores or compact:
             pieces.append('withscores')
-        options = {'withscores': withscores, 'score_cast_func': score_cast_func}
+        options = {'withscores': withscores, 'score_cast_func': score_cast_func,
+                   'compact': compact}
         return self._execute_command(*pieces, **options)
 
     def zrangebyscore(self, name, min, max,
-            start=None, num=None, withscores=False, score_cast_func=float):
+            start=None, num=None, withscores=False, score_cast_func=float,
+            compact=False):
         """
         Return a range of values from the sorted set ``name`` with scores
         between ``min`` and ``max``.
@@ -677,6 +531,8 @@ class RedisClient(core.RedisSocket):
         The return type is a list of (value, score) pairs
 
         `score_cast_func`` a callable used to cast the score return value
+
+        ``compact`` returns the values and their scores as ScoredMembers
         """
         if (start is not None and num is None) or \
                 (num is not None and start is None):
@@ -684,40 +540,14 @@ class RedisClient(core.RedisSocket):
         pieces = ['ZRANGEBYSCORE', name, min, max]
         if start is not None and num is not None:
             pieces.extend(['LIMIT', start, num])
-        if withscores:
+        if withscores or compact:
             pieces.append('withscores')
-        options = {'withscores': withscores, 'score_cast_func': score_cast_func}
+        options = {'withscores': withscores, 'score_cast_func': score_cast_func,
+                   'compact': compact}
         return self._execute_command(*pieces, **options)
 
-    def zrank(self, name, value):
-        """
-        Returns a 0-based value indicating the rank of ``value`` in sorted set
-        ``name``
-        """
-        return self._execute_command_3('ZRANK', name, value)
-
-    def zrem(self, name, *values):
-        """Remove member ``values`` from sorted set ``name``"""
-        return self._execute_command('ZREM', name, *values)
-
-    def zremrangebyrank(self, name, min, max):
-        """
-        Remove all elements in the sorted set ``name`` with ranks between
-        ``min`` and ``max``. Values are 0-based, ordered from smallest score
-        to largest. Values can be negative indicating the highest scores.
-        Returns the number of elements removed
-        """
-        return self._execute_command_4('ZREMRANGEBYRANK', name, min, max)
-
-    def zremrangebyscore(self, name, min, max):
-        """
-        Remove all elements in the sorted set ``name`` with scores
-        between ``min`` and ``max``. Returns the number of elements removed.
-        """
-        return self._execute_command_4('ZREMRANGEBYSCORE', name, min, max)
-
     def zrevrange(self, name, start, num, withscores=False,
-                  score_cast_func=float):
+                  score_cast_func=float, compact=False):
         """
         Return a range of values from sorted set ``name`` between
         ``start`` and ``num`` sorted in descending order.
@@ -728,15 +558,19 @@ class RedisClient(core.RedisSocket):
         The return type is a list of (value, score) pairs
 
         ``score_cast_func`` a callable used to cast the score return value
+
+        ``compact`` returns the values and their scores as ScoredMembers
         """
         pieces = ['ZREVRANGE', name, start, num]
-        if withscores:
+        if withscores or compact:
             pieces.append('withscores')
-        options = {'withscores': withscores, 'score_cast_func': score_cast_func}
+        options = {'withscores': withscores, 'score_cast_func': score_cast_func,
+                   'compact': compact}
         return self._execute_command(*pieces, **options)
 
     def zrevrangebyscore(self, name, max, min,
-            start=None, num=None, withscores=False, score_cast_func=float):
+            start=None, num=None, withscores=False, score_cast_func=float,
+            compact=False):
         """
         Return a range of values from the sorted set ``name`` with scores
         between ``min`` and ``max`` in descending order.
@@ -748,6 +582,8 @@ class RedisClient(core.RedisSocket):
         The return type is a list of (value, score) pairs
 
         ``score_cast_func`` a callable used to cast the score return value
+
+        ``compact`` returns the values and their scores as ScoredMembers
         """
         if (start is not None and num is None) or \
                 (num is not None and start is None):
@@ -755,22 +591,12 @@ class RedisClient(core.RedisSocket):
         pieces = ['ZREVRANGEBYSCORE', name, max, min]
         if start is not None and num is not None:
             pieces.extend(['LIMIT', start, num])
-        if withscores:
+        if withscores or compact:
             pieces.append('withscores')
-        options = {'withscores': withscores, 'score_cast_func': score_cast_func}
+        options = {'withscores': withscores, 'score_cast_func': score_cast_func,
+                   'compact': compact}
         return self._execute_command(*pieces, **options)
 
-    def zrevrank(self, name, value):
-        """
-        Returns a 0-based value indicating the descending rank of
-        ``value`` in sorted set ``name``
-        """
-        return self._execute_command_3('ZREVRANK', name, value)
-
-    def zscore(self, name, value):
-        """Return the score of element ``value`` in sorted set ``name``"""
-        return self._execute_command_3('ZSCORE', name, value)
-
     def zunionstore(self, dest, keys, aggregate=None):
         """
         Union multiple sorted sets specified by ``keys`` into
@@ -794,50 +620,29 @@ class RedisClient(core.RedisSocket):
             pieces.append(aggregate)
         return self._execute_command(*pieces)
 
-    #### HASH COMMANDS ####
-    def hdel(self, name, *keys):
-        """Delete ``keys`` from hash ``name``"""
-        return self._execute_command('HDEL', name, *keys)
-
-    def hexists(self, name, key):
+    def zscan(self, name, cursor=0, match=None, count=None, score_cast_func=float):
         """
-        Returns a boolean indicating if ``key`` exists within hash ``name``
+        Return the next cursor and a page of the (member, score) pairs of
+        the sorted set ``name`` whose member matches ``match``
         """
-        return self._execute_command_3('HEXISTS', name, key)
-
-    def hget(self, name, key):
-        """Return the value of ``key`` within the hash ``name``"""
-        return self._execute_command_3('HGET', name, key)
-
-    def hgetall(self, name):
-        """Return a Python dict of the hash's name/value pairs"""
-        return self._execute_command_2('HGETALL', name)
-
-    def hincrby(self, name, key, amount=1):
-        """Increment the value of ``key`` in hash ``name`` by ``amount``"""
-        return self._execute_command_4('HINCRBY', name, key, amount)
-
-    def hkeys(self, name):
-        """Return the list of keys within hash ``name``"""
-        return self._execute_command_2('HKEYS', name)
+        pieces = scan_arguments(['ZSCAN', name, cursor], match, count)
+        return self._execute_command(*pieces, score_cast_func=score_cast_func)
 
-    def hlen(self, name):
-        """Return the number of elements in hash ``name``"""
-        return self._execute_command_2('HLEN', name)
-
-    def hset(self, name, key, value):
+    def zscan_iter(self, name, match=None, count=None, prefetch=False,
+                   score_cast_func=float):
         """
-        Set ``key`` to ``value`` within hash ``name``
-        Returns 1 if HSET created a new field, otherwise 0
+        Yield the (member, score) pairs of the sorted set ``name`` whose
+        member matches ``match``, a page at a time (see ``scan_iter``)
         """
-        return self._execute_command_4('HSET', name, key, value)
+        def zscan(name, **options):
+            return self.zscan(name, score_cast_func=score_cast_func, **options)
+        return self._scan_iter(zscan, (name,), match, count, prefetch)
 
-    def hsetnx(self, name, key, value):
-        """
-        Set ``key`` to ``value`` within hash ``name`` if ``key`` does not
-        exist.  Returns 1 if HSETNX created a field, otherwise 0.
-        """
-        return self._execute_command_4("HSETNX", name, key, value)
+    #### HASH COMMANDS ####
+    def hgetall_iter(self, name):
+        """Yield the (key, value) pairs of the hash ``name`` as they are received"""
+        items = self._execute_iter_command('HGETALL', name)
+        return izip(items, items)
 
     def hmset(self, name, mapping):
         """
@@ -845,7 +650,7 @@ class RedisClient(core.RedisSocket):
         in the hash ``name``
         """
         if not mapping:
-            raise DataError("'hmset' with 'mapping' of length 0")
+            raise RedisError("'hmset' with 'mapping' of length 0")
         items = []
         for pair in mapping.iteritems():
             items.extend(pair)
@@ -855,16 +660,20 @@ class RedisClient(core.RedisSocket):
         """Returns a list of values ordered identically to ``keys``"""
         return self._execute_command('HMGET', name, *keys)
 
-    def hvals(self, name):
-        """Return the list of values within hash ``name``"""
-        return self._execute_command_2('HVALS', name)
+    def hscan(self, name, cursor=0, match=None, count=None):
+        """
+        Return the next cursor and a dict of a page of the fields of the
+        hash ``name`` matching ``match``
+        """
+        pieces = scan_arguments(['HSCAN', name, cursor], match, count)
+        return self._execute_command(*pieces)
 
-    def publish(self, channel, message):
+    def hscan_iter(self, name, match=None, count=None, prefetch=False):
         """
-        Publish ``message`` on ``channel``.
-        Returns the number of subscribers the message was delivered to.
+        Yield the (field, value) pairs of the hash ``name`` whose field
+        matches ``match``, a page at a time (see ``scan_iter``)
         """
-        return self._execute_command_3('PUBLISH', channel, message)
+        return self._scan_iter(self.hscan, (name,), match, count, prefetch)
 
     def psubscribe(self, patterns):
         """Subscribe to all channels matching any pattern in ``patterns``"""
@@ -880,24 +689,457 @@ class RedisClient(core.RedisSocket):
             patterns = [patterns]
         return self._execute_command('PUNSUBSCRIBE', *patterns)
 
-    def subscribe(self, patterns):
-        """Subscribe to all channels matching any pattern in ``patterns``"""
-        if isinstance(patterns, basestring):
-            patterns = [patterns]
-        return self._execute_yield_command('SUBSCRIBE', *patterns)
+    def subscribe(self, channels):
+        """Subscribe to all the channels in ``channels``"""
+        if isinstance(channels, basestring):
+            channels = [channels]
+        return self._execute_yield_command('SUBSCRIBE', *channels)
 
-    def unsubscribe(self, patterns):
-        """
-        Unsubscribe from any channel matching any pattern in ``patterns``.
-        """
-        if isinstance(patterns, basestring):
-            patterns = [patterns]
-        return self._execute_command('UNSUBSCRIBE', *patterns)
+    def unsubscribe(self, channels):
+        """Unsubscribe from all the channels in ``channels``"""
+        if isinstance(channels, basestring):
+            channels = [channels]
+        return self._execute_command('UNSUBSCRIBE', *channels)
 
     def monitor(self):
         """Monitor to all commands in redis server"""
         return self._execute_yield_command('MONITOR')
 
+
+class RedisClient(RedisCommands):
+    """An gevent Redis client.
+
+    Example usage::
+
+        import geventredis
+
+        redis_client = geventredis.RedisClient('127.0.0.1', 6379)
+        result = redis_client.get('foo')
+        print result
+
+    This class implements a Redis client on top of Gevent Socket.
+    It does not currently implement all applicable parts of the Redis
+    specification, but it does enough to work with major redis server APIs
+    (mostly tested against the LIST/HASH/PUBSUB API so far).
+
+    Each command checks a connection out of ``connection_pool`` for the
+    duration of its round trip, so one client can be shared by many
+    greenlets.  Commands that stream replies forever (``monitor``,
+    ``subscribe``...) use a dedicated connection, closed when the returned
+    generator is.
+
+    Given an Instrumentation, the client reports the latency, bytes and
+    errors of every round trip to it (see geventredis.instrumentation).
+    Given a Codec, it serializes the values it writes and deserializes the
+    ones it reads, compressing the large ones with CompressedCodec (see
+    geventredis.codec).
+
+    ``timeout`` applies to each socket operation, while ``command_timeout``
+    bounds whole commands and pipelines, waiting for a pooled connection
+    included, and raises RedisTimeoutError when exceeded; ``with_timeout``
+    returns a client sharing this one's pool with another bound, for a
+    single call.  A connection interrupted in the middle of a reply is
+    closed rather than returned to the pool.  Readonly commands failing
+    with socket.error are tried again up to ``retries`` times within their
+    deadline, after the reconnection backoff of the pool if any.
+    Blocking commands (BLPOP, BRPOP, BRPOPLPUSH) get their own timeout
+    added to ``command_timeout``, and are not bounded when it is 0, since
+    abandoning one while the server still waits would lose the element it
+    pops.  Streaming commands are not bounded nor retried.
+    """
+
+    def __init__(self, host='localhost', port=6379, timeout=None,
+                 connection_pool=None, multiplex=False, instrumentation=None,
+                 command_timeout=None, retries=0, codec=None, **pool_options):
+        if connection_pool is None:
+            if multiplex:
+                pool_class = MultiplexedConnectionPool
+            else:
+                pool_class = ConnectionPool
+            connection_pool = pool_class(host, port, timeout, **pool_options)
+        self.connection_pool = connection_pool
+        self.instrumentation = instrumentation
+        self.command_timeout = command_timeout
+        self.retries = retries
+        self.codec = codec
+
+    def with_timeout(self, command_timeout):
+        """
+        Return a client sharing the connections of this one whose commands
+        must complete within ``command_timeout`` seconds, e.g.
+        ``redis_client.with_timeout(0.05).get('foo')``
+        """
+        redis_client = copy.copy(self)
+        redis_client.command_timeout = command_timeout
+        return redis_client
+
+    def pipeline(self, transaction=False):
+        """
+        Return a new Pipeline that buffers commands issued on it and sends
+        them to the server in a single write when ``execute`` is called,
+        wrapped in MULTI/EXEC if ``transaction``.
+        """
+        return Pipeline(self, transaction)
+
+    def transaction(self, func, *watches, **options):
+        """
+        Call ``func`` with a transactional Pipeline watching the keys
+        ``watches``, then execute the pipeline and return its replies.
+
+        ``func`` reads with the pipeline, whose commands run immediately
+        until it calls ``multi``, then queues the writes.  When a watched
+        key changes before EXEC, it is called again on a new pipeline,
+        after a random sleep of up to ``backoff`` seconds doubling with
+        each attempt, and WatchError is raised after ``max_retries``
+        retries.
+        """
+        max_retries = options.pop('max_retries', 10)
+        backoff = options.pop('backoff', 0.001)
+        if options:
+            raise TypeError('Unexpected options %s' % ', '.join(options))
+        attempt = 0
+        while True:
+            with self.pipeline(True) as pipe:
+                if watches:
+                    pipe.watch(*watches)
+                func(pipe)
+                try:
+                    return pipe.execute()
+                except WatchError:
+                    if attempt == max_retries:
+                        raise
+            attempt += 1
+            gevent.sleep(random.uniform(0, backoff * 2 ** min(attempt, 10)))
+
+    def register_script(self, script):
+        """
+        Return a Script running the Lua ``script`` with EVALSHA, which the
+        connection pool loads on each of its connections
+        """
+        script = Script(self, script)
+        self.connection_pool.scripts[script.sha] = script.script
+        return script
+
+    def pubsub(self, queue=None):
+        """
+        Return a new PubSub, whose subscriptions share a dedicated
+        connection and can be changed while it is being read
+        """
+        return PubSub(self.connection_pool, queue)
+
+    def _execute(self, command, args, **options):
+        codec = self.codec
+        if codec is not None:
+            args = codec.encode_arguments(command, args)
+        if self.command_timeout is not None or self.retries:
+            timeout = self.command_timeout
+            if timeout is not None and 'blocking' in command.flags:
+                # the server holds the reply for up to the timeout of the
+                # command, the last argument, and 0 blocks for ever
+                block = float(args[-1])
+                timeout = timeout + block if block else None
+            result = self._execute_bounded(command.name, command.pack(args), None,
+                                           command.readonly, timeout)
+            return parse_reply(command, result, options, codec)
+        if self.instrumentation is not None:
+            result = self._execute_instrumented(command.name, command.pack(args), None)
+            return parse_reply(command, result, options, codec)
+        pool = self.connection_pool
+        connection = pool.get_connection()
+        try:
+            result = connection._execute_packed(command.pack(args))
+        except:
+            pool.discard(connection)
+            raise
+        pool.release(connection)
+        return parse_reply(command, result, options, codec)
+
+    def _execute_bounded(self, name, buffers, count, idempotent, timeout):
+        """
+        ``_execute_packed`` within ``timeout`` seconds, retrying idempotent
+        commands on socket errors
+        """
+        retries = self.retries if idempotent else 0
+        exception = RedisTimeoutError('%s did not complete within %ss' % (name, timeout))
+        with gevent.Timeout(timeout, exception):
+            attempt = 0
+            while True:
+                try:
+                    if self.instrumentation is not None:
+                        return self._execute_instrumented(name, buffers, count)
+                    return self._execute_round_trip(buffers, count)
+                except error:
+                    if attempt == retries:
+                        raise
+                    attempt += 1
+                    gevent.sleep(self.connection_pool.retry_delay())
+
+    def _execute_packed(self, buffers, count):
+        if self.command_timeout is not None:
+            return self._execute_bounded('PIPELINE', buffers, count, False,
+                                         self.command_timeout)
+        if self.instrumentation is not None:
+            return self._execute_instrumented('PIPELINE', buffers, count)
+        return self._execute_round_trip(buffers, count)
+
+    def _execute_round_trip(self, buffers, count):
+        pool = self.connection_pool
+        connection = pool.get_connection()
+        try:
+            result = connection._execute_packed(buffers, count)
+        except:
+            pool.discard(connection)
+            raise
+        pool.release(connection)
+        return result
+
+    def _execute_instrumented(self, name, buffers, count):
+        """``_execute_packed`` reporting to the instrumentation"""
+        instrumentation = self.instrumentation
+        pool = self.connection_pool
+        bytes_sent = sum([len(buf) for buf in buffers])
+        start = instrumentation.start(name, bytes_sent)
+        checked_out = bytes_received = result = None
+        try:
+            connection = pool.get_connection()
+            checked_out = instrumentation.checked_out(start)
+            received = getattr(connection, 'bytes_received', None)
+            try:
+                result = connection._execute_packed(buffers, count)
+            except:
+                pool.discard(connection)
+                raise
+            pool.release(connection)
+            if received is not None:
+                bytes_received = connection.bytes_received - received
+        except:
+            # GreenletExit and the gevent.Timeout of a caller included,
+            # or the gauges of the instrumentation would leak
+            instrumentation.finish(name, start, checked_out, bytes_sent, bytes_received,
+                                   None, sys.exc_info()[1])
+            raise
+        instrumentation.finish(name, start, checked_out, bytes_sent, bytes_received, result)
+        return result
+
+    def _execute_iter_command(self, *args):
+        if self.instrumentation is not None:
+            return self._execute_iter_instrumented(args)
+        return self._execute_iter(args)
+
+    def _execute_iter_instrumented(self, args):
+        instrumentation = self.instrumentation
+        command = lookup_command(args[0])
+        name = command.name
+        bytes_sent = sum([len(buf) for buf in command.pack(args[1:])])
+        start = instrumentation.start(name, bytes_sent)
+        checked_out = bytes_received = None
+        try:
+            connection = self.connection_pool.get_connection()
+            checked_out = instrumentation.checked_out(start)
+            received = getattr(connection, 'bytes_received', None)
+            for result in self._execute_iter(args, connection):
+                yield result
+            if received is not None:
+                bytes_received = connection.bytes_received - received
+        except GeneratorExit:
+            instrumentation.finish(name, start, checked_out, bytes_sent, None, None)
+            raise
+        except:
+            instrumentation.finish(name, start, checked_out, bytes_sent, bytes_received,
+                                   None, sys.exc_info()[1])
+            raise
+        instrumentation.finish(name, start, checked_out, bytes_sent, bytes_received, None)
+
+    def _execute_iter(self, args, connection=None):
+        pool = self.connection_pool
+        if connection is None:
+            connection = pool.get_connection()
+        try:
+            for result in connection._execute_iter_command(*args):
+                yield result
+        except:
+            # includes the generator being closed before the end of the
+            # reply, which leaves unread elements on the connection
+            pool.discard(connection)
+            raise
+        pool.release(connection)
+
+    def _execute_yield_command(self, *args):
+        connection = self.connection_pool.make_connection()
+        try:
+            for result in connection._execute_yield_command(*args):
+                yield result
+        finally:
+            connection.close()
+
+
+class Pipeline(RedisCommands):
+    """Buffers commands and executes them in one round trip.
+
+    Example usage::
+
+        pipe = redis_client.pipeline()
+        pipe.lpush('list', 'a').hset('hash', 'field', 'value')
+        print pipe.execute()
+
+    Every command method returns the pipeline itself so calls can be
+    chained.  ``execute`` writes all the buffered commands at once, reads
+    one reply per command and returns them in order.  Error replies are
+    returned in place as RedisError instances.
+
+    With ``transaction`` the commands are wrapped in MULTI and EXEC, in
+    the same write, and the replies are taken from the reply of EXEC.
+    ``watch`` checks a connection out and keeps it until ``execute`` or
+    ``reset``: commands run immediately on it and return their reply,
+    until ``multi`` starts buffering the transaction.  ``execute`` raises
+    WatchError if a watched key changed meanwhile.  See also
+    RedisClient.transaction.
+    """
+
+    def __init__(self, redis_client, transaction=False):
+        self.redis_client = redis_client
+        self.transaction = transaction
+        # the wrappers of a client (cache, replicas) have no codec
+        self.codec = getattr(redis_client, 'codec', None)
+        self.command_stack = []
+        self.connection = None
+        self.explicit_multi = False
+
+    def __len__(self):
+        return len(self.command_stack)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+    def reset(self):
+        """Discard all the buffered commands and the watches"""
+        self.command_stack = []
+        self.explicit_multi = False
+        if self.connection is not None:
+            try:
+                self._immediate(COMMANDS['UNWATCH'], (), {})
+            except error:
+                # the connection is already discarded
+                return
+            self._release()
+
+    def _checkout(self):
+        pool = self.redis_client.connection_pool
+        if isinstance(pool, MultiplexedConnectionPool):
+            # the watches must not be shared with other greenlets
+            return pool.make_connection()
+        return pool.get_connection()
+
+    def _release(self, discard=False):
+        connection = self.connection
+        self.connection = None
+        pool = self.redis_client.connection_pool
+        if isinstance(pool, MultiplexedConnectionPool):
+            connection.close()
+        elif discard:
+            pool.discard(connection)
+        else:
+            pool.release(connection)
+
+    def _immediate(self, command, args, options):
+        """Execute a command on the connection kept by ``watch``"""
+        try:
+            result = self.connection._execute_packed(command.pack(args))
+        except:
+            self._release(discard=True)
+            raise
+        return parse_reply(command, result, options, self.codec)
+
+    def watch(self, *names):
+        """
+        Watch the keys ``names``: the transaction fails if any of them is
+        modified before it is executed
+        """
+        if self.explicit_multi:
+            raise RedisError('WATCH must be called before MULTI')
+        if self.connection is None:
+            self.connection = self._checkout()
+        return self._immediate(COMMANDS['WATCH'], names, {})
+
+    def unwatch(self):
+        """Forget the watched keys and give the connection back"""
+        if self.connection is None:
+            return True
+        result = self._immediate(COMMANDS['UNWATCH'], (), {})
+        self._release()
+        return result
+
+    def multi(self):
+        """Start buffering the commands of the transaction after ``watch``"""
+        if self.explicit_multi:
+            raise RedisError('MULTI calls cannot be nested')
+        if self.command_stack:
+            raise RedisError('MULTI must be called before any command is buffered')
+        self.explicit_multi = True
+
+    def execute(self):
+        """Send all the buffered commands and return the list of replies"""
+        stack = self.command_stack
+        if self.transaction or self.explicit_multi or self.connection is not None:
+            return self._execute_transaction(stack)
+        if not stack:
+            return []
+        self.command_stack = []
+        buffers = []
+        for _, packed, _ in stack:
+            buffers.extend(packed)
+        results = self.redis_client._execute_packed(buffers, len(stack))
+        codec = self.codec
+        return [parse_reply(command, result, options, codec)
+                for (command, _, options), result in izip(stack, results)]
+
+    def _execute_transaction(self, stack):
+        self.command_stack = []
+        self.explicit_multi = False
+        buffers = list(MULTI)
+        for _, packed, _ in stack:
+            buffers.extend(packed)
+        buffers.extend(EXEC)
+        count = len(stack) + 2
+        if self.connection is None:
+            replies = self.redis_client._execute_packed(buffers, count)
+        else:
+            try:
+                replies = self.connection._execute_packed(buffers, count)
+            except:
+                self._release(discard=True)
+                raise
+            # EXEC forgets the watches
+            self._release()
+        result = replies[-1]
+        if result is None:
+            raise WatchError('Watched keys changed, transaction aborted')
+        if isinstance(result, RedisError):
+            # EXECABORT: the commands that could not be queued have their
+            # own error, the others get the one of EXEC
+            return [reply if isinstance(reply, RedisError) else result
+                    for reply in replies[1:-1]]
+        codec = self.codec
+        return [parse_reply(command, reply, options, codec)
+                for (command, _, options), reply in izip(stack, result)]
+
+    def _execute(self, command, args, **options):
+        if self.codec is not None:
+            args = self.codec.encode_arguments(command, args)
+        if self.connection is not None and not self.explicit_multi:
+            return self._immediate(command, args, options)
+        self.command_stack.append((command, command.pack(args), options))
+        return self
+
+    def _execute_yield_command(self, *args):
+        raise RedisError('%s cannot be pipelined' % args[0])
+
+    _execute_iter_command = _execute_yield_command
+
+
 def test():
     redis_client = connect('127.0.0.1', 6379)
     print redis_client.set('foo', 'bar')
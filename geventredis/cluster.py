@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Redis Cluster client following the slot map of the cluster"""
+
+import random
+from itertools import izip
+
+import gevent
+from gevent.socket import error
+
+from geventredis.client import RedisClient, RedisCommands, parse_reply
+from geventredis.commands import lookup_command
+from geventredis.sharded import SPLIT_COMMANDS, hash_tag
+from geventredis.wire_protocol import RedisError, encode, pack_command
+
+SLOT_COUNT = 16384
+
+ASKING = pack_command('ASKING')
+
+
+def _make_crc16_table():
+    table = []
+    for byte in xrange(256):
+        crc = byte << 8
+        for _ in xrange(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xffff
+            else:
+                crc = (crc << 1) & 0xffff
+        table.append(crc)
+    return table
+
+CRC16_TABLE = _make_crc16_table()
+
+def crc16(data):
+    """CRC16-CCITT (XModem) of ``data``, the checksum of cluster slots"""
+    crc = 0
+    table = CRC16_TABLE
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xff00) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+def key_slot(key):
+    """Return the cluster slot of ``key``, honouring its {tag}"""
+    return crc16(hash_tag(encode(key))) % SLOT_COUNT
+
+def parse_redirect(reply):
+    """
+    Return ('MOVED' or 'ASK', slot, (host, port)) if ``reply`` is a
+    redirection error, None otherwise
+    """
+    if not isinstance(reply, RedisError):
+        return None
+    parts = str(reply).split()
+    if len(parts) != 3 or parts[0] not in ('MOVED', 'ASK'):
+        return None
+    host, _, port = parts[2].rpartition(':')
+    return parts[0], int(parts[1]), (host, int(port))
+
+
+class RedisClusterClient(RedisCommands):
+    """A client of a Redis Cluster.
+
+    Example usage::
+
+        redis_client = RedisClusterClient([('127.0.0.1', 7000),
+                                           ('127.0.0.1', 7001)])
+        redis_client.set('foo', 'bar')
+
+    The slot map is loaded with CLUSTER SLOTS from the first of the known
+    nodes that answers, into a table of the master of each of the 16384
+    slots, and the slot of each key is computed locally.  Each master gets
+    a RedisClient of its own, built with ``timeout`` and ``pool_options``.
+
+    A MOVED reply updates the slot in the table, retries the command on
+    the new node and schedules a reload of the whole map in the background;
+    an ASK reply retries the command once on the node it names, preceded
+    by ASKING.  RedisError is raised after ``max_redirects`` redirections.
+
+    Commands whose keys are in different slots raise RedisError, except
+    MGET, MSET and DEL, which are split per slot: the parts for the same
+    node are pipelined in one round trip, the nodes are queried
+    concurrently, and the replies are merged back in the order of the
+    keys.  Commands without keys are sent to any node.  Streaming commands
+    (``lrange_iter``, ``subscribe``...) go to the node of their key but do
+    not follow redirections.
+    """
+
+    def __init__(self, startup_nodes, timeout=None, max_redirects=5, **pool_options):
+        self.startup_nodes = [(host, int(port)) for host, port in startup_nodes]
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.pool_options = pool_options
+        self.clients = {}
+        self.slots = [None] * SLOT_COUNT
+        self._refresher = None
+        self.refresh_slots()
+
+    def get_node_client(self, node):
+        """Return the RedisClient of ``node``, a (host, port) tuple"""
+        client = self.clients.get(node)
+        if client is None:
+            client = RedisClient(node[0], node[1], self.timeout, **self.pool_options)
+            self.clients[node] = client
+        return client
+
+    def refresh_slots(self):
+        """Reload the slot map from the first known node that answers"""
+        nodes = list(self.clients)
+        nodes.extend([node for node in self.startup_nodes if node not in self.clients])
+        last_error = None
+        for node in nodes:
+            try:
+                ranges = self.get_node_client(node).cluster_slots()
+            except error, e:
+                last_error = e
+                continue
+            if isinstance(ranges, RedisError):
+                last_error = ranges
+                continue
+            slots = [None] * SLOT_COUNT
+            for slot_range in ranges:
+                start, end, master = slot_range[:3]
+                # the node answering may not know its own address
+                master = (master[0] or node[0], int(master[1]))
+                slots[start:end + 1] = [master] * (end - start + 1)
+            self.slots = slots
+            return
+        raise RedisError('No cluster node could return the slot map: %s' % last_error)
+
+    def _schedule_refresh(self):
+        refresher = self._refresher
+        if refresher is None or refresher.ready():
+            self._refresher = gevent.spawn(self._background_refresh)
+
+    def _background_refresh(self):
+        try:
+            self.refresh_slots()
+        except RedisError:
+            # the next MOVED or socket error tries again
+            pass
+
+    def _node_for(self, slot):
+        node = self.slots[slot]
+        if node is None:
+            self.refresh_slots()
+            node = self.slots[slot]
+            if node is None:
+                raise RedisError('Slot %d is not served by any node' % slot)
+        return node
+
+    def _route(self, command, args):
+        """Return the slot of the keys of ``args``, None if there are none"""
+        keys = command.keys(args)
+        if not keys:
+            return None
+        slot = key_slot(keys[0])
+        for key in keys[1:]:
+            if key_slot(key) != slot:
+                raise RedisError("CROSSSLOT %s keys don't hash to the same slot" % command.name)
+        return slot
+
+    def _execute(self, command, args, **options):
+        merge = SPLIT_COMMANDS.get(command.name)
+        if merge is None:
+            slot = self._route(command, args)
+            if slot is None:
+                client = random.choice(self.clients.values())
+                return client._execute(command, args, **options)
+            return self._execute_slot(slot, command, args, options)
+        # group the keys, along with their values for MSET, by slot
+        first, _, step = command.key_spec
+        slots = {}
+        for position, index in enumerate(xrange(first, len(args), step)):
+            slot = key_slot(args[index])
+            group = slots.get(slot)
+            if group is None:
+                group = slots[slot] = (slot, [], [])
+            group[1].append(position)
+            group[2].extend(args[index:index + step])
+        if not slots:
+            raise RedisError('%s needs at least one key' % command.name)
+        if len(slots) == 1:
+            return self._execute_slot(slot, command, args, options)
+        batches = {}
+        for group in slots.itervalues():
+            batches.setdefault(self._node_for(group[0]), []).append(group)
+        greenlets = [gevent.spawn(self._execute_batch, node, command, batch, options)
+                     for node, batch in batches.iteritems()]
+        gevent.joinall(greenlets, raise_error=True)
+        parts = []
+        for greenlet in greenlets:
+            parts.extend(greenlet.value)
+        for _, reply in parts:
+            if isinstance(reply, RedisError):
+                return reply
+        return merge(parts, position + 1)
+
+    def _execute_batch(self, node, command, batch, options):
+        """
+        Pipeline the per slot parts of a split command to ``node``, and
+        return their (positions, reply)
+        """
+        buffers = []
+        for _, _, slot_args in batch:
+            buffers.extend(command.pack(slot_args))
+        try:
+            replies = self.get_node_client(node)._execute_packed(buffers, len(batch))
+        except error:
+            self._schedule_refresh()
+            raise
+        parts = []
+        for (slot, positions, slot_args), reply in izip(batch, replies):
+            if parse_redirect(reply) is not None:
+                reply = self._execute_slot(slot, command, slot_args, options, reply)
+            else:
+                reply = parse_reply(command, reply, options)
+            parts.append((positions, reply))
+        return parts
+
+    def _execute_slot(self, slot, command, args, options, reply=None):
+        """
+        Send a command to the node of ``slot`` and follow its redirections,
+        starting from ``reply`` if it already got one
+        """
+        packed = command.pack(args)
+        redirects = 0
+        try:
+            while True:
+                if reply is None:
+                    client = self.get_node_client(self._node_for(slot))
+                    reply = client._execute_packed(packed, None)
+                redirect = parse_redirect(reply)
+                if redirect is None:
+                    return parse_reply(command, reply, options)
+                if redirects == self.max_redirects:
+                    raise RedisError('Too many cluster redirections, last one: %s' % reply)
+                redirects += 1
+                kind, moved_slot, node = redirect
+                client = self.get_node_client(node)
+                if kind == 'ASK':
+                    reply = client._execute_packed(ASKING + packed, 2)[1]
+                else:
+                    self.slots[moved_slot] = node
+                    self._schedule_refresh()
+                    reply = client._execute_packed(packed, None)
+        except error:
+            self._schedule_refresh()
+            raise
+
+    def _client_for(self, args):
+        slot = self._route(lookup_command(args[0]), args[1:])
+        if slot is None:
+            return random.choice(self.clients.values())
+        return self.get_node_client(self._node_for(slot))
+
+    def _execute_iter_command(self, *args):
+        return self._client_for(args)._execute_iter_command(*args)
+
+    def _execute_yield_command(self, *args):
+        return self._client_for(args)._execute_yield_command(*args)
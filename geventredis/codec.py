@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Serialization and compression of the values stored by a RedisClient"""
+
+import cPickle
+import json
+import marshal
+import zlib
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+from geventredis.wire_protocol import RedisError, encode
+
+# Positions of the values among the arguments of the commands writing
+# them, as (first, last, step) like the key positions of the command table
+VALUE_ARGUMENTS = {
+    'SET': (1, 1, 1),
+    'SETNX': (1, 1, 1),
+    'GETSET': (1, 1, 1),
+    'SETEX': (2, 2, 1),
+    'MSET': (1, -1, 2),
+    'MSETNX': (1, -1, 2),
+    'LPUSH': (1, -1, 1),
+    'RPUSH': (1, -1, 1),
+    'LPUSHX': (1, 1, 1),
+    'RPUSHX': (1, 1, 1),
+    'LSET': (2, 2, 1),
+    'LINSERT': (2, 3, 1),
+    'LREM': (2, 2, 1),
+    'HSET': (2, 2, 1),
+    'HSETNX': (2, 2, 1),
+    'HMSET': (2, -1, 2),
+}
+
+def decode_bulk(decode, reply):
+    if reply is None:
+        return None
+    return decode(reply)
+
+def decode_list(decode, reply):
+    if reply is None:
+        return None
+    return [None if value is None else decode(value) for value in reply]
+
+def decode_popped(decode, reply):
+    # [list name, value] of BLPOP and BRPOP
+    if reply is None:
+        return None
+    return [reply[0], decode(reply[1])]
+
+def decode_pairs(decode, reply):
+    # [field, value...] of HGETALL
+    reply = list(reply)
+    reply[1::2] = [decode(value) for value in reply[1::2]]
+    return reply
+
+# How to decode the values in the reply of the commands reading them
+DECODED_REPLIES = {
+    'GET': decode_bulk,
+    'GETSET': decode_bulk,
+    'LINDEX': decode_bulk,
+    'LPOP': decode_bulk,
+    'RPOP': decode_bulk,
+    'RPOPLPUSH': decode_bulk,
+    'BRPOPLPUSH': decode_bulk,
+    'HGET': decode_bulk,
+    'MGET': decode_list,
+    'LRANGE': decode_list,
+    'HMGET': decode_list,
+    'HVALS': decode_list,
+    'BLPOP': decode_popped,
+    'BRPOP': decode_popped,
+    'HGETALL': decode_pairs,
+}
+
+
+class Codec(object):
+    """Converts values to the bytes stored in Redis and back.
+
+    Example usage::
+
+        codec = CompressedCodec(JSONCodec(), threshold=1024)
+        redis_client = geventredis.connect('127.0.0.1', 6379, codec=codec)
+        redis_client.set('session:1', {'user': 42, 'cart': [...]})
+        print redis_client.get('session:1')['user']
+
+    A RedisClient given a codec encodes the values written by the string,
+    list and hash commands (SET, MSET, LPUSH, HSET... per VALUE_ARGUMENTS)
+    and decodes the values of their replies (GET, MGET, LRANGE,
+    HGETALL... per DECODED_REPLIES); keys, hash fields, set and sorted set
+    members are left alone.  Pipelines and transactions of the client use
+    it too, but not the streamed replies of ``lrange_iter`` or
+    ``hgetall_iter``, nor replies read with ``raw=True``.  Values compared
+    by the server (LREM, LINSERT) must encode to the same bytes each time.
+
+    This base codec stores values as the client does without one, and
+    subclasses override ``dumps`` and ``loads``.
+    """
+
+    def dumps(self, value):
+        return encode(value)
+
+    def loads(self, data):
+        return data
+
+    def encode_arguments(self, command, args):
+        """Return ``args`` of ``command`` with their values encoded"""
+        spec = VALUE_ARGUMENTS.get(command.name)
+        if spec is None:
+            return args
+        first, last, step = spec
+        args = list(args)
+        stop = last + 1 or None
+        args[first:stop:step] = [self.dumps(value) for value in args[first:stop:step]]
+        return args
+
+    def decode_reply(self, command, reply):
+        """Return the reply of ``command`` with its values decoded"""
+        decoder = DECODED_REPLIES.get(command.name)
+        if decoder is None:
+            return reply
+        return decoder(self.loads, reply)
+
+
+class PickleCodec(Codec):
+    """Pickles values, which must then only be read from trusted servers"""
+
+    def __init__(self, protocol=cPickle.HIGHEST_PROTOCOL):
+        self.protocol = protocol
+
+    def dumps(self, value):
+        return cPickle.dumps(value, self.protocol)
+
+    def loads(self, data):
+        return cPickle.loads(data)
+
+
+class JSONCodec(Codec):
+    """Stores values as compact JSON"""
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':'))
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class MarshalCodec(Codec):
+    """Stores values with marshal, fast but bound to the Python version"""
+
+    def dumps(self, value):
+        return marshal.dumps(value)
+
+    def loads(self, data):
+        return marshal.loads(data)
+
+# Values compressed by CompressedCodec start with 0xff and a letter naming
+# the algorithm, and values that start with 0xff but are not compressed
+# get a 0xff 0x00 header, so any value can be told apart
+HEADER = '\xff'
+STORED = '\xff\x00'
+ZLIB = '\xffz'
+LZ4 = '\xffl'
+
+
+class CompressedCodec(Codec):
+    """Compresses the values of another codec above a size.
+
+    The values that ``codec`` (a plain Codec by default) encodes into at
+    least ``threshold`` bytes are compressed with ``compressor``, 'zlib'
+    at ``level`` or 'lz4' if the lz4 package is installed, and stored with
+    a header naming the algorithm, unless that does not make them
+    smaller.  Smaller values are stored as they are, so data written with
+    and without compression, or by another algorithm, reads back alike;
+    values written without the codec must not start with 0xff, which
+    UTF-8 text, JSON and pickles never do.
+    """
+
+    def __init__(self, codec=None, threshold=1024, compressor='zlib', level=6):
+        if compressor == 'lz4':
+            if lz4 is None:
+                raise RedisError('lz4 is not installed')
+            self._header = LZ4
+            self._compress = lz4.compress
+        elif compressor == 'zlib':
+            self._header = ZLIB
+            self._compress = lambda data: zlib.compress(data, level)
+        else:
+            raise ValueError('Unknown compressor %r' % compressor)
+        self.codec = codec or Codec()
+        self.threshold = threshold
+
+    def dumps(self, value):
+        data = self.codec.dumps(value)
+        if len(data) >= self.threshold:
+            compressed = self._compress(data)
+            if len(compressed) + 2 < len(data):
+                return self._header + compressed
+        if data[:1] == HEADER:
+            return STORED + data
+        return data
+
+    def loads(self, data):
+        if data[:1] == HEADER:
+            header = data[:2]
+            if header == ZLIB:
+                data = zlib.decompress(data[2:])
+            elif header == STORED:
+                data = data[2:]
+            elif header == LZ4:
+                if lz4 is None:
+                    raise RedisError('lz4 is not installed')
+                data = lz4.decompress(data[2:])
+        return self.codec.loads(data)
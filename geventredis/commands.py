@@ -0,0 +1,668 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""The table of Redis commands and the client methods generated from it"""
+
+import datetime
+import inspect
+from collections import Mapping
+from itertools import izip
+
+from geventredis.wire_protocol import pack_arguments
+from geventredis.zset import ScoredMembers
+
+# Key positions as (first, last, step) over the arguments of a command,
+# ``last`` counting from the end when negative
+FIRST_KEY = (0, 0, 1)
+TWO_KEYS = (0, 1, 1)
+ALL_KEYS = (0, -1, 1)
+KEYS_BUT_LAST = (0, -2, 1)
+KEY_VALUE_PAIRS = (0, -1, 2)
+
+class Command(object):
+    """Metadata of a Redis command.
+
+    ``arity`` follows the convention of the Redis COMMAND command: the
+    number of words including the command name, negative when it is a
+    minimum.  ``flags`` is a set among 'readonly', 'write', 'admin',
+    'pubsub', 'blocking' and 'movablekeys' (key positions that ``keys``
+    does not describe).  ``callback`` converts the reply, unless it is an
+    error, and ``options`` are the keyword arguments it understands, along
+    with ``raw``.
+
+    The packed header of the command name is computed once, along with the
+    whole ``*N`` header when the arity is fixed.
+    """
+
+    def __init__(self, name, flags='', arity=-1, keys=FIRST_KEY, callback=None):
+        words = name.split()
+        self.name = name
+        self.flags = frozenset(flags.split())
+        self.arity = arity
+        self.key_spec = keys
+        self.callback = callback
+        self.options = callback_options(callback)
+        self.readonly = 'readonly' in self.flags
+        self.name_header = ''.join(['$%d\r\n%s\r\n' % (len(word), word) for word in words])
+        self.word_count = len(words)
+        if arity > 0:
+            self.header = '*%d\r\n%s' % (arity, self.name_header)
+        else:
+            self.header = None
+
+    def __repr__(self):
+        return 'Command(%r)' % self.name
+
+    def pack(self, args):
+        """Pack the command with ``args``, as a list of buffers"""
+        header = self.header
+        if header is None or len(args) != self.arity - self.word_count:
+            header = '*%d\r\n%s' % (self.word_count + len(args), self.name_header)
+        return pack_arguments(header, args)
+
+    def keys(self, args):
+        """Return the keys among ``args``"""
+        if self.key_spec is None:
+            return []
+        first, last, step = self.key_spec
+        return list(args[first:last + 1 or None:step])
+
+    def check_options(self, options):
+        """Raise TypeError for the ``options`` the callback does not take"""
+        for name in options:
+            if name not in self.options:
+                raise TypeError('%s got an unexpected keyword argument %r'
+                                % (self.name, name))
+
+def callback_options(callback):
+    """The names of the keyword arguments of ``callback``, and ``raw``"""
+    options = set(['raw'])
+    if callback is not None:
+        args = inspect.getargspec(callback).args
+        options.update(args[1:])
+    return frozenset(options)
+
+def parse_bool(reply, **options):
+    return bool(reply)
+
+def parse_exists(reply, count=False, **options):
+    """Return the number of keys EXISTS found if ``count``, else a bool"""
+    if count:
+        return reply
+    return bool(reply)
+
+def parse_scan(reply, **options):
+    """Return the next cursor and the items of a SCAN or SSCAN page"""
+    cursor, items = reply
+    return long(cursor), items
+
+def parse_hscan(reply, **options):
+    """Return the next cursor and the fields of a HSCAN page as a dict"""
+    cursor, items = reply
+    items = iter(items)
+    return long(cursor), dict(izip(items, items))
+
+def parse_zscan(reply, score_cast_func=float, **options):
+    """Return the next cursor and the (member, score) of a ZSCAN page"""
+    cursor, items = reply
+    items = iter(items)
+    return long(cursor), [(member, score_cast_func(score)) for member, score in izip(items, items)]
+
+class LazyDict(Mapping):
+    """A read-only dict built by calling ``build`` on first access, so
+    that replies nobody looks into are never converted"""
+
+    __slots__ = ('_build', '_dict')
+
+    def __init__(self, build):
+        self._build = build
+        self._dict = None
+
+    def _items(self):
+        if self._dict is None:
+            self._dict = self._build()
+            self._build = None
+        return self._dict
+
+    def __getitem__(self, key):
+        return self._items()[key]
+
+    def __contains__(self, key):
+        return key in self._items()
+
+    def __iter__(self):
+        return iter(self._items())
+
+    def __len__(self):
+        return len(self._items())
+
+    def __repr__(self):
+        return 'LazyDict(%r)' % self._items()
+
+def pairs_to_dict(reply):
+    items = iter(reply)
+    return dict(izip(items, items))
+
+def parse_pairs(reply, lazy=False, **options):
+    """
+    Return the [field, value...] reply of HGETALL or CONFIG GET as a dict,
+    or a LazyDict if ``lazy``
+    """
+    if lazy:
+        return LazyDict(lambda: pairs_to_dict(reply))
+    return pairs_to_dict(reply)
+
+def info_value(value):
+    if ',' in value or '=' in value:
+        # e.g. db0:keys=1,expires=0
+        fields = {}
+        for field in value.split(','):
+            name, _, value = field.partition('=')
+            fields[name] = info_value(value)
+        return fields
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+def parse_info(reply, lazy=False, **options):
+    """
+    Return the ``name:value`` lines of INFO as a dict, numbers converted,
+    or a LazyDict if ``lazy``
+    """
+    def build():
+        info = {}
+        for line in reply.splitlines():
+            if line and not line.startswith('#'):
+                name, _, value = line.partition(':')
+                info[name] = info_value(value)
+        return info
+    if lazy:
+        return LazyDict(build)
+    return build()
+
+def parse_score(reply, score_cast_func=float, **options):
+    """Return the score of ZSCORE or ZINCRBY cast by ``score_cast_func``"""
+    if reply is None:
+        return None
+    return score_cast_func(reply)
+
+def parse_zrange(reply, withscores=False, score_cast_func=float, compact=False, **options):
+    """
+    Return the members of a ZRANGE-like reply, as (member, score) pairs if
+    ``withscores``, or as ScoredMembers if ``compact``
+    """
+    if compact:
+        return ScoredMembers.from_reply(reply)
+    if not withscores:
+        return reply
+    items = iter(reply)
+    return [(member, score_cast_func(score)) for member, score in izip(items, items)]
+
+def parse_timestamp(reply, **options):
+    return datetime.datetime.fromtimestamp(reply)
+
+def parse_script_exists(reply, **options):
+    """Return a bool per script of SCRIPT EXISTS"""
+    return [bool(exists) for exists in reply]
+
+COMMANDS = {}
+COMMAND_METHODS = {}
+
+def lookup_command(name):
+    """Return the Command called ``name``, an anonymous one if unknown"""
+    command = COMMANDS.get(name.upper())
+    if command is None:
+        command = Command(name.upper())
+    return command
+
+def command_method(command, signature, doc=None):
+    """
+    Build a method sending ``command`` with the parameters listed in
+    ``signature``, e.g. 'lpush(name, *values)'.  Keyword arguments are
+    passed to the reply callback (see ``parse_reply``), and TypeError is
+    raised for those it does not take.
+    """
+    name, params = signature.rstrip(')').split('(')
+    params = [param.strip() for param in params.split(',') if param.strip()]
+    names = [param.split('=')[0] for param in params if not param.startswith('*')]
+    args = '(%s)' % ''.join([arg + ', ' for arg in names])
+    if params and params[-1].startswith('*'):
+        if names:
+            args = '%s + %s' % (args, params[-1][1:])
+        else:
+            args = params[-1][1:]
+    source = ('def %s(%s):\n'
+              '    if options:\n'
+              '        command.check_options(options)\n'
+              '    return self._execute(command, %s, **options)\n') % (
+        name, ', '.join(['self'] + params + ['**options']), args)
+    namespace = {'command': command}
+    exec source in namespace
+    method = namespace[name]
+    method.__doc__ = doc
+    return method
+
+def command(name, flags, arity=None, keys=FIRST_KEY, callback=None, method=None, doc=None):
+    """
+    Add a command to the table, along with a generated client method when
+    ``method`` gives its signature, which determines the arity
+    """
+    if arity is None:
+        params = method[method.index('(') + 1:-1].split(',')
+        params = [param for param in params if param.strip()]
+        arity = len(name.split()) + len(params)
+        if params and params[-1].strip().startswith('*'):
+            arity = -arity
+    spec = Command(name, flags, arity, keys, callback)
+    COMMANDS[name] = spec
+    if method is not None:
+        method = command_method(spec, method, doc)
+        COMMAND_METHODS[method.__name__] = method
+    return spec
+
+def add_command_methods(cls):
+    """Class decorator adding the methods generated from the command table"""
+    for name, method in COMMAND_METHODS.iteritems():
+        if name in cls.__dict__:
+            raise TypeError('%s.%s is also generated' % (cls.__name__, name))
+        setattr(cls, name, method)
+    return cls
+
+#### SERVER INFORMATION ####
+command('BGREWRITEAOF', 'admin', keys=None,
+        method='bgrewriteaof()',
+        doc="Tell the Redis server to rewrite the AOF file from data in memory.")
+command('BGSAVE', 'admin', keys=None,
+        method='bgsave()', doc="""
+        Tell the Redis server to save its data to disk.  Unlike save(),
+        this method is asynchronous and returns immediately.
+        """)
+command('CONFIG GET', 'admin', keys=None, callback=parse_pairs,
+        method="config_get(pattern='*')",
+        doc="Return a dictionary of configuration based on the ``pattern``")
+command('CONFIG SET', 'admin', keys=None,
+        method='config_set(name, value)',
+        doc="Set config item ``name`` with ``value``")
+command('DBSIZE', 'readonly', keys=None,
+        method='dbsize()',
+        doc="Returns the number of keys in the current database")
+command('DEL', 'write', keys=ALL_KEYS,
+        method='delete(*names)',
+        doc="Delete one or more keys specified by ``names``")
+command('FLUSHALL', 'admin', keys=None,
+        method='flushall()',
+        doc="Delete all keys in all databases on the current host")
+command('FLUSHDB', 'admin', keys=None,
+        method='flushdb()',
+        doc="Delete all keys in the current database")
+command('INFO', 'admin', keys=None, callback=parse_info,
+        method='info()', doc="""
+        Returns a dictionary containing information about the Redis
+        server, or a LazyDict built on first access with ``lazy=True``
+        """)
+command('LASTSAVE', 'admin', keys=None, callback=parse_timestamp,
+        method='lastsave()', doc="""
+        Return a Python datetime object representing the last time the
+        Redis database was saved to disk
+        """)
+command('PING', 'readonly', keys=None,
+        method='ping()',
+        doc="Ping the Redis server")
+command('SAVE', 'admin', keys=None,
+        method='save()', doc="""
+        Tell the Redis server to save its data to disk,
+        blocking until the save is complete
+        """)
+command('SHUTDOWN', 'admin', 1, keys=None)
+command('SLAVEOF', 'admin', 3, keys=None)
+
+#### BASIC KEY COMMANDS ####
+command('APPEND', 'write',
+        method='append(key, value)', doc="""
+        Appends the string ``value`` to the value at ``key``. If ``key``
+        doesn't already exist, create it with a value of ``value``.
+        Returns the new length of the value at ``key``.
+        """)
+command('DECRBY', 'write',
+        method='decr(name, amount=1)', doc="""
+        Decrements the value of ``key`` by ``amount``.  If no key exists,
+        the value will be initialized as 0 - ``amount``
+        """)
+command('EXISTS', 'readonly', -2, keys=ALL_KEYS, callback=parse_exists)
+command('EXPIRE', 'write',
+        method='expire(name, time)',
+        doc="Set an expire flag on key ``name`` for ``time`` seconds")
+command('EXPIREAT', 'write', 3)
+command('GET', 'readonly',
+        method='get(name)', doc="""
+        Return the value at key ``name``, or None if the key doesn't exist
+        """)
+command('GETBIT', 'readonly', callback=parse_bool,
+        method='getbit(name, offset)',
+        doc="Returns a boolean indicating the value of ``offset`` in ``name``")
+command('GETSET', 'write',
+        method='getset(name, value)', doc="""
+        Set the value at key ``name`` to ``value`` if key doesn't exist
+        Return the value at key ``name`` atomically
+        """)
+command('INCRBY', 'write',
+        method='incr(name, amount=1)', doc="""
+        Increments the value of ``key`` by ``amount``.  If no key exists,
+        the value will be initialized as ``amount``
+        """)
+command('KEYS', 'readonly', keys=None,
+        method="keys(pattern='*')", doc="""
+        Returns a list of keys matching ``pattern``.  The server is blocked
+        while it walks the whole keyspace, see ``scan_iter``
+        """)
+command('MGET', 'readonly', -2, keys=ALL_KEYS)
+command('MSET', 'write', -3, keys=KEY_VALUE_PAIRS)
+command('MSETNX', 'write', -3, keys=KEY_VALUE_PAIRS)
+command('MOVE', 'write',
+        method='move(name, db)',
+        doc="Moves the key ``name`` to a different Redis database ``db``")
+command('PERSIST', 'write',
+        method='persist(name)',
+        doc="Removes an expiration on ``name``")
+command('RANDOMKEY', 'readonly', keys=None,
+        method='randomkey()',
+        doc="Returns the name of a random key")
+command('RENAME', 'write', keys=TWO_KEYS,
+        method='rename(src, dst)', doc="""
+        Rename key ``src`` to ``dst``
+        """)
+command('RENAMENX', 'write', keys=TWO_KEYS,
+        method='renamenx(src, dst)',
+        doc="Rename key ``src`` to ``dst`` if ``dst`` doesn't already exist")
+command('SCAN', 'readonly', -2, keys=None, callback=parse_scan)
+command('SET', 'write',
+        method='set(name, value)',
+        doc="Set the value at key ``name`` to ``value``")
+command('SETBIT', 'write', 4, callback=parse_bool)
+command('SETEX', 'write', 4)
+command('SETNX', 'write',
+        method='setnx(name, value)',
+        doc="Set the value of key ``name`` to ``value`` if key doesn't exist")
+command('SETRANGE', 'write',
+        method='setrange(name, offset, value)', doc="""
+        Overwrite bytes in the value of ``name`` starting at ``offset`` with
+        ``value``. If ``offset`` plus the length of ``value`` exceeds the
+        length of the original value, the new value will be larger than before.
+        If ``offset`` exceeds the length of the original value, null bytes
+        will be used to pad between the end of the previous value and the start
+        of what's being injected.
+
+        Returns the length of the new string.
+        """)
+command('STRLEN', 'readonly',
+        method='strlen(name)',
+        doc="Return the number of bytes stored in the value of ``name``")
+command('SUBSTR', 'readonly',
+        method='substr(name, start, end=-1)', doc="""
+        Return a substring of the string at key ``name``. ``start`` and ``end``
+        are 0-based integers specifying the portion of the string to return.
+        """)
+command('TTL', 'readonly',
+        method='ttl(name)',
+        doc="Returns the number of seconds until the key ``name`` will expire")
+command('TYPE', 'readonly',
+        method='type(name)',
+        doc="Returns the type of key ``name``")
+command('WATCH', 'write', -2, keys=ALL_KEYS)
+command('UNWATCH', 'write', 1, keys=None)
+command('MULTI', 'write', 1, keys=None)
+command('EXEC', 'write', 1, keys=None)
+command('DISCARD', 'write', 1, keys=None)
+
+#### LIST COMMANDS ####
+command('BLPOP', 'write blocking', -3, keys=KEYS_BUT_LAST)
+command('BRPOP', 'write blocking', -3, keys=KEYS_BUT_LAST)
+command('BRPOPLPUSH', 'write blocking', 4, keys=TWO_KEYS)
+command('LINDEX', 'readonly',
+        method='lindex(name, index)', doc="""
+        Return the item from list ``name`` at position ``index``
+
+        Negative indexes are supported and will return an item at the
+        end of the list
+        """)
+command('LINSERT', 'write',
+        method='linsert(name, where, refvalue, value)', doc="""
+        Insert ``value`` in list ``name`` either immediately before or after
+        [``where``] ``refvalue``
+
+        Returns the new length of the list on success or -1 if ``refvalue``
+        is not in the list.
+        """)
+command('LLEN', 'readonly',
+        method='llen(name)',
+        doc="Return the length of the list ``name``")
+command('LPOP', 'write',
+        method='lpop(name)',
+        doc="Remove and return the first item of the list ``name``")
+command('LPUSH', 'write',
+        method='lpush(name, *values)',
+        doc="Push ``values`` onto the head of the list ``name``")
+command('LPUSHX', 'write',
+        method='lpushx(name, value)', doc="""
+        Push ``value`` onto the head of the list ``name`` if ``name`` exists
+        """)
+command('LRANGE', 'readonly',
+        method='lrange(name, start, end)', doc="""
+        Return a slice of the list ``name`` between
+        position ``start`` and ``end``
+
+        ``start`` and ``end`` can be negative numbers just like
+        Python slicing notation
+        """)
+command('LREM', 'write', 4)
+command('LSET', 'write',
+        method='lset(name, index, value)',
+        doc="Set ``position`` of list ``name`` to ``value``")
+command('LTRIM', 'write',
+        method='ltrim(name, start, end)', doc="""
+        Trim the list ``name``, removing all values not within the slice
+        between ``start`` and ``end``
+
+        ``start`` and ``end`` can be negative numbers just like
+        Python slicing notation
+        """)
+command('RPOP', 'write',
+        method='rpop(name)',
+        doc="Remove and return the last item of the list ``name``")
+command('RPOPLPUSH', 'write', keys=TWO_KEYS,
+        method='rpoplpush(src, dst)', doc="""
+        RPOP a value off of the ``src`` list and atomically LPUSH it
+        on to the ``dst`` list.  Returns the value.
+        """)
+command('RPUSH', 'write',
+        method='rpush(name, *values)',
+        doc="Push ``values`` onto the tail of the list ``name``")
+command('RPUSHX', 'write',
+        method='rpushx(name, value)', doc="""
+        Push ``value`` onto the tail of the list ``name`` if ``name`` exists
+        """)
+command('SORT', 'write movablekeys', -2)
+
+#### SET COMMANDS ####
+command('SADD', 'write',
+        method='sadd(name, *values)',
+        doc="Add ``value(s)`` to set ``name``")
+command('SCARD', 'readonly',
+        method='scard(name)',
+        doc="Return the number of elements in set ``name``")
+command('SDIFF', 'readonly', -2, keys=ALL_KEYS)
+command('SDIFFSTORE', 'write', -3, keys=ALL_KEYS)
+command('SINTER', 'readonly', -2, keys=ALL_KEYS)
+command('SINTERSTORE', 'write', -3, keys=ALL_KEYS)
+command('SISMEMBER', 'readonly', callback=parse_bool,
+        method='sismember(name, value)', doc="""
+        Return a boolean indicating if ``value`` is a member of set ``name``
+        """)
+command('SMEMBERS', 'readonly',
+        method='smembers(name)',
+        doc="Return all members of the set ``name``")
+command('SMOVE', 'write', keys=TWO_KEYS,
+        method='smove(src, dst, value)',
+        doc="Move ``value`` from set ``src`` to set ``dst`` atomically")
+command('SPOP', 'write',
+        method='spop(name)',
+        doc="Remove and return a random member of set ``name``")
+command('SRANDMEMBER', 'readonly',
+        method='srandmember(name)',
+        doc="Return a random member of set ``name``")
+command('SREM', 'write',
+        method='srem(name, *values)',
+        doc="Remove ``values`` from set ``name``")
+command('SSCAN', 'readonly', -3, callback=parse_scan)
+command('SUNION', 'readonly', -2, keys=ALL_KEYS)
+command('SUNIONSTORE', 'write', -3, keys=ALL_KEYS)
+
+#### SORTED SET COMMANDS ####
+command('ZADD', 'write', -4)
+command('ZCARD', 'readonly',
+        method='zcard(name)',
+        doc="Return the number of elements in the sorted set ``name``")
+command('ZCOUNT', 'readonly',
+        method='zcount(name, min, max)', doc="""
+        Returns the number of elements in the sorted set ``name`` with
+        a score between ``min`` and ``max``
+        """)
+command('ZINCRBY', 'write', 4, callback=parse_score)
+command('ZINTERSTORE', 'write movablekeys', -4)
+command('ZRANGE', 'readonly', -4, callback=parse_zrange)
+command('ZRANGEBYSCORE', 'readonly', -4, callback=parse_zrange)
+command('ZRANK', 'readonly',
+        method='zrank(name, value)', doc="""
+        Returns a 0-based value indicating the rank of ``value`` in sorted set
+        ``name``
+        """)
+command('ZREM', 'write',
+        method='zrem(name, *values)',
+        doc="Remove member ``values`` from sorted set ``name``")
+command('ZREMRANGEBYRANK', 'write',
+        method='zremrangebyrank(name, min, max)', doc="""
+        Remove all elements in the sorted set ``name`` with ranks between
+        ``min`` and ``max``. Values are 0-based, ordered from smallest score
+        to largest. Values can be negative indicating the highest scores.
+        Returns the number of elements removed
+        """)
+command('ZREMRANGEBYSCORE', 'write',
+        method='zremrangebyscore(name, min, max)', doc="""
+        Remove all elements in the sorted set ``name`` with scores
+        between ``min`` and ``max``. Returns the number of elements removed.
+        """)
+command('ZREVRANGE', 'readonly', -4, callback=parse_zrange)
+command('ZREVRANGEBYSCORE', 'readonly', -4, callback=parse_zrange)
+command('ZREVRANK', 'readonly',
+        method='zrevrank(name, value)', doc="""
+        Returns a 0-based value indicating the descending rank of
+        ``value`` in sorted set ``name``
+        """)
+command('ZSCAN', 'readonly', -3, callback=parse_zscan)
+command('ZSCORE', 'readonly', callback=parse_score,
+        method='zscore(name, value)',
+        doc="Return the score of element ``value`` in sorted set ``name``")
+command('ZUNIONSTORE', 'write movablekeys', -4)
+
+#### HASH COMMANDS ####
+command('HDEL', 'write',
+        method='hdel(name, *keys)',
+        doc="Delete ``keys`` from hash ``name``")
+command('HEXISTS', 'readonly', callback=parse_bool,
+        method='hexists(name, key)', doc="""
+        Returns a boolean indicating if ``key`` exists within hash ``name``
+        """)
+command('HGET', 'readonly',
+        method='hget(name, key)',
+        doc="Return the value of ``key`` within the hash ``name``")
+command('HGETALL', 'readonly', callback=parse_pairs,
+        method='hgetall(name)', doc="""
+        Return a Python dict of the hash's name/value pairs, or a LazyDict
+        built on first access with ``lazy=True``
+        """)
+command('HINCRBY', 'write',
+        method='hincrby(name, key, amount=1)',
+        doc="Increment the value of ``key`` in hash ``name`` by ``amount``")
+command('HKEYS', 'readonly',
+        method='hkeys(name)',
+        doc="Return the list of keys within hash ``name``")
+command('HLEN', 'readonly',
+        method='hlen(name)',
+        doc="Return the number of elements in hash ``name``")
+command('HSET', 'write',
+        method='hset(name, key, value)', doc="""
+        Set ``key`` to ``value`` within hash ``name``
+        Returns 1 if HSET created a new field, otherwise 0
+        """)
+command('HSETNX', 'write',
+        method='hsetnx(name, key, value)', doc="""
+        Set ``key`` to ``value`` within hash ``name`` if ``key`` does not
+        exist.  Returns 1 if HSETNX created a field, otherwise 0.
+        """)
+command('HMSET', 'write', -4)
+command('HMGET', 'readonly', -3)
+command('HSCAN', 'readonly', -3, callback=parse_hscan)
+command('HVALS', 'readonly',
+        method='hvals(name)',
+        doc="Return the list of values within hash ``name``")
+
+#### PUBSUB COMMANDS ####
+command('PUBLISH', 'pubsub', keys=None,
+        method='publish(channel, message)', doc="""
+        Publish ``message`` on ``channel``.
+        Returns the number of subscribers the message was delivered to.
+        """)
+command('PSUBSCRIBE', 'pubsub', -2, keys=None)
+command('PUNSUBSCRIBE', 'pubsub', -1, keys=None)
+command('SUBSCRIBE', 'pubsub', -2, keys=None)
+command('UNSUBSCRIBE', 'pubsub', -1, keys=None)
+
+#### SCRIPTING COMMANDS ####
+command('EVAL', 'write movablekeys', keys=None,
+        method='eval(script, numkeys, *keys_and_args)', doc="""
+        Execute the Lua ``script``, whose first ``numkeys`` of
+        ``keys_and_args`` are keys.  See also ``register_script``.
+        """)
+command('EVALSHA', 'write movablekeys', keys=None,
+        method='evalsha(sha, numkeys, *keys_and_args)', doc="""
+        Execute the Lua script cached by the server under ``sha``, whose
+        first ``numkeys`` of ``keys_and_args`` are keys
+        """)
+command('SCRIPT EXISTS', 'admin', keys=None,
+        callback=parse_script_exists,
+        method='script_exists(*shas)',
+        doc="Return whether each of ``shas`` is in the script cache of the server")
+command('SCRIPT FLUSH', 'admin', keys=None,
+        method='script_flush()',
+        doc="Empty the script cache of the server")
+command('SCRIPT LOAD', 'admin', keys=None,
+        method='script_load(script)',
+        doc="Add ``script`` to the script cache of the server and return its SHA1")
+
+#### CLUSTER COMMANDS ####
+command('ASKING', 'readonly', 1, keys=None)
+command('CLUSTER SLOTS', 'admin', keys=None,
+        method='cluster_slots()', doc="""
+        Return the slot ranges of the cluster, each as [start, end, master,
+        replicas...] where the nodes are [host, port, node id]
+        """)
+
+#### DEBUGGING ####
+command('MONITOR', 'admin', 1, keys=None)
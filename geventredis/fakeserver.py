@@ -0,0 +1,1412 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""An in-process Redis server speaking the wire protocol, for tests and benchmarks"""
+
+import fnmatch
+import inspect
+import random
+import select
+import time
+
+import gevent
+from gevent.event import Event
+from gevent.lock import Semaphore
+from gevent.server import StreamServer
+from gevent.socket import error, IPPROTO_TCP, MSG_PEEK, TCP_NODELAY
+
+from geventredis.cluster import SLOT_COUNT, key_slot
+from geventredis.commands import COMMANDS, lookup_command
+from geventredis.wire_protocol import PythonReader, RedisError
+
+
+class Status(str):
+    """A status reply, e.g. OK"""
+
+OK = Status('OK')
+QUEUED = Status('QUEUED')
+
+
+class Replies(list):
+    """Several replies to one command, e.g. SUBSCRIBE to many channels"""
+
+
+class WrongArity(Exception):
+    """Raised by a command whose arguments do not fit its signature alone"""
+
+WRONGTYPE = 'WRONGTYPE Operation against a key holding the wrong kind of value'
+NOT_INTEGER = 'ERR value is not an integer or out of range'
+NOT_FLOAT = 'ERR value is not a valid float'
+SYNTAX = 'ERR syntax error'
+NO_KEY = 'ERR no such key'
+
+TRANSACTION_COMMANDS = frozenset(['multi', 'exec', 'discard', 'watch'])
+
+# How often a blocked pop checks that its client is still connected
+DISCONNECT_CHECK_INTERVAL = 0.05
+
+TYPE_NAMES = {str: 'string', list: 'list', dict: 'hash', set: 'set'}
+
+
+def encode_reply(value, pieces):
+    """Append the protocol encoding of ``value`` to the list ``pieces``"""
+    if value is None:
+        pieces.append('$-1\r\n')
+    elif isinstance(value, Replies):
+        for item in value:
+            encode_reply(item, pieces)
+    elif isinstance(value, Status):
+        pieces.append('+%s\r\n' % value)
+    elif isinstance(value, str):
+        pieces.append('$%d\r\n' % len(value))
+        pieces.append(value)
+        pieces.append('\r\n')
+    elif isinstance(value, (int, long)):
+        pieces.append(':%d\r\n' % value)
+    elif isinstance(value, RedisError):
+        pieces.append('-%s\r\n' % value)
+    else:
+        pieces.append('*%d\r\n' % len(value))
+        for item in value:
+            encode_reply(item, pieces)
+    return pieces
+
+def format_score(score):
+    return '%.17g' % score
+
+def parse_score(value):
+    """Parse a score bound of ZRANGEBYSCORE into (score, exclusive)"""
+    exclusive = value.startswith('(')
+    if exclusive:
+        value = value[1:]
+    try:
+        return float(value), exclusive
+    except ValueError:
+        raise RedisError('ERR min or max is not a float')
+
+def quote(value):
+    """Quote an argument the way MONITOR prints it"""
+    return '"%s"' % value.encode('string_escape').replace("\\'", "'").replace('"', '\\"')
+
+def to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise RedisError(NOT_INTEGER)
+
+def to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        raise RedisError(NOT_FLOAT)
+
+def arity_range(method):
+    """The lowest and highest, None if unbounded, argument counts of a
+    ``cmd_<name>`` method"""
+    args, varargs, _, defaults = inspect.getargspec(method)
+    # self and the connection are not arguments of the command
+    highest = len(args) - 2
+    lowest = highest - len(defaults or ())
+    return lowest, None if varargs else highest
+
+def index_range(length, start, end):
+    """Turn inclusive, possibly negative, Redis indexes into a slice"""
+    start = to_int(start)
+    end = to_int(end)
+    if start < 0:
+        start = max(start + length, 0)
+    if end < 0:
+        end += length
+    return start, min(end, length - 1) + 1
+
+
+class SortedSet(dict):
+    """Member -> score, ordered on demand"""
+
+    def ordered(self):
+        return sorted(self.iteritems(), key=lambda item: (item[1], item[0]))
+
+TYPE_NAMES[SortedSet] = 'zset'
+
+
+class FakeConnection(object):
+    """The state of one client connection"""
+
+    def __init__(self, server, sock, address):
+        self.server = server
+        self.sock = sock
+        self.address = address
+        self.channels = set()
+        self.patterns = set()
+        self.queued = None
+        self.aborted = False
+        self.watched = {}
+        # set by ASKING for the next command
+        self.asking = False
+        self._write_lock = Semaphore()
+
+    def send(self, pieces):
+        # publishers write to subscribers from their own greenlet
+        data = ''.join(pieces)
+        server = self.server
+        with self._write_lock:
+            if server.fragment_size is None and server.bandwidth is None:
+                self.sock.sendall(data)
+                return
+            step = server.fragment_size or 65536
+            for start in xrange(0, len(data), step):
+                chunk = data[start:start + step]
+                # a chunk arrives once its transmission time has elapsed
+                if server.bandwidth:
+                    gevent.sleep(float(len(chunk)) / server.bandwidth)
+                elif start:
+                    gevent.sleep(server.fragment_delay)
+                self.sock.sendall(chunk)
+
+    def closed(self):
+        """Whether the client closed the connection, without reading it"""
+        poller = select.poll()
+        poller.register(self.sock, select.POLLIN)
+        if not poller.poll(0):
+            return False
+        try:
+            return not self.sock.recv(1, MSG_PEEK)
+        except error:
+            return True
+
+
+class FakeRedisServer(object):
+    """A single-database Redis server kept in a dict.
+
+    Example usage::
+
+        server = FakeRedisServer(latency=0.001)
+        server.start()
+        redis_client = geventredis.connect('127.0.0.1', server.port)
+
+    The string, key, list, set, sorted set, hash and pub/sub commands of
+    the client are implemented, along with transactions, MONITOR and keys
+    expiring.
+    Every command is a ``cmd_<name>`` method taking the connection and the
+    arguments and returning the reply; argument counts its signature does
+    not allow are answered with an arity error before it is called, and
+    it raises WrongArity for those it checks itself.  All the commands received in one
+    read are executed before their replies are sent in one write, so
+    pipelines are answered at the pace of the client.
+
+    The network can be degraded at any time through attributes: every
+    batch of replies waits ``latency`` seconds, and replies are written
+    ``fragment_size`` bytes at a time, ``fragment_delay`` seconds apart, or
+    at ``bandwidth`` bytes per second, so that clients receive partial
+    replies.
+
+    The nodes of a FakeRedisCluster answer commands on the slots of other
+    nodes with redirections.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, bandwidth=None,
+                 fragment_size=None, fragment_delay=0.001, cluster=None):
+        self.host = host
+        self.cluster = cluster
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fragment_size = fragment_size
+        self.fragment_delay = fragment_delay
+        self.data = {}
+        self.expires = {}
+        self.config = {'maxmemory': '0', 'notify-keyspace-events': ''}
+        self.channels = {}
+        self.patterns = {}
+        self.monitors = set()
+        self.connections = set()
+        self.last_save = int(time.time())
+        self._pushed = Event()
+        # watched key -> number of writes to it
+        self.versions = {}
+        # command name -> (lowest, highest) argument counts
+        self._arities = {}
+        self.server = StreamServer((host, port), self._handle)
+
+    @property
+    def port(self):
+        return self.server.server_port
+
+    def start(self):
+        self.server.start()
+
+    def stop(self):
+        self.server.stop()
+
+    def _handle(self, sock, address):
+        connection = FakeConnection(self, sock, address)
+        self.connections.add(connection)
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        reader = PythonReader()
+        try:
+            while reader.recv_from(sock):
+                pieces = []
+                request = reader.gets()
+                while request is not False:
+                    encode_reply(self.execute(connection, request), pieces)
+                    request = reader.gets()
+                if pieces:
+                    if self.latency:
+                        gevent.sleep(self.latency)
+                    connection.send(pieces)
+        except error:
+            pass
+        finally:
+            self.connections.discard(connection)
+            self.monitors.discard(connection)
+            self.cmd_unwatch(connection)
+            self._unsubscribe(connection, self.channels, connection.channels, ())
+            self._unsubscribe(connection, self.patterns, connection.patterns, ())
+            sock.close()
+
+    def execute(self, connection, request):
+        """Run one request, a list of the command name and arguments"""
+        if self.monitors:
+            line = '+%.6f [0 %s:%d] %s\r\n' % (
+                time.time(), connection.address[0], connection.address[1],
+                ' '.join([quote(arg) for arg in request]))
+            for monitor in list(self.monitors):
+                monitor.send([line])
+        if self.cluster is not None:
+            redirect = self.cluster.redirect(self, connection, request)
+            if redirect is not None:
+                return redirect
+        name = request[0].lower()
+        method = getattr(self, 'cmd_' + name, None)
+        if connection.queued is not None and name not in TRANSACTION_COMMANDS:
+            if method is None:
+                connection.aborted = True
+                return RedisError("ERR unknown command '%s'" % request[0])
+            connection.queued.append(request)
+            return QUEUED
+        return self._call(connection, method, request)
+
+    def _call(self, connection, method, request):
+        if method is None:
+            return RedisError("ERR unknown command '%s'" % request[0])
+        name = request[0].lower()
+        arity = self._arities.get(name)
+        if arity is None:
+            arity = self._arities[name] = arity_range(method)
+        lowest, highest = arity
+        count = len(request) - 1
+        try:
+            if count < lowest or (highest is not None and count > highest):
+                raise WrongArity
+            reply = method(connection, *request[1:])
+        except RedisError, e:
+            return e
+        except WrongArity:
+            return RedisError("ERR wrong number of arguments for '%s' command" % request[0])
+        if self.versions:
+            # a write touching a watched key fails the transactions watching it
+            command = lookup_command(request[0])
+            if not command.readonly and command.name != 'WATCH':
+                versions = self.versions
+                for key in command.keys(request[1:]):
+                    if key in versions:
+                        versions[key] += 1
+        return reply
+
+    #### KEYSPACE ####
+    def _expire_key(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.time():
+            del self.expires[key]
+            self.data.pop(key, None)
+
+    def _get(self, key, kind):
+        """Return the value of ``key``, None if missing, checking its type"""
+        self._expire_key(key)
+        value = self.data.get(key)
+        if value is not None and type(value) is not kind:
+            raise RedisError(WRONGTYPE)
+        return value
+
+    def _get_or_create(self, key, kind):
+        value = self._get(key, kind)
+        if value is None:
+            value = self.data[key] = kind()
+        return value
+
+    def _set(self, key, value):
+        self.data[key] = value
+        self.expires.pop(key, None)
+
+    def _delete(self, key):
+        self.expires.pop(key, None)
+        return self.data.pop(key, None) is not None
+
+    def _cleanup(self, key, value):
+        # empty containers do not exist in Redis
+        if not value:
+            self._delete(key)
+
+    def _keys(self):
+        for key in list(self.data):
+            self._expire_key(key)
+        return sorted(self.data)
+
+    def _scan(self, items, cursor, args):
+        match = None
+        count = 10
+        for option, value in zip(args[::2], args[1::2]):
+            option = option.upper()
+            if option == 'MATCH':
+                match = value
+            elif option == 'COUNT':
+                count = to_int(value)
+            else:
+                raise RedisError(SYNTAX)
+        cursor = to_int(cursor)
+        page = items[cursor:cursor + count]
+        cursor += count
+        if cursor >= len(items):
+            cursor = 0
+        if match is not None:
+            page = [item for item in page if fnmatch.fnmatchcase(item, match)]
+        return str(cursor), page
+
+    #### SERVER ####
+    def cmd_ping(self, connection, message=None):
+        if message is not None:
+            return message
+        return Status('PONG')
+
+    def cmd_echo(self, connection, message):
+        return message
+
+    def cmd_select(self, connection, db):
+        if db != '0':
+            raise RedisError('ERR the fake server has a single database')
+        return OK
+
+    def cmd_dbsize(self, connection):
+        return len(self._keys())
+
+    def cmd_flushdb(self, connection):
+        for key in self.versions:
+            self.versions[key] += 1
+        self.data.clear()
+        self.expires.clear()
+        return OK
+
+    cmd_flushall = cmd_flushdb
+
+    def cmd_info(self, connection, section=None):
+        lines = [
+            '# Server',
+            'redis_version:2.8.0',
+            'redis_mode:standalone',
+            '# Clients',
+            'connected_clients:%d' % len(self.connections),
+            '# Keyspace',
+            'db0:keys=%d,expires=%d' % (len(self.data), len(self.expires)),
+        ]
+        return '\r\n'.join(lines) + '\r\n'
+
+    def cmd_config(self, connection, subcommand, *args):
+        subcommand = subcommand.upper()
+        if subcommand == 'GET':
+            pattern, = args
+            reply = []
+            for name, value in sorted(self.config.iteritems()):
+                if fnmatch.fnmatchcase(name, pattern):
+                    reply.extend([name, value])
+            return reply
+        if subcommand == 'SET':
+            name, value = args
+            self.config[name] = value
+            return OK
+        raise RedisError('ERR CONFIG subcommand must be one of GET, SET')
+
+    def cmd_save(self, connection):
+        self.last_save = int(time.time())
+        return OK
+
+    def cmd_bgsave(self, connection):
+        self.last_save = int(time.time())
+        return Status('Background saving started')
+
+    def cmd_bgrewriteaof(self, connection):
+        return Status('Background append only file rewriting started')
+
+    def cmd_lastsave(self, connection):
+        return self.last_save
+
+    def cmd_slaveof(self, connection, host, port):
+        return OK
+
+    def cmd_cluster(self, connection, subcommand, *args):
+        if self.cluster is None:
+            raise RedisError('ERR This instance has cluster support disabled')
+        if subcommand.lower() != 'slots':
+            raise RedisError('ERR Unknown subcommand or wrong number of arguments')
+        return self.cluster.slot_ranges()
+
+    def cmd_asking(self, connection):
+        if self.cluster is None:
+            raise RedisError('ERR This instance has cluster support disabled')
+        connection.asking = True
+        return OK
+
+    def cmd_monitor(self, connection):
+        self.monitors.add(connection)
+        return OK
+
+    #### TRANSACTIONS ####
+    def cmd_multi(self, connection):
+        if connection.queued is not None:
+            raise RedisError('ERR MULTI calls can not be nested')
+        connection.queued = []
+        connection.aborted = False
+        return OK
+
+    def cmd_exec(self, connection):
+        queued = connection.queued
+        if queued is None:
+            raise RedisError('ERR EXEC without MULTI')
+        connection.queued = None
+        changed = [key for key, version in connection.watched.iteritems()
+                   if self.versions[key] != version]
+        self.cmd_unwatch(connection)
+        if connection.aborted:
+            raise RedisError('EXECABORT Transaction discarded because of previous errors.')
+        if changed:
+            return None
+        return [self._call(connection, getattr(self, 'cmd_' + request[0].lower()), request)
+                for request in queued]
+
+    def cmd_discard(self, connection):
+        if connection.queued is None:
+            raise RedisError('ERR DISCARD without MULTI')
+        connection.queued = None
+        self.cmd_unwatch(connection)
+        return OK
+
+    def cmd_watch(self, connection, *keys):
+        if not keys:
+            raise WrongArity
+        if connection.queued is not None:
+            raise RedisError('ERR WATCH inside MULTI is not allowed')
+        for key in keys:
+            self._expire_key(key)
+            version = self.versions.setdefault(key, 0)
+            connection.watched.setdefault(key, version)
+        return OK
+
+    def cmd_unwatch(self, connection):
+        connection.watched = {}
+        watched = set()
+        for other in self.connections:
+            watched.update(other.watched)
+        for key in list(self.versions):
+            if key not in watched:
+                del self.versions[key]
+        return OK
+
+    #### KEYS ####
+    def cmd_del(self, connection, *keys):
+        count = 0
+        for key in keys:
+            self._expire_key(key)
+            count += self._delete(key)
+        return count
+
+    def cmd_exists(self, connection, *keys):
+        count = 0
+        for key in keys:
+            self._expire_key(key)
+            count += key in self.data
+        return count
+
+    def cmd_type(self, connection, key):
+        self._expire_key(key)
+        value = self.data.get(key)
+        if value is None:
+            return Status('none')
+        return Status(TYPE_NAMES[type(value)])
+
+    def cmd_keys(self, connection, pattern):
+        return [key for key in self._keys() if fnmatch.fnmatchcase(key, pattern)]
+
+    def cmd_scan(self, connection, cursor, *args):
+        return self._scan(self._keys(), cursor, args)
+
+    def cmd_randomkey(self, connection):
+        keys = self._keys()
+        if not keys:
+            return None
+        return random.choice(keys)
+
+    def cmd_rename(self, connection, key, new_key):
+        self._expire_key(key)
+        if key not in self.data:
+            raise RedisError(NO_KEY)
+        expires = self.expires.pop(key, None)
+        self._set(new_key, self.data.pop(key))
+        if expires is not None:
+            self.expires[new_key] = expires
+        return OK
+
+    def cmd_renamenx(self, connection, key, new_key):
+        self._expire_key(new_key)
+        if new_key in self.data:
+            self._expire_key(key)
+            if key not in self.data:
+                raise RedisError(NO_KEY)
+            return 0
+        self.cmd_rename(connection, key, new_key)
+        return 1
+
+    def cmd_expire(self, connection, key, seconds):
+        return self.cmd_expireat(connection, key, time.time() + to_int(seconds))
+
+    def cmd_pexpire(self, connection, key, milliseconds):
+        return self.cmd_expireat(connection, key, time.time() + to_int(milliseconds) / 1000.0)
+
+    def cmd_expireat(self, connection, key, when):
+        self._expire_key(key)
+        if key not in self.data:
+            return 0
+        self.expires[key] = float(when)
+        self._expire_key(key)
+        return 1
+
+    def cmd_persist(self, connection, key):
+        self._expire_key(key)
+        return int(self.expires.pop(key, None) is not None)
+
+    def cmd_ttl(self, connection, key):
+        self._expire_key(key)
+        if key not in self.data:
+            return -2
+        expires = self.expires.get(key)
+        if expires is None:
+            return -1
+        return int(round(expires - time.time()))
+
+    def cmd_move(self, connection, key, db):
+        raise RedisError('ERR the fake server has a single database')
+
+    def cmd_sort(self, connection, key, *args):
+        self._expire_key(key)
+        value = self.data.get(key, ())
+        if type(value) is str or type(value) is dict:
+            raise RedisError(WRONGTYPE)
+        items = list(value)
+        alpha = desc = False
+        limit = store = None
+        args = list(args)
+        while args:
+            option = args.pop(0).upper()
+            if option == 'ALPHA':
+                alpha = True
+            elif option == 'DESC':
+                desc = True
+            elif option == 'ASC':
+                desc = False
+            elif option == 'LIMIT':
+                limit = to_int(args.pop(0)), to_int(args.pop(0))
+            elif option == 'STORE':
+                store = args.pop(0)
+            else:
+                raise RedisError('ERR SORT %s is not supported by the fake server' % option)
+        if alpha:
+            items.sort(reverse=desc)
+        else:
+            try:
+                items.sort(key=float, reverse=desc)
+            except ValueError:
+                raise RedisError("ERR One or more scores can't be converted into double")
+        if limit is not None:
+            items = items[limit[0]:limit[0] + limit[1]]
+        if store is not None:
+            self._delete(store)
+            if items:
+                self._set(store, items)
+            return len(items)
+        return items
+
+    #### STRINGS ####
+    def cmd_get(self, connection, key):
+        return self._get(key, str)
+
+    def cmd_set(self, connection, key, value, *args):
+        expires = None
+        condition = None
+        args = list(args)
+        while args:
+            option = args.pop(0).upper()
+            if option == 'EX':
+                expires = time.time() + to_int(args.pop(0))
+            elif option == 'PX':
+                expires = time.time() + to_int(args.pop(0)) / 1000.0
+            elif option in ('NX', 'XX'):
+                condition = option
+            else:
+                raise RedisError(SYNTAX)
+        if condition is not None:
+            self._expire_key(key)
+            if (key in self.data) == (condition == 'NX'):
+                return None
+        self._set(key, value)
+        if expires is not None:
+            self.expires[key] = expires
+        return OK
+
+    def cmd_setnx(self, connection, key, value):
+        return int(self.cmd_set(connection, key, value, 'NX') is not None)
+
+    def cmd_setex(self, connection, key, seconds, value):
+        return self.cmd_set(connection, key, value, 'EX', seconds)
+
+    def cmd_getset(self, connection, key, value):
+        old = self._get(key, str)
+        self._set(key, value)
+        return old
+
+    def cmd_mget(self, connection, *keys):
+        data = self.data
+        values = []
+        for key in keys:
+            self._expire_key(key)
+            value = data.get(key)
+            values.append(value if type(value) is str else None)
+        return values
+
+    def cmd_mset(self, connection, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise WrongArity
+        for i in xrange(0, len(pairs), 2):
+            self._set(pairs[i], pairs[i + 1])
+        return OK
+
+    def cmd_msetnx(self, connection, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise WrongArity
+        for key in pairs[::2]:
+            self._expire_key(key)
+            if key in self.data:
+                return 0
+        self.cmd_mset(connection, *pairs)
+        return 1
+
+    def cmd_append(self, connection, key, value):
+        value = (self._get(key, str) or '') + value
+        self.data[key] = value
+        return len(value)
+
+    def cmd_strlen(self, connection, key):
+        return len(self._get(key, str) or '')
+
+    def cmd_incrby(self, connection, key, amount):
+        value = to_int(self._get(key, str) or '0') + to_int(amount)
+        self.data[key] = str(value)
+        return value
+
+    def cmd_decrby(self, connection, key, amount):
+        return self.cmd_incrby(connection, key, -to_int(amount))
+
+    def cmd_incr(self, connection, key):
+        return self.cmd_incrby(connection, key, 1)
+
+    def cmd_decr(self, connection, key):
+        return self.cmd_incrby(connection, key, -1)
+
+    def cmd_getrange(self, connection, key, start, end):
+        value = self._get(key, str) or ''
+        start, stop = index_range(len(value), start, end)
+        return value[start:stop]
+
+    cmd_substr = cmd_getrange
+
+    def cmd_setrange(self, connection, key, offset, value):
+        offset = to_int(offset)
+        old = self._get(key, str) or ''
+        if len(old) < offset:
+            old += '\0' * (offset - len(old))
+        value = old[:offset] + value + old[offset + len(value):]
+        self.data[key] = value
+        return len(value)
+
+    def cmd_getbit(self, connection, key, offset):
+        offset = to_int(offset)
+        value = self._get(key, str) or ''
+        byte = offset >> 3
+        if byte >= len(value):
+            return 0
+        return (ord(value[byte]) >> (7 - (offset & 7))) & 1
+
+    def cmd_setbit(self, connection, key, offset, bit):
+        offset = to_int(offset)
+        if bit not in ('0', '1'):
+            raise RedisError('ERR bit is not an integer or out of range')
+        value = bytearray(self._get(key, str) or '')
+        byte = offset >> 3
+        if byte >= len(value):
+            value.extend('\0' * (byte + 1 - len(value)))
+        mask = 1 << (7 - (offset & 7))
+        old = int(bool(value[byte] & mask))
+        if bit == '1':
+            value[byte] |= mask
+        else:
+            value[byte] &= ~mask
+        self.data[key] = str(value)
+        return old
+
+    #### LISTS ####
+    def _push(self, key, values, left, create=True):
+        if not create and self._get(key, list) is None:
+            return 0
+        items = self._get_or_create(key, list)
+        if left:
+            items[:0] = reversed(values)
+        else:
+            items.extend(values)
+        # wake the blocked pops up
+        pushed, self._pushed = self._pushed, Event()
+        pushed.set()
+        return len(items)
+
+    def _pop(self, key, left):
+        items = self._get(key, list)
+        if not items:
+            return None
+        value = items.pop(0 if left else -1)
+        self._cleanup(key, items)
+        return value
+
+    def _blocking(self, connection, timeout, pop):
+        """
+        Call ``pop`` until it returns a value or ``timeout`` expires, or
+        the client disconnects, which must not have anything popped for it
+        """
+        timeout = to_int(timeout)
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            reply = pop()
+            if reply is not None:
+                return reply
+            remaining = DISCONNECT_CHECK_INTERVAL
+            if deadline is not None:
+                remaining = min(deadline - time.time(), remaining)
+                if remaining <= 0:
+                    return None
+            self._pushed.wait(remaining)
+            if connection.closed():
+                return None
+
+    def cmd_lpush(self, connection, key, *values):
+        if not values:
+            raise WrongArity
+        return self._push(key, values, True)
+
+    def cmd_rpush(self, connection, key, *values):
+        if not values:
+            raise WrongArity
+        return self._push(key, values, False)
+
+    def cmd_lpushx(self, connection, key, value):
+        return self._push(key, [value], True, create=False)
+
+    def cmd_rpushx(self, connection, key, value):
+        return self._push(key, [value], False, create=False)
+
+    def cmd_lpop(self, connection, key):
+        return self._pop(key, True)
+
+    def cmd_rpop(self, connection, key):
+        return self._pop(key, False)
+
+    def _blocking_pop(self, connection, args, left):
+        if len(args) < 2:
+            raise WrongArity
+        keys = args[:-1]
+        def pop():
+            for key in keys:
+                value = self._pop(key, left)
+                if value is not None:
+                    return [key, value]
+        return self._blocking(connection, args[-1], pop)
+
+    def cmd_blpop(self, connection, *args):
+        return self._blocking_pop(connection, args, True)
+
+    def cmd_brpop(self, connection, *args):
+        return self._blocking_pop(connection, args, False)
+
+    def cmd_rpoplpush(self, connection, source, destination):
+        self._get(destination, list)
+        value = self._pop(source, False)
+        if value is not None:
+            self._push(destination, [value], True)
+        return value
+
+    def cmd_brpoplpush(self, connection, source, destination, timeout):
+        return self._blocking(connection, timeout, lambda: self.cmd_rpoplpush(connection, source, destination))
+
+    def cmd_llen(self, connection, key):
+        return len(self._get(key, list) or ())
+
+    def cmd_lrange(self, connection, key, start, end):
+        items = self._get(key, list) or []
+        start, stop = index_range(len(items), start, end)
+        return items[start:stop]
+
+    def cmd_lindex(self, connection, key, index):
+        items = self._get(key, list) or []
+        index = to_int(index)
+        if -len(items) <= index < len(items):
+            return items[index]
+        return None
+
+    def cmd_lset(self, connection, key, index, value):
+        items = self._get(key, list)
+        if items is None:
+            raise RedisError(NO_KEY)
+        index = to_int(index)
+        if not -len(items) <= index < len(items):
+            raise RedisError('ERR index out of range')
+        items[index] = value
+        return OK
+
+    def cmd_linsert(self, connection, key, where, pivot, value):
+        items = self._get(key, list)
+        if items is None:
+            return 0
+        where = where.upper()
+        if where not in ('BEFORE', 'AFTER'):
+            raise RedisError(SYNTAX)
+        if pivot not in items:
+            return -1
+        index = items.index(pivot)
+        items.insert(index if where == 'BEFORE' else index + 1, value)
+        return len(items)
+
+    def cmd_lrem(self, connection, key, count, value):
+        items = self._get(key, list)
+        if items is None:
+            return 0
+        count = to_int(count)
+        indexes = [i for i, item in enumerate(items) if item == value]
+        if count < 0:
+            indexes = indexes[count:]
+        elif count > 0:
+            indexes = indexes[:count]
+        for index in reversed(indexes):
+            del items[index]
+        self._cleanup(key, items)
+        return len(indexes)
+
+    def cmd_ltrim(self, connection, key, start, end):
+        items = self._get(key, list)
+        if items is not None:
+            start, stop = index_range(len(items), start, end)
+            items[:] = items[start:stop]
+            self._cleanup(key, items)
+        return OK
+
+    #### SETS ####
+    def _sets(self, keys):
+        return [self._get(key, set) or set() for key in keys]
+
+    def _store(self, key, value):
+        self._delete(key)
+        if value:
+            self._set(key, value)
+        return len(value)
+
+    def cmd_sadd(self, connection, key, *members):
+        if not members:
+            raise WrongArity
+        items = self._get_or_create(key, set)
+        count = len(items)
+        items.update(members)
+        return len(items) - count
+
+    def cmd_srem(self, connection, key, *members):
+        if not members:
+            raise WrongArity
+        items = self._get(key, set)
+        if items is None:
+            return 0
+        count = len(items)
+        items.difference_update(members)
+        removed = count - len(items)
+        self._cleanup(key, items)
+        return removed
+
+    def cmd_scard(self, connection, key):
+        return len(self._get(key, set) or ())
+
+    def cmd_sismember(self, connection, key, member):
+        return int(member in (self._get(key, set) or ()))
+
+    def cmd_smembers(self, connection, key):
+        return sorted(self._get(key, set) or ())
+
+    def cmd_sscan(self, connection, key, cursor, *args):
+        return self._scan(sorted(self._get(key, set) or ()), cursor, args)
+
+    def cmd_spop(self, connection, key):
+        items = self._get(key, set)
+        if not items:
+            return None
+        member = random.choice(list(items))
+        items.discard(member)
+        self._cleanup(key, items)
+        return member
+
+    def cmd_srandmember(self, connection, key):
+        items = self._get(key, set)
+        if not items:
+            return None
+        return random.choice(list(items))
+
+    def cmd_smove(self, connection, source, destination, member):
+        items = self._get(source, set)
+        self._get(destination, set)
+        if not items or member not in items:
+            return 0
+        items.discard(member)
+        self._cleanup(source, items)
+        self._get_or_create(destination, set).add(member)
+        return 1
+
+    def cmd_sinter(self, connection, *keys):
+        sets = self._sets(keys)
+        return sorted(set.intersection(*sets))
+
+    def cmd_sunion(self, connection, *keys):
+        sets = self._sets(keys)
+        return sorted(set.union(*sets))
+
+    def cmd_sdiff(self, connection, *keys):
+        sets = self._sets(keys)
+        return sorted(set.difference(*sets))
+
+    def cmd_sinterstore(self, connection, destination, *keys):
+        return self._store(destination, set.intersection(*self._sets(keys)))
+
+    def cmd_sunionstore(self, connection, destination, *keys):
+        return self._store(destination, set.union(*self._sets(keys)))
+
+    def cmd_sdiffstore(self, connection, destination, *keys):
+        return self._store(destination, set.difference(*self._sets(keys)))
+
+    #### SORTED SETS ####
+    def _range_reply(self, items, withscores):
+        if not withscores:
+            return [member for member, _ in items]
+        reply = []
+        for member, score in items:
+            reply.append(member)
+            reply.append(format_score(score))
+        return reply
+
+    def _score_range(self, key, low, high, reverse):
+        low, low_exclusive = parse_score(low)
+        high, high_exclusive = parse_score(high)
+        items = []
+        for member, score in (self._get(key, SortedSet) or SortedSet()).ordered():
+            if score < low or (low_exclusive and score == low):
+                continue
+            if score > high or (high_exclusive and score == high):
+                continue
+            items.append((member, score))
+        if reverse:
+            items.reverse()
+        return items
+
+    def cmd_zadd(self, connection, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise WrongArity
+        scores = [to_float(score) for score in pairs[::2]]
+        zset = self._get_or_create(key, SortedSet)
+        added = 0
+        for score, member in zip(scores, pairs[1::2]):
+            added += member not in zset
+            zset[member] = score
+        return added
+
+    def cmd_zincrby(self, connection, key, amount, member):
+        zset = self._get_or_create(key, SortedSet)
+        score = zset.get(member, 0.0) + to_float(amount)
+        zset[member] = score
+        return format_score(score)
+
+    def cmd_zrem(self, connection, key, *members):
+        if not members:
+            raise WrongArity
+        zset = self._get(key, SortedSet)
+        if zset is None:
+            return 0
+        removed = len([zset.pop(member) for member in members if member in zset])
+        self._cleanup(key, zset)
+        return removed
+
+    def cmd_zcard(self, connection, key):
+        return len(self._get(key, SortedSet) or ())
+
+    def cmd_zscore(self, connection, key, member):
+        score = (self._get(key, SortedSet) or {}).get(member)
+        if score is None:
+            return None
+        return format_score(score)
+
+    def cmd_zcount(self, connection, key, low, high):
+        return len(self._score_range(key, low, high, False))
+
+    def _rank(self, key, member, reverse):
+        zset = self._get(key, SortedSet)
+        if not zset or member not in zset:
+            return None
+        members = [item[0] for item in zset.ordered()]
+        if reverse:
+            members.reverse()
+        return members.index(member)
+
+    def cmd_zrank(self, connection, key, member):
+        return self._rank(key, member, False)
+
+    def cmd_zrevrank(self, connection, key, member):
+        return self._rank(key, member, True)
+
+    def _zrange(self, key, start, end, args, reverse):
+        withscores = [arg.upper() for arg in args] == ['WITHSCORES']
+        if args and not withscores:
+            raise RedisError(SYNTAX)
+        items = (self._get(key, SortedSet) or SortedSet()).ordered()
+        if reverse:
+            items.reverse()
+        start, stop = index_range(len(items), start, end)
+        return self._range_reply(items[start:stop], withscores)
+
+    def cmd_zrange(self, connection, key, start, end, *args):
+        return self._zrange(key, start, end, args, False)
+
+    def cmd_zrevrange(self, connection, key, start, end, *args):
+        return self._zrange(key, start, end, args, True)
+
+    def _zrangebyscore(self, key, low, high, args, reverse):
+        withscores = False
+        offset, count = 0, None
+        args = list(args)
+        while args:
+            option = args.pop(0).upper()
+            if option == 'WITHSCORES':
+                withscores = True
+            elif option == 'LIMIT':
+                offset, count = to_int(args.pop(0)), to_int(args.pop(0))
+            else:
+                raise RedisError(SYNTAX)
+        items = self._score_range(key, low, high, reverse)[offset:]
+        if count is not None and count >= 0:
+            items = items[:count]
+        return self._range_reply(items, withscores)
+
+    def cmd_zrangebyscore(self, connection, key, low, high, *args):
+        return self._zrangebyscore(key, low, high, args, False)
+
+    def cmd_zrevrangebyscore(self, connection, key, high, low, *args):
+        return self._zrangebyscore(key, low, high, args, True)
+
+    def cmd_zremrangebyrank(self, connection, key, start, end):
+        zset = self._get(key, SortedSet)
+        if zset is None:
+            return 0
+        items = zset.ordered()
+        start, stop = index_range(len(items), start, end)
+        for member, _ in items[start:stop]:
+            del zset[member]
+        self._cleanup(key, zset)
+        return max(stop - start, 0)
+
+    def cmd_zremrangebyscore(self, connection, key, low, high):
+        items = self._score_range(key, low, high, False)
+        zset = self._get(key, SortedSet)
+        for member, _ in items:
+            del zset[member]
+        if zset is not None:
+            self._cleanup(key, zset)
+        return len(items)
+
+    def cmd_zscan(self, connection, key, cursor, *args):
+        zset = self._get(key, SortedSet) or SortedSet()
+        cursor, members = self._scan(sorted(zset), cursor, args)
+        return cursor, self._range_reply([(member, zset[member]) for member in members], True)
+
+    def _zstore(self, destination, numkeys, args, union):
+        numkeys = to_int(numkeys)
+        keys = args[:numkeys]
+        if len(keys) < numkeys:
+            raise RedisError(SYNTAX)
+        weights = [1.0] * numkeys
+        aggregate = 'SUM'
+        args = list(args[numkeys:])
+        while args:
+            option = args.pop(0).upper()
+            if option == 'WEIGHTS':
+                weights = [to_float(args.pop(0)) for _ in xrange(numkeys)]
+            elif option == 'AGGREGATE':
+                aggregate = args.pop(0).upper()
+            else:
+                raise RedisError(SYNTAX)
+        combine = {'SUM': lambda a, b: a + b, 'MIN': min, 'MAX': max}[aggregate]
+        zsets = []
+        for key in keys:
+            value = self.data.get(key)
+            if type(value) is set:
+                value = SortedSet.fromkeys(value, 1.0)
+            else:
+                value = self._get(key, SortedSet) or SortedSet()
+            zsets.append(value)
+        result = SortedSet()
+        members = set().union(*zsets) if union else set(zsets[0]).intersection(*zsets[1:])
+        for member in members:
+            score = None
+            for zset, weight in zip(zsets, weights):
+                if member in zset:
+                    weighted = zset[member] * weight
+                    score = weighted if score is None else combine(score, weighted)
+            result[member] = score
+        return self._store(destination, result)
+
+    def cmd_zunionstore(self, connection, destination, numkeys, *args):
+        return self._zstore(destination, numkeys, args, True)
+
+    def cmd_zinterstore(self, connection, destination, numkeys, *args):
+        return self._zstore(destination, numkeys, args, False)
+
+    #### HASHES ####
+    def cmd_hset(self, connection, key, field, value):
+        fields = self._get_or_create(key, dict)
+        added = field not in fields
+        fields[field] = value
+        return int(added)
+
+    def cmd_hsetnx(self, connection, key, field, value):
+        fields = self._get_or_create(key, dict)
+        if field in fields:
+            return 0
+        fields[field] = value
+        return 1
+
+    def cmd_hmset(self, connection, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise WrongArity
+        fields = self._get_or_create(key, dict)
+        for i in xrange(0, len(pairs), 2):
+            fields[pairs[i]] = pairs[i + 1]
+        return OK
+
+    def cmd_hget(self, connection, key, field):
+        return (self._get(key, dict) or {}).get(field)
+
+    def cmd_hmget(self, connection, key, *fields):
+        values = self._get(key, dict) or {}
+        return [values.get(field) for field in fields]
+
+    def cmd_hgetall(self, connection, key):
+        reply = []
+        for field, value in sorted((self._get(key, dict) or {}).iteritems()):
+            reply.append(field)
+            reply.append(value)
+        return reply
+
+    def cmd_hkeys(self, connection, key):
+        return sorted(self._get(key, dict) or ())
+
+    def cmd_hvals(self, connection, key):
+        fields = self._get(key, dict) or {}
+        return [fields[field] for field in sorted(fields)]
+
+    def cmd_hlen(self, connection, key):
+        return len(self._get(key, dict) or ())
+
+    def cmd_hexists(self, connection, key, field):
+        return int(field in (self._get(key, dict) or ()))
+
+    def cmd_hdel(self, connection, key, *fields):
+        if not fields:
+            raise WrongArity
+        values = self._get(key, dict)
+        if values is None:
+            return 0
+        removed = len([values.pop(field) for field in fields if field in values])
+        self._cleanup(key, values)
+        return removed
+
+    def cmd_hincrby(self, connection, key, field, amount):
+        fields = self._get_or_create(key, dict)
+        value = to_int(fields.get(field, '0')) + to_int(amount)
+        fields[field] = str(value)
+        return value
+
+    def cmd_hscan(self, connection, key, cursor, *args):
+        values = self._get(key, dict) or {}
+        cursor, fields = self._scan(sorted(values), cursor, args)
+        reply = []
+        for field in fields:
+            reply.append(field)
+            reply.append(values[field])
+        return cursor, reply
+
+    #### PUBSUB ####
+    def cmd_publish(self, connection, channel, message):
+        receivers = 0
+        subscribers = self.channels.get(channel)
+        if subscribers:
+            pieces = encode_reply(['message', channel, message], [])
+            for subscriber in list(subscribers):
+                subscriber.send(pieces)
+            receivers += len(subscribers)
+        for pattern, subscribers in self.patterns.items():
+            if fnmatch.fnmatchcase(channel, pattern):
+                pieces = encode_reply(['pmessage', pattern, channel, message], [])
+                for subscriber in list(subscribers):
+                    subscriber.send(pieces)
+                receivers += len(subscribers)
+        return receivers
+
+    def _subscribe(self, connection, kind, registry, subscriptions, names):
+        if not names:
+            raise WrongArity
+        replies = Replies()
+        for name in names:
+            subscriptions.add(name)
+            registry.setdefault(name, set()).add(connection)
+            replies.append([kind, name, len(connection.channels) + len(connection.patterns)])
+        return replies
+
+    def _unsubscribe(self, connection, registry, subscriptions, names, kind=None):
+        replies = Replies()
+        for name in names or sorted(subscriptions):
+            subscriptions.discard(name)
+            subscribers = registry.get(name)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del registry[name]
+            replies.append([kind, name, len(connection.channels) + len(connection.patterns)])
+        return replies
+
+    def cmd_subscribe(self, connection, *channels):
+        return self._subscribe(connection, 'subscribe', self.channels,
+                               connection.channels, channels)
+
+    def cmd_psubscribe(self, connection, *patterns):
+        return self._subscribe(connection, 'psubscribe', self.patterns,
+                               connection.patterns, patterns)
+
+    def cmd_unsubscribe(self, connection, *channels):
+        return self._unsubscribe(connection, self.channels, connection.channels,
+                                 channels, 'unsubscribe')
+
+    def cmd_punsubscribe(self, connection, *patterns):
+        return self._unsubscribe(connection, self.patterns, connection.patterns,
+                                 patterns, 'punsubscribe')
+
+
+class FakeRedisCluster(object):
+    """FakeRedisServers sharing the slots of a Redis Cluster.
+
+    Example usage::
+
+        cluster = FakeRedisCluster(3)
+        cluster.start()
+        redis_client = RedisClusterClient([('127.0.0.1', cluster.nodes[0].port)])
+
+    The slots are split evenly between the ``size`` nodes.  A node answers
+    CLUSTER SLOTS, and MOVED to the commands on keys of a slot it does not
+    own, CROSSSLOT to those on keys of several slots.  ``move_slot`` hands
+    a slot and its keys over to another node, as resharding does.
+    ``migrate_slot`` starts such a move: the owner answers ASK to the
+    commands on keys it does not hold, which the target only accepts after
+    ASKING, until ``move_slot`` completes it.
+    """
+
+    def __init__(self, size=3, host='127.0.0.1', **options):
+        self.host = host
+        self.nodes = [FakeRedisServer(host, cluster=self, **options) for _ in xrange(size)]
+        self.slots = [self.nodes[slot * size // SLOT_COUNT] for slot in xrange(SLOT_COUNT)]
+        # slot -> node it is being migrated to
+        self.migrating = {}
+
+    def start(self):
+        for node in self.nodes:
+            node.start()
+
+    def stop(self):
+        for node in self.nodes:
+            node.stop()
+
+    def slot_ranges(self):
+        """The reply to CLUSTER SLOTS"""
+        ranges = []
+        slots = self.slots
+        start = 0
+        for slot in xrange(1, SLOT_COUNT + 1):
+            if slot == SLOT_COUNT or slots[slot] is not slots[start]:
+                ranges.append([start, slot - 1, [self.host, slots[start].port]])
+                start = slot
+        return ranges
+
+    def migrate_slot(self, slot, node):
+        """Start moving ``slot`` to ``node``"""
+        self.migrating[slot] = node
+
+    def move_slot(self, slot, node):
+        """Give ``slot`` and its keys to ``node``"""
+        owner = self.slots[slot]
+        for key in [key for key in owner.data if key_slot(key) == slot]:
+            node.data[key] = owner.data.pop(key)
+            if key in owner.expires:
+                node.expires[key] = owner.expires.pop(key)
+        self.slots[slot] = node
+        self.migrating.pop(slot, None)
+
+    def redirect(self, node, connection, request):
+        """
+        Return the error redirecting ``request`` sent to ``node``, None if
+        it can run there
+        """
+        asking = connection.asking
+        connection.asking = False
+        command = COMMANDS.get(request[0].upper())
+        if command is None:
+            return None
+        keys = command.keys(request[1:])
+        if not keys:
+            return None
+        slots = set([key_slot(key) for key in keys])
+        if len(slots) > 1:
+            return RedisError("CROSSSLOT Keys in request don't hash to the same slot")
+        slot = slots.pop()
+        owner = self.slots[slot]
+        target = self.migrating.get(slot)
+        if owner is node:
+            if target is not None and [key for key in keys if key not in node.data]:
+                return RedisError('ASK %d %s:%d' % (slot, self.host, target.port))
+            return None
+        if asking and target is node:
+            return None
+        return RedisError('MOVED %d %s:%d' % (slot, self.host, owner.port))
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Per command statistics and hooks around the round trips of a RedisClient"""
+
+import time
+from collections import namedtuple
+
+from geventredis.wire_protocol import RedisError
+
+CommandEvent = namedtuple('CommandEvent', [
+    'name', 'elapsed', 'pool_wait', 'bytes_sent', 'bytes_received', 'errors', 'exception'])
+
+
+class CommandStats(object):
+    """Counters and a latency histogram of one command name.
+
+    The histogram has a bucket per power of two microseconds, so recording
+    is a couple of additions and percentiles are within a factor of two.
+    """
+
+    __slots__ = ('calls', 'errors', 'failures', 'total', 'max', 'bytes_sent',
+                 'bytes_received', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.failures = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.buckets = [0] * 32
+
+    def record(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.buckets[min(int(elapsed * 1000000).bit_length(), 31)] += 1
+
+    def percentile(self, percent):
+        """Upper bound in microseconds of the ``percent`` fastest calls"""
+        wanted = self.calls * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                return min(1 << index, int(self.max * 1000000))
+        return 0
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'failures': self.failures,
+            'total_seconds': self.total,
+            'mean_us': int(self.total * 1000000 / self.calls) if self.calls else 0,
+            'p50_us': self.percentile(50),
+            'p99_us': self.percentile(99),
+            'max_us': int(self.max * 1000000),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            # upper bound in microseconds -> calls
+            'histogram': dict((1 << index, count)
+                              for index, count in enumerate(self.buckets) if count),
+        }
+
+
+class Instrumentation(object):
+    """Measures the round trips of the RedisClients it is given to.
+
+    Example usage::
+
+        instrumentation = Instrumentation()
+        redis_client = geventredis.connect('127.0.0.1', 6379,
+                                           instrumentation=instrumentation)
+        instrumentation.add_hook(after=lambda event: log.debug('%r', event))
+        ...
+        metrics.publish(instrumentation.to_dict())
+
+    For every command, pipeline (named PIPELINE) and streamed reply, it
+    keeps the number of calls, error replies, exceptions raised, bytes
+    sent and received and a latency histogram, along with gauges of the
+    requests in flight and of the greenlets waiting for a pooled
+    connection, and statistics of that wait.  The latency covers the
+    checkout, the send and the reading of every reply.  Bytes received
+    are not counted on multiplexed connections, which share their socket.
+
+    Hooks are optional: ``before(name, bytes_sent)`` is called before the
+    connection is checked out and ``after(event)`` once the replies are
+    read, with a CommandEvent.  A hook raising propagates to the caller.
+    A client without instrumentation pays nothing but an attribute test.
+    """
+
+    def __init__(self):
+        self.before_hooks = []
+        self.after_hooks = []
+        self.in_flight = 0
+        self.waiting = 0
+        self.reset()
+
+    def reset(self):
+        """Clear the counters, but not the gauges or the hooks"""
+        self.commands = {}
+        self.pool_waits = 0
+        self.pool_wait_total = 0.0
+        self.pool_wait_max = 0.0
+
+    def add_hook(self, before=None, after=None):
+        if before is not None:
+            self.before_hooks.append(before)
+        if after is not None:
+            self.after_hooks.append(after)
+
+    def remove_hook(self, before=None, after=None):
+        if before is not None:
+            self.before_hooks.remove(before)
+        if after is not None:
+            self.after_hooks.remove(after)
+
+    def start(self, name, bytes_sent):
+        """Account for a request about to check a connection out"""
+        for hook in self.before_hooks:
+            hook(name, bytes_sent)
+        self.in_flight += 1
+        self.waiting += 1
+        return time.time()
+
+    def checked_out(self, start):
+        """Account for the end of the wait for a connection"""
+        self.waiting -= 1
+        now = time.time()
+        wait = now - start
+        self.pool_waits += 1
+        self.pool_wait_total += wait
+        if wait > self.pool_wait_max:
+            self.pool_wait_max = wait
+        return now
+
+    def finish(self, name, start, checked_out, bytes_sent, bytes_received,
+               result, exception=None):
+        """
+        Record a request started at ``start`` that got a connection at
+        ``checked_out``, None if it never did, and returned ``result`` or
+        raised ``exception``
+        """
+        elapsed = time.time() - start
+        self.in_flight -= 1
+        if checked_out is None:
+            self.waiting -= 1
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats()
+        stats.record(elapsed)
+        stats.bytes_sent += bytes_sent
+        stats.bytes_received += bytes_received or 0
+        errors = 0
+        if exception is not None:
+            stats.failures += 1
+        elif isinstance(result, RedisError):
+            errors = 1
+        elif isinstance(result, list) and name == 'PIPELINE':
+            for reply in result:
+                if isinstance(reply, RedisError):
+                    errors += 1
+        stats.errors += errors
+        if self.after_hooks:
+            pool_wait = checked_out - start if checked_out is not None else elapsed
+            event = CommandEvent(name, elapsed, pool_wait, bytes_sent, bytes_received,
+                                 errors, exception)
+            for hook in self.after_hooks:
+                hook(event)
+
+    def to_dict(self):
+        """Return the counters and gauges as plain dicts and numbers"""
+        return {
+            'commands': dict((name, stats.to_dict())
+                             for name, stats in self.commands.iteritems()),
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'pool_wait': {
+                'count': self.pool_waits,
+                'total_seconds': self.pool_wait_total,
+                'max_us': int(self.pool_wait_max * 1000000),
+            },
+        }
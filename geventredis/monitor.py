@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Online profiling of the command stream of MONITOR"""
+
+import random
+import re
+from collections import namedtuple
+
+import gevent
+
+from geventredis.commands import COMMANDS
+
+MonitorEvent = namedtuple('MonitorEvent', 'timestamp db client command args')
+
+# '1318055499.218114 [0 127.0.0.1:51234] "set" "foo" "bar"', servers older
+# than 2.6 leave the bracketed part out
+MONITOR_LINE = re.compile(r'(\d+\.\d+)(?: \[(\d+) ([^\]]*)\])? (".*)$')
+QUOTED_ARGUMENT = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+def parse_monitor_line(line):
+    """
+    Parse a line yielded by ``monitor`` into a MonitorEvent, or return None
+    if it is not a command, e.g. the OK reply to MONITOR itself
+    """
+    match = MONITOR_LINE.match(line)
+    if match is None:
+        return None
+    timestamp, db, client, quoted = match.groups()
+    # arguments are quoted the way sdscatrepr does, which string_escape
+    # knows how to undo
+    args = [arg.decode('string_escape') for arg in QUOTED_ARGUMENT.findall(quoted)]
+    if not args:
+        return None
+    if db is not None:
+        db = int(db)
+    return MonitorEvent(float(timestamp), db, client, args[0].upper(), args[1:])
+
+
+class SpaceSaving(object):
+    """Approximate top-K counter over a stream using ``capacity`` counters.
+
+    Any item whose true count exceeds ``total / capacity`` is guaranteed to
+    be tracked.  A tracked count may overestimate the true one by at most
+    its error, the count of the item it replaced.
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.total = 0
+        # item -> [count, error]
+        self.counters = {}
+
+    def add(self, item, weight=1):
+        self.total += weight
+        counters = self.counters
+        counter = counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(counters) < self.capacity:
+            counters[item] = [weight, 0]
+        else:
+            smallest = min(counters, key=lambda k: counters[k][0])
+            count = counters.pop(smallest)[0]
+            counters[item] = [count + weight, count]
+
+    def top(self, n=None):
+        """Return the ``n`` largest (item, count, error), largest first"""
+        items = sorted(self.counters.iteritems(), key=lambda i: -i[1][0])
+        return [(item, count, error) for item, (count, error) in items[:n]]
+
+
+class MonitorAnalyzer(object):
+    """Aggregates a MONITOR stream into bounded, periodic profiles.
+
+    Example usage::
+
+        analyzer = MonitorAnalyzer(sample_rate=0.1, top_k=50)
+        analyzer.run(redis_client, interval=10, callback=pprint.pprint)
+
+    Each event is kept with probability ``sample_rate`` and only updates
+    counters: per-command counts, the ``top_k`` most accessed keys and the
+    ``top_k`` key prefixes (the part of the key before
+    ``prefix_separator``) moving the most bytes, both tracked with a
+    SpaceSaving sketch, so memory stays bounded whatever the key space.
+
+    ``snapshot`` returns the aggregates of the current window with counts
+    scaled back by the sample rate and rates per second of server time.
+    """
+
+    def __init__(self, sample_rate=1.0, top_k=100, prefix_separator=':'):
+        self.sample_rate = sample_rate
+        self.top_k = top_k
+        self.prefix_separator = prefix_separator
+        self.reset()
+
+    def reset(self):
+        """Start a new window"""
+        self.events = 0
+        self.sampled = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.commands = {}
+        self.keys = SpaceSaving(self.top_k)
+        self.prefixes = SpaceSaving(self.top_k)
+
+    def feed(self, line):
+        """Account for one line yielded by ``monitor``, or a MonitorEvent"""
+        if isinstance(line, MonitorEvent):
+            event = line
+            timestamp = event.timestamp
+        else:
+            # only the timestamp is read from the lines left out of the
+            # sample, the rest is parsed once the line is kept
+            event = None
+            try:
+                timestamp = float(line.partition(' ')[0])
+            except ValueError:
+                return
+        self.events += 1
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        self.last_timestamp = timestamp
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        if event is None:
+            event = parse_monitor_line(line)
+            if event is None:
+                return
+        self.sampled += 1
+        commands = self.commands
+        name = event.command
+        commands[name] = commands.get(name, 0) + 1
+        args = event.args
+        # commands missing from the table (AUTH, SELECT, CLIENT...) have
+        # no known keys, and their arguments may be passwords
+        command = COMMANDS.get(name)
+        if command is None:
+            return
+        keys = command.keys(args)
+        if not keys:
+            return
+        size = sum([len(arg) for arg in args])
+        share = size // len(keys) or 1
+        separator = self.prefix_separator
+        for key in keys:
+            self.keys.add(key)
+            self.prefixes.add(key.split(separator, 1)[0], share)
+
+    def snapshot(self, reset=False):
+        """
+        Return the aggregates of the current window as a dict, starting a
+        new window afterwards if ``reset`` is true
+        """
+        scale = 1.0 / self.sample_rate
+        elapsed = 0.0
+        if self.first_timestamp is not None:
+            elapsed = self.last_timestamp - self.first_timestamp
+        commands = {}
+        for name, count in self.commands.iteritems():
+            commands[name] = {
+                'count': int(count * scale),
+                'rate': count * scale / elapsed if elapsed else None,
+            }
+        snapshot = {
+            'start': self.first_timestamp,
+            'elapsed': elapsed,
+            'events': self.events,
+            'sampled': self.sampled,
+            'commands': commands,
+            'top_keys': [(key, int(count * scale), int(error * scale))
+                         for key, count, error in self.keys.top()],
+            'top_prefixes': [(prefix, int(size * scale), int(error * scale))
+                             for prefix, size, error in self.prefixes.top()],
+        }
+        if reset:
+            self.reset()
+        return snapshot
+
+    def run(self, redis_client, interval=60, callback=None, duration=None):
+        """
+        Feed the output of ``redis_client.monitor()`` to the analyzer,
+        passing a snapshot to ``callback`` and starting a new window every
+        ``interval`` seconds, for ``duration`` seconds or forever.  Return
+        the snapshot of the last window.
+
+        Snapshots and the end are timed by greenlets of their own, so they
+        happen on time even when the server is idle.
+        """
+        feed = self.feed
+        monitor = redis_client.monitor()
+        ticker = gevent.spawn(self._tick, interval, callback)
+        try:
+            with gevent.Timeout(duration, False):
+                for line in monitor:
+                    feed(line)
+        finally:
+            ticker.kill()
+            monitor.close()
+        return self.snapshot()
+
+    def _tick(self, interval, callback):
+        while True:
+            gevent.sleep(interval)
+            snapshot = self.snapshot(reset=True)
+            if callback is not None:
+                callback(snapshot)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""One RedisSocket shared by many greenlets with automatic pipelining"""
+
+from collections import deque
+
+import gevent
+from gevent.event import AsyncResult, Event
+from gevent.lock import Semaphore
+
+from geventredis.pool import ConnectionPool
+from geventredis.wire_protocol import RedisError, iter_reply, pack_command
+
+
+class MultiplexedConnection(object):
+    """Multiplexes the commands of many greenlets on one RedisSocket.
+
+    Callers never touch the socket: they queue their packed request and
+    wait on an AsyncResult.  A writer greenlet sends everything queued
+    since it last ran in one ``_send_packed`` call, so all the commands
+    issued during one event loop iteration share one write, and a reader
+    greenlet hands the replies out in FIFO order, which is the order the
+    server answers in.  Any number of requests can be in flight at once.
+
+    A socket error fails every pending request and closes the connection
+    for good; MultiplexedConnectionPool opens a new one on the next call.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.closed = False
+        self._outgoing = []
+        self._pending = deque()
+        self._outgoing_event = Event()
+        self._pending_event = Event()
+        self._writer = gevent.spawn(self._write_loop)
+        self._reader = gevent.spawn(self._read_loop)
+
+    def _execute_command(self, *args):
+        return self._execute_packed(pack_command(*args))
+
+    def _execute_packed(self, buffers, count=None):
+        """
+        Queue already packed commands and wait for their replies, a list of
+        ``count`` results, or a single result if ``count`` is None
+        """
+        if self.closed:
+            raise RedisError('Multiplexed connection is closed')
+        result = AsyncResult()
+        self._outgoing.extend(buffers)
+        self._pending.append((result, count))
+        self._outgoing_event.set()
+        self._pending_event.set()
+        return result.get()
+
+    def _execute_iter_command(self, *args):
+        # The shared socket cannot be held while the caller iterates, so
+        # the reply is read in full and iterated afterwards.
+        return iter_reply(self._execute_command(*args))
+
+    def _execute_yield_command(self, *args):
+        raise RedisError('%s needs a dedicated connection' % args[0])
+
+    def close(self):
+        """Close the socket, failing the requests still waiting for a reply"""
+        self._fail(RedisError('Multiplexed connection is closed'))
+
+    def _write_loop(self):
+        outgoing_event = self._outgoing_event
+        send_packed = self.connection._send_packed
+        try:
+            while True:
+                outgoing_event.wait()
+                outgoing_event.clear()
+                outgoing = self._outgoing
+                self._outgoing = []
+                send_packed(outgoing)
+        except Exception, e:
+            self._fail(e)
+
+    def _read_loop(self):
+        pending = self._pending
+        pending_event = self._pending_event
+        read_response = self.connection._read_response
+        try:
+            while True:
+                while not pending:
+                    pending_event.clear()
+                    pending_event.wait()
+                result, count = pending[0]
+                if count is None:
+                    reply = read_response()
+                else:
+                    reply = [read_response() for _ in xrange(count)]
+                pending.popleft()
+                result.set(reply)
+        except Exception, e:
+            self._fail(e)
+
+    def _fail(self, exception):
+        if self.closed:
+            return
+        self.closed = True
+        self.connection.close()
+        pending = self._pending
+        while pending:
+            result, _ = pending.popleft()
+            result.set_exception(exception)
+        current = gevent.getcurrent()
+        for greenlet in (self._writer, self._reader):
+            if greenlet is not current:
+                greenlet.kill(block=False)
+
+
+class MultiplexedConnectionPool(ConnectionPool):
+    """Hands the same MultiplexedConnection out to every caller.
+
+    The shared connection is opened on first use and reopened on the first
+    call after it failed.  Streaming commands still get a dedicated
+    connection from ``make_connection``.
+    """
+
+    def __init__(self, host='localhost', port=6379, timeout=None, **kwargs):
+        ConnectionPool.__init__(self, host, port, timeout, **kwargs)
+        self._connection = None
+        self._connect_lock = Semaphore()
+
+    def get_connection(self):
+        connection = self._connection
+        if connection is None or connection.closed:
+            with self._connect_lock:
+                connection = self._connection
+                if connection is None or connection.closed:
+                    connection = MultiplexedConnection(self.make_connection())
+                    self._connection = connection
+        if self.scripts:
+            self.load_scripts(connection)
+        return connection
+
+    def release(self, connection):
+        pass
+
+    def discard(self, connection):
+        # The shared connection fails its own pending requests when its
+        # socket breaks; one caller giving up must not close it for others.
+        pass
+
+    def reap(self):
+        pass
+
+    def disconnect(self):
+        connection = self._connection
+        if connection is not None:
+            connection.close()
+            self._connection = None
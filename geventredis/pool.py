@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Connection pool shared by the greenlets of a RedisClient"""
+
+import random
+import select
+import time
+from collections import deque
+from errno import ECONNREFUSED
+
+from gevent.event import AsyncResult
+from gevent.socket import error, IPPROTO_TCP, TCP_NODELAY
+
+from geventredis.commands import COMMANDS
+from geventredis.wire_protocol import RedisError, RedisSocket
+
+SCRIPT_LOAD = COMMANDS['SCRIPT LOAD']
+
+
+class ConnectionPool(object):
+    """A bounded pool of RedisSocket connections.
+
+    Example usage::
+
+        pool = ConnectionPool('127.0.0.1', 6379, max_connections=10)
+        connection = pool.get_connection()
+        try:
+            result = connection._execute_command('GET', 'foo')
+        except:
+            pool.discard(connection)
+            raise
+        pool.release(connection)
+
+    At most ``max_connections`` connections are checked out at a time;
+    ``get_connection`` blocks until one is released, or raises RedisError
+    after ``checkout_timeout`` seconds.  Waiting greenlets are served in
+    the order they arrived: a released slot is handed to the oldest of
+    them, so a greenlet checking out again right after a release queues
+    behind them instead of taking the slot back.  Released connections are kept idle
+    and reused most-recently-used first, so connections that stay idle for
+    more than ``idle_timeout`` seconds are closed and dropped.  An idle
+    connection is only handed out again if the server has not closed it
+    and has nothing unexpected waiting on it.
+
+    Connections parse replies with ``reader_class``, PythonReader by
+    default; pass HiredisReader to use the hiredis C parser.
+
+    After a failed connection attempt, no other is made for
+    ``reconnect_backoff`` seconds, doubling with each consecutive failure
+    up to ``max_reconnect_backoff`` and jittered down by up to half, so
+    greenlets do not hammer a server that is down: meanwhile
+    ``make_connection`` raises socket.error right away, and
+    ``retry_delay`` tells how long is left.
+
+    The Lua scripts in ``scripts`` (see RedisClient.register_script) are
+    loaded on each connection before it is first handed out, so EVALSHA
+    finds them even on a server that was just restarted.
+    """
+
+    def __init__(self, host='localhost', port=6379, timeout=None,
+                 max_connections=50, checkout_timeout=None, idle_timeout=300,
+                 connection_class=RedisSocket, reader_class=None,
+                 reconnect_backoff=0.05, max_reconnect_backoff=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.connection_class = connection_class
+        self.reader_class = reader_class
+        self.reconnect_backoff = reconnect_backoff
+        self.max_reconnect_backoff = max_reconnect_backoff
+        # free checkout slots, and the AsyncResults of the greenlets waiting
+        # for one, oldest first
+        self._free_slots = max_connections
+        self._waiters = deque()
+        self._idle = deque()
+        self._connect_failures = 0
+        self._retry_at = 0
+        # SHA1 -> body of the scripts loaded on every connection handed out
+        self.scripts = {}
+
+    def make_connection(self):
+        """Open a new connection that is not accounted for by the pool"""
+        delay = self.retry_delay()
+        if delay:
+            raise error(ECONNREFUSED, 'Not reconnecting to %s:%s for %.3fs after %d failures'
+                        % (self.host, self.port, delay, self._connect_failures))
+        connection = self.connection_class(reader_class=self.reader_class)
+        connection.settimeout(self.timeout)
+        try:
+            connection.connect((self.host, self.port))
+        except:
+            connection.close()
+            self._connect_failures += 1
+            backoff = min(self.reconnect_backoff * 2 ** (self._connect_failures - 1),
+                          self.max_reconnect_backoff)
+            self._retry_at = time.time() + backoff * random.uniform(0.5, 1.0)
+            raise
+        self._connect_failures = 0
+        # large values are written separately from their framing, which
+        # must not wait for delayed ACKs
+        connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        return connection
+
+    def _acquire_slot(self):
+        if self._free_slots and not self._waiters:
+            self._free_slots -= 1
+            return
+        waiter = AsyncResult()
+        self._waiters.append(waiter)
+        try:
+            waiter.wait(self.checkout_timeout)
+        except:
+            # killed while waiting: give back a slot handed meanwhile
+            if waiter.ready():
+                self._release_slot()
+            else:
+                self._waiters.remove(waiter)
+            raise
+        if not waiter.ready():
+            self._waiters.remove(waiter)
+            raise RedisError('Timed out waiting for a connection from the pool')
+
+    def _release_slot(self):
+        if self._waiters:
+            self._waiters.popleft().set()
+        else:
+            self._free_slots += 1
+
+    def get_connection(self):
+        """Check a connection out of the pool, opening one if none is idle"""
+        self._acquire_slot()
+        try:
+            self.reap()
+            idle = self._idle
+            while idle:
+                connection, _ = idle.pop()
+                if self._is_healthy(connection):
+                    break
+                connection.close()
+            else:
+                connection = self.make_connection()
+            if self.scripts:
+                self.load_scripts(connection)
+            return connection
+        except:
+            self._release_slot()
+            raise
+
+    def load_scripts(self, connection):
+        """
+        Send SCRIPT LOAD for the registered scripts ``connection`` has not
+        loaded yet, all in one round trip
+        """
+        loaded = getattr(connection, 'loaded_scripts', None)
+        if loaded is None:
+            loaded = connection.loaded_scripts = set()
+        scripts = self.scripts
+        if len(loaded) == len(scripts):
+            return
+        missing = [sha for sha in scripts if sha not in loaded]
+        buffers = []
+        for sha in missing:
+            buffers.extend(SCRIPT_LOAD.pack((scripts[sha],)))
+        try:
+            # errors, e.g. of compilation, are left to EVAL to report
+            connection._execute_packed(buffers, len(missing))
+        except:
+            connection.close()
+            raise
+        loaded.update(missing)
+
+    def retry_delay(self):
+        """Seconds before the next connection attempt is allowed"""
+        if not self._connect_failures:
+            return 0
+        return max(self._retry_at - time.time(), 0)
+
+    def release(self, connection):
+        """Return a connection to the pool after a complete reply was read"""
+        self._idle.append((connection, time.time()))
+        self._release_slot()
+
+    def discard(self, connection):
+        """
+        Close a checked out connection instead of returning it to the pool,
+        e.g. because an error left it in the middle of a reply
+        """
+        try:
+            connection.close()
+        finally:
+            self._release_slot()
+
+    def reap(self):
+        """Close the connections that have been idle for too long"""
+        idle = self._idle
+        deadline = time.time() - self.idle_timeout
+        while idle and idle[0][1] < deadline:
+            connection, _ = idle.popleft()
+            connection.close()
+
+    def disconnect(self):
+        """Close every idle connection"""
+        idle = self._idle
+        while idle:
+            connection, _ = idle.popleft()
+            connection.close()
+
+    def _is_healthy(self, connection):
+        # An idle connection must not be readable: that means the server
+        # closed it, or sent something no request of ours asked for.
+        # poll, unlike select, accepts descriptors above FD_SETSIZE.
+        poller = select.poll()
+        try:
+            poller.register(connection, select.POLLIN)
+            events = poller.poll(0)
+        except (select.error, error, ValueError):
+            return False
+        return not events
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Publish/subscribe on a dedicated connection"""
+
+from collections import namedtuple
+
+import gevent
+from gevent.lock import Semaphore
+from gevent.socket import error
+
+from geventredis.wire_protocol import RedisError, encode, pack_command
+
+# ``type`` is one of message, pmessage, subscribe, unsubscribe, psubscribe,
+# punsubscribe or pong.  ``pattern`` is only set for pattern subscriptions;
+# ``data`` is the payload, or the subscription count of a confirmation.
+Message = namedtuple('Message', 'type pattern channel data')
+
+
+def parse_message(reply):
+    """Convert a reply read in subscribed mode to a Message"""
+    if isinstance(reply, RedisError):
+        raise reply
+    kind = reply[0]
+    if kind == 'message':
+        return Message(kind, None, reply[1], reply[2])
+    if kind == 'pmessage':
+        return Message(kind, reply[1], reply[2], reply[3])
+    if kind in ('psubscribe', 'punsubscribe'):
+        return Message(kind, reply[1], None, reply[2])
+    if kind in ('subscribe', 'unsubscribe'):
+        return Message(kind, None, reply[1], reply[2])
+    return Message(kind, None, None, reply[1] if len(reply) > 1 else None)
+
+
+class PubSub(object):
+    """Subscriptions sharing one dedicated connection.
+
+    Example usage::
+
+        pubsub = redis_client.pubsub()
+        pubsub.subscribe('news', alerts=handle_alert)
+        pubsub.psubscribe('user.*')
+        for message in pubsub.listen():
+            print message.channel, message.data
+
+    Channels and patterns can be added or removed at any time, from any
+    greenlet, including while another one is reading.  Each wakeup of the
+    reader returns every complete message already received, so a busy
+    subscription costs one ``recv`` per batch of messages rather than per
+    message.
+
+    ``run`` reads and dispatches until ``close`` is called: a message goes
+    to the handler registered for its pattern or channel, called with the
+    Message, and otherwise is put on ``queue`` (any object with a ``put``
+    method, e.g. a ``gevent.queue.Queue``) if there is one.  Messages with
+    neither are dropped.
+    """
+
+    def __init__(self, connection_pool, queue=None):
+        self.connection_pool = connection_pool
+        self.queue = queue
+        self.connection = None
+        self.closed = False
+        # channel or pattern -> handler, None if there is none
+        self.channels = {}
+        self.patterns = {}
+        self._write_lock = Semaphore()
+
+    def subscribe(self, *channels, **handlers):
+        """
+        Subscribe to ``channels``, and to the keyword arguments' names with
+        their value as the handler
+        """
+        self._subscribe('SUBSCRIBE', self.channels, channels, handlers)
+
+    def psubscribe(self, *patterns, **handlers):
+        """
+        Subscribe to the channels matching ``patterns``, and the keyword
+        arguments' names with their value as the handler
+        """
+        self._subscribe('PSUBSCRIBE', self.patterns, patterns, handlers)
+
+    def unsubscribe(self, *channels):
+        """Unsubscribe from ``channels``, or from every channel if none"""
+        self._unsubscribe('UNSUBSCRIBE', self.channels, channels)
+
+    def punsubscribe(self, *patterns):
+        """Unsubscribe from ``patterns``, or from every pattern if none"""
+        self._unsubscribe('PUNSUBSCRIBE', self.patterns, patterns)
+
+    def _subscribe(self, name, subscriptions, names, handlers):
+        names = dict.fromkeys([encode(n) for n in names])
+        for n, handler in handlers.iteritems():
+            names[encode(n)] = handler
+        if not names:
+            raise RedisError('%s needs at least one channel' % name)
+        # handlers are in place before the server can send any message; a
+        # channel subscribed again without a handler keeps the one it has
+        for n, handler in names.iteritems():
+            if handler is not None or n not in subscriptions:
+                subscriptions[n] = handler
+        self._send(name, *names)
+
+    def _unsubscribe(self, name, subscriptions, names):
+        names = [encode(n) for n in names]
+        if names:
+            for n in names:
+                subscriptions.pop(n, None)
+        else:
+            subscriptions.clear()
+        if self.connection is not None:
+            self._send(name, *names)
+
+    def _send(self, *args):
+        if self.closed:
+            raise RedisError('PubSub is closed')
+        with self._write_lock:
+            if self.connection is None:
+                self.connection = self.connection_pool.make_connection()
+            self.connection._send_packed(pack_command(*args))
+
+    def get_messages(self):
+        """
+        Wait for the next message and return it along with every other one
+        already received, as a list of Message
+        """
+        if self.connection is None:
+            raise RedisError('Not subscribed to any channel or pattern')
+        return [parse_message(reply)
+                for reply in self.connection._read_responses()]
+
+    def listen(self):
+        """Yield messages as they arrive, until ``close`` is called"""
+        try:
+            while not self.closed:
+                for message in self.get_messages():
+                    yield message
+        except error:
+            if not self.closed:
+                raise
+
+    def dispatch(self, message):
+        """Hand a message to its handler, or to ``queue``"""
+        kind = message.type
+        if kind == 'message':
+            handler = self.channels.get(message.channel)
+        elif kind == 'pmessage':
+            handler = self.patterns.get(message.pattern)
+        else:
+            return
+        if handler is not None:
+            handler(message)
+        elif self.queue is not None:
+            self.queue.put(message)
+
+    def run(self):
+        """Read and dispatch messages until ``close`` is called"""
+        dispatch = self.dispatch
+        for message in self.listen():
+            dispatch(message)
+
+    def run_in_greenlet(self):
+        """Spawn a greenlet running ``run`` and return it"""
+        return gevent.spawn(self.run)
+
+    def close(self):
+        """Close the connection, which ends ``listen`` and ``run``"""
+        self.closed = True
+        self.channels.clear()
+        self.patterns.clear()
+        connection = self.connection
+        if connection is not None:
+            self.connection = None
+            connection.close()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Reads spread over replicas by response time, writes to the primary"""
+
+import time
+
+import gevent
+from gevent.socket import error
+
+from geventredis.client import RedisClient, RedisCommands
+from geventredis.commands import lookup_command
+from geventredis.wire_protocol import RedisError, RedisTimeoutError
+
+
+class Replica(object):
+    """Response time statistics of one replica"""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        # seconds, 0 until the first response
+        self.ewma = 0.0
+        self.in_flight = 0
+        self.ejected = False
+        self.ejections = 0
+
+    def score(self):
+        # waiting requests are expected to take as long each, so a fast
+        # replica is not piled on by every greenlet at once
+        return self.ewma * (self.in_flight + 1)
+
+    def __repr__(self):
+        return 'Replica(%r, ewma=%.6f, ejected=%r)' % (self.name, self.ewma, self.ejected)
+
+
+class ReplicatedRedisClient(RedisCommands):
+    """Sends writes to a primary and reads to the fastest replica.
+
+    Example usage::
+
+        redis_client = ReplicatedRedisClient(('10.0.0.1', 6379),
+                                             [('10.0.0.2', 6379),
+                                              ('10.0.0.3', 6379)])
+        redis_client.set('foo', 'bar')   # primary
+        redis_client.get('foo')          # a replica
+
+    Commands flagged readonly in the command table go to the replica with
+    the lowest exponentially weighted moving average of response time,
+    weighted by its requests in flight; ``decay`` is the weight of the
+    past in the average.  Everything else, pipelines included, goes to the
+    primary, and so do reads when every replica is ejected.  Replicas may
+    lag behind the primary, so reads that must see a write just made
+    should use ``primary``.
+
+    A replica is ejected when a request to it fails or exceeds the
+    ``command_timeout`` of the clients, which retries the read elsewhere,
+    or when its average exceeds ``slow_factor`` times the best one among
+    the replicas measured so far.  A greenlet then PINGs it every
+    ``probe_interval`` seconds and brings it back, with the measured time
+    as its average, once it answers fast enough again.  At least one
+    replica is kept in rotation for being slow.
+    """
+
+    def __init__(self, primary, replicas, timeout=None, decay=0.9,
+                 slow_factor=4.0, probe_interval=5, **pool_options):
+        host, port = primary
+        self.primary = RedisClient(host, port, timeout, **pool_options)
+        self.replicas = [Replica(RedisClient(host, port, timeout, **pool_options),
+                                 '%s:%d' % (host, port))
+                         for host, port in replicas]
+        self.decay = decay
+        self.slow_factor = slow_factor
+        self.probe_interval = probe_interval
+
+    def pipeline(self, transaction=False):
+        """Return a Pipeline on the primary"""
+        return self.primary.pipeline(transaction)
+
+    def _select(self):
+        best = None
+        best_score = None
+        for replica in self.replicas:
+            if replica.ejected:
+                continue
+            score = replica.score()
+            if best is None or score < best_score:
+                best = replica
+                best_score = score
+        return best
+
+    def _best_ewma(self):
+        # replicas not measured yet have no average to compare with
+        measured = [replica.ewma for replica in self.replicas
+                    if not replica.ejected and replica.ewma]
+        return min(measured) if measured else None
+
+    def _eject(self, replica):
+        if replica.ejected:
+            return
+        replica.ejected = True
+        replica.ejections += 1
+        gevent.spawn(self._probe, replica)
+
+    def _probe(self, replica):
+        while True:
+            gevent.sleep(self.probe_interval)
+            start = time.time()
+            try:
+                reply = replica.client.ping()
+            except (error, RedisTimeoutError):
+                continue
+            if isinstance(reply, RedisError):
+                continue
+            elapsed = time.time() - start
+            best = self._best_ewma()
+            if not best or elapsed <= best * self.slow_factor:
+                replica.ewma = elapsed
+                replica.ejected = False
+                return
+
+    def _read(self, replica, command, args, options):
+        """
+        Execute a command on ``replica`` and account for its time, failed
+        and timed out requests included
+        """
+        replica.in_flight += 1
+        start = time.time()
+        try:
+            return replica.client._execute(command, args, **options)
+        finally:
+            replica.in_flight -= 1
+            self._record(replica, time.time() - start)
+
+    def _record(self, replica, elapsed):
+        if replica.ewma:
+            decay = self.decay
+            replica.ewma = decay * replica.ewma + (1 - decay) * elapsed
+        else:
+            replica.ewma = elapsed
+        best = self._best_ewma()
+        if not replica.ejected and best and replica.ewma > best * self.slow_factor:
+            self._eject(replica)
+
+    def _execute(self, command, args, **options):
+        if not command.readonly:
+            return self.primary._execute(command, args, **options)
+        while True:
+            replica = self._select()
+            if replica is None:
+                return self.primary._execute(command, args, **options)
+            try:
+                return self._read(replica, command, args, options)
+            except (error, RedisTimeoutError):
+                self._eject(replica)
+
+    def _execute_packed(self, buffers, count):
+        return self.primary._execute_packed(buffers, count)
+
+    def _execute_iter_command(self, *args):
+        if lookup_command(args[0]).readonly:
+            replica = self._select()
+            if replica is not None:
+                return replica.client._execute_iter_command(*args)
+        return self.primary._execute_iter_command(*args)
+
+    def _execute_yield_command(self, *args):
+        return self.primary._execute_yield_command(*args)
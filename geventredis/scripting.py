@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Lua scripts executed by their SHA1"""
+
+import hashlib
+
+from geventredis.wire_protocol import RedisError, encode
+
+
+class Script(object):
+    """A Lua script executed with EVALSHA.
+
+    Example usage::
+
+        incr_max = redis_client.register_script('''
+            local value = redis.call('INCR', KEYS[1])
+            if value > tonumber(ARGV[1]) then
+                redis.call('DECR', KEYS[1])
+                return 0
+            end
+            return value''')
+        print incr_max(keys=['counter'], args=[10])
+
+    The SHA1 of the script is computed locally and the body is only sent
+    when the server does not know it: scripts registered on a RedisClient
+    are loaded on every connection its pool hands out, and a NOSCRIPT
+    reply, after SCRIPT FLUSH for instance, is answered by running the
+    script with EVAL, which caches it again.  The reply is returned like
+    any other, error replies included.
+
+    The script runs on the client it was registered with, or on
+    ``client``, which may be a Pipeline; a pipeline gets the EVALSHA
+    queued, with no NOSCRIPT fallback, and relies on the loading of
+    scripts on its connection.
+    """
+
+    def __init__(self, redis_client, script):
+        self.redis_client = redis_client
+        self.script = encode(script)
+        self.sha = hashlib.sha1(self.script).hexdigest()
+
+    def __repr__(self):
+        return 'Script(%r)' % self.sha
+
+    def __call__(self, keys=(), args=(), client=None):
+        if client is None:
+            client = self.redis_client
+        keys_and_args = list(keys)
+        keys_and_args.extend(args)
+        reply = client.evalsha(self.sha, len(keys), *keys_and_args)
+        if isinstance(reply, RedisError) and str(reply).startswith('NOSCRIPT'):
+            reply = client.eval(self.script, len(keys), *keys_and_args)
+        return reply
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Keys spread over independent Redis servers by consistent hashing"""
+
+import struct
+from bisect import bisect, insort
+from hashlib import md5
+
+import gevent
+
+from geventredis.client import RedisClient, RedisCommands
+from geventredis.commands import lookup_command
+from geventredis.wire_protocol import RedisError, encode
+
+# Each node gets 4 points on the ring per md5 digest, as in libketama
+POINTS_PER_NODE = 160
+
+
+def hash_tag(key):
+    """
+    Return the part of ``key`` that decides its node: the content of the
+    first {...} if it is not empty, the whole key otherwise
+    """
+    start = key.find('{')
+    if start >= 0:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+class HashRing(object):
+    """A ketama consistent hash ring.
+
+    Every node is placed on the ring at ``POINTS_PER_NODE * weight``
+    pseudo-random points, and a key belongs to the node of the first point
+    at or after its hash.  Adding or removing one of N nodes only moves
+    the keys of the points it gains or loses, about 1/N of them.
+    """
+
+    def __init__(self, nodes=()):
+        self._points = []
+        self._nodes = {}
+        for node in nodes:
+            self.add_node(node)
+
+    def _node_points(self, node, weight):
+        for i in xrange(POINTS_PER_NODE * weight // 4):
+            digest = md5('%s-%d' % (node, i)).digest()
+            for point in struct.unpack('<4I', digest):
+                yield point
+
+    def add_node(self, node, weight=1):
+        if node in self._nodes:
+            raise ValueError('%s is already on the ring' % node)
+        self._nodes[node] = weight
+        points = self._points
+        for point in self._node_points(node, weight):
+            insort(points, (point, node))
+
+    def remove_node(self, node):
+        del self._nodes[node]
+        self._points = [point for point in self._points if point[1] != node]
+
+    def get_node(self, key):
+        """Return the node holding ``key``, a string"""
+        points = self._points
+        if not points:
+            raise RedisError('No node on the hash ring')
+        point = struct.unpack('<I', md5(hash_tag(key)).digest()[:4])[0]
+        index = bisect(points, (point, ''))
+        if index == len(points):
+            index = 0
+        return points[index][1]
+
+
+def _merge_mget(parts, size):
+    values = [None] * size
+    for positions, reply in parts:
+        for position, value in zip(positions, reply):
+            values[position] = value
+    return values
+
+def _merge_count(parts, size):
+    return sum([reply for _, reply in parts])
+
+def _merge_status(parts, size):
+    return parts[0][1]
+
+# Multi-key commands that can be split per node, and how the replies of
+# the parts are combined back into one
+SPLIT_COMMANDS = {
+    'MGET': _merge_mget,
+    'DEL': _merge_count,
+    'MSET': _merge_status,
+}
+
+
+class ShardedRedisClient(RedisCommands):
+    """Shards keys over independent Redis servers.
+
+    Example usage::
+
+        redis_client = ShardedRedisClient([('10.0.0.1', 6379),
+                                           ('10.0.0.2', 6379)])
+        redis_client.set('foo', 'bar')
+        print redis_client.mget(['foo', 'user:{42}:name', 'user:{42}:mail'])
+
+    Each ``(host, port)`` node gets a RedisClient of its own, built with
+    ``timeout`` and ``pool_options``, and keys are placed on a HashRing of
+    the nodes named 'host:port'.  Only the part of a key between braces
+    is hashed, so keys sharing a {tag} are on the same node.
+
+    Commands go to the node of their keys.  MGET, MSET and DEL on keys
+    spread over several nodes are split, sent to the nodes concurrently
+    from one greenlet each, and their replies merged back in the order of
+    the keys.  Any other command whose keys are on different nodes raises
+    RedisError, and so do commands without keys, which can be sent to a
+    node through ``clients`` or ``get_client``.  Commands whose key
+    positions are not known in advance (SORT ... STORE, ZUNIONSTORE...)
+    are routed by their first key, so their keys should share a tag.
+    """
+
+    def __init__(self, nodes, timeout=None, **pool_options):
+        self.timeout = timeout
+        self.pool_options = pool_options
+        self.clients = {}
+        self.ring = HashRing()
+        for host, port in nodes:
+            self.add_node(host, port)
+
+    def add_node(self, host, port, weight=1):
+        """Add a server, which takes over about 1/N of the keys"""
+        name = '%s:%d' % (host, port)
+        self.ring.add_node(name, weight)
+        self.clients[name] = RedisClient(host, port, self.timeout, **self.pool_options)
+
+    def remove_node(self, host, port):
+        """Remove a server, its keys going to the other nodes"""
+        name = '%s:%d' % (host, port)
+        self.ring.remove_node(name)
+        self.clients.pop(name).connection_pool.disconnect()
+
+    def get_client(self, key):
+        """Return the RedisClient of the node holding ``key``"""
+        return self.clients[self.ring.get_node(encode(key))]
+
+    def _route(self, command, args):
+        """Return the client every key of ``args`` is on"""
+        keys = command.keys(args)
+        if not keys:
+            raise RedisError('%s has no key to pick a node with' % command.name)
+        get_node = self.ring.get_node
+        node = get_node(encode(keys[0]))
+        for key in keys[1:]:
+            if get_node(encode(key)) != node:
+                raise RedisError('%s keys are on different nodes' % command.name)
+        return self.clients[node]
+
+    def _execute(self, command, args, **options):
+        merge = SPLIT_COMMANDS.get(command.name)
+        if merge is None:
+            return self._route(command, args)._execute(command, args, **options)
+        # group the keys, along with their values for MSET, by node
+        first, _, step = command.key_spec
+        get_node = self.ring.get_node
+        groups = {}
+        for position, index in enumerate(xrange(first, len(args), step)):
+            node = get_node(encode(args[index]))
+            group = groups.get(node)
+            if group is None:
+                group = groups[node] = ([], [])
+            group[0].append(position)
+            group[1].extend(args[index:index + step])
+        if not groups:
+            raise RedisError('%s has no key to pick a node with' % command.name)
+        if len(groups) == 1:
+            node, = groups
+            return self.clients[node]._execute(command, args, **options)
+        greenlets = [(positions, gevent.spawn(self.clients[node]._execute,
+                                              command, tuple(node_args), **options))
+                     for node, (positions, node_args) in groups.iteritems()]
+        gevent.joinall([greenlet for _, greenlet in greenlets], raise_error=True)
+        parts = [(positions, greenlet.value) for positions, greenlet in greenlets]
+        for _, reply in parts:
+            if isinstance(reply, RedisError):
+                return reply
+        return merge(parts, position + 1)
+
+    def _execute_iter_command(self, *args):
+        command = lookup_command(args[0])
+        return self._route(command, args[1:])._execute_iter_command(*args)
+
+    def _execute_yield_command(self, *args):
+        command = lookup_command(args[0])
+        return self._route(command, args[1:])._execute_yield_command(*args)
@@ -1,164 +1,357 @@
 """
 """
 
-from cStringIO import StringIO
-from errno import EINTR
+from errno import EINTR, ECONNRESET
 from gevent.socket import socket, error
 
+try:
+    import hiredis
+except ImportError:
+    hiredis = None
+
+# Free space made available to each recv_into() call
+READ_CHUNK_SIZE = 65536
+# A read buffer grown past this size by a large reply is given back once
+# it has been consumed
+MAX_IDLE_BUFFER_SIZE = 1024 * 1024
+# Arguments longer than this are written from their own buffer instead of
+# being copied into the packed command
+BUFFER_CUTOFF = 6000
+
 class RedisError(Exception):
     pass
 
+class RedisTimeoutError(RedisError):
+    """A command did not complete before its deadline"""
+
+class WatchError(RedisError):
+    """A key watched by a transaction changed before EXEC"""
+
+def encode(value):
+    """Convert a command argument to the bytes sent to the server"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def pack_arguments(header, args):
+    """
+    Encode ``args`` in the unified request protocol after ``header``, the
+    already packed beginning of the command, as a list of buffers to be
+    written in order.
+
+    Each argument is converted once.  Small arguments are joined with the
+    protocol framing into as few buffers as possible, while arguments
+    longer than BUFFER_CUTOFF are kept as buffers of their own so that
+    large values are never copied.
+    """
+    buffers = []
+    pieces = [header]
+    for arg in args:
+        arg = encode(arg)
+        length = len(arg)
+        if length > BUFFER_CUTOFF:
+            pieces.append('$%d\r\n' % length)
+            buffers.append(''.join(pieces))
+            buffers.append(arg)
+            pieces = ['\r\n']
+        else:
+            pieces.append('$%d\r\n%s\r\n' % (length, arg))
+    buffers.append(''.join(pieces))
+    return buffers
+
+def pack_command(*args):
+    """Encode a redis command in the unified request protocol"""
+    return pack_arguments('*%d\r\n' % len(args), args)
+
+def iter_reply(reply):
+    """
+    Iterate over an already parsed reply the way RedisSocket.iter_response
+    does: the elements of a multi-bulk, nothing for nil, the reply itself
+    otherwise, and raise error replies
+    """
+    if isinstance(reply, RedisError):
+        raise reply
+    if reply is None:
+        return
+    if isinstance(reply, list):
+        for item in reply:
+            yield item
+    else:
+        yield reply
+
+class PythonReader(object):
+    """Incremental RESP parser with the interface of ``hiredis.Reader``.
+
+    Received data is passed to ``feed`` and complete replies are taken out
+    with ``gets``, which returns False until one is fully buffered.  Error
+    replies are returned as RedisError instances, at any nesting depth.
+
+    The partially parsed multi-bulks are kept on a stack between calls, so
+    a huge reply arriving in many pieces is parsed exactly once.  Data is
+    kept in one growable bytearray; ``recv_from`` receives into it in place,
+    and makes room for the whole of a large bulk before receiving it.
+    """
+
+    def __init__(self):
+        self._buf = bytearray(READ_CHUNK_SIZE)
+        self._pos = 0
+        self._end = 0
+        # [items, remaining] for every multi-bulk being parsed
+        self._stack = []
+        # bytes needed at _pos to complete the bulk being parsed
+        self._wanted = 0
+
+    def _reserve(self, size):
+        """Make room for ``size`` bytes after the buffered data"""
+        buf = self._buf
+        pos = self._pos
+        end = self._end
+        if pos == end:
+            pos = end = 0
+            if len(buf) > MAX_IDLE_BUFFER_SIZE:
+                buf = self._buf = bytearray(READ_CHUNK_SIZE)
+        elif pos and len(buf) - end < size:
+            # move the unparsed tail to the front instead of growing
+            buf[:end - pos] = buf[pos:end]
+            end -= pos
+            pos = 0
+        free = len(buf) - end
+        if free < size:
+            buf.extend(bytearray(max(size - free, READ_CHUNK_SIZE)))
+        self._pos = pos
+        self._end = end
+        return buf
+
+    def feed(self, data, offset=0, length=-1):
+        if length < 0:
+            length = len(data) - offset
+        buf = self._reserve(length)
+        end = self._end
+        buf[end:end + length] = buffer(data, offset, length)
+        self._end = end + length
+
+    def recv_from(self, sock):
+        """Receive data from ``sock`` straight into the buffer"""
+        wanted = self._wanted - (self._end - self._pos)
+        buf = self._reserve(max(wanted, 4096))
+        end = self._end
+        n = sock.recv_into(memoryview(buf)[end:])
+        self._end = end + n
+        return n
+
+    def gets(self):
+        buf = self._buf
+        pos = self._pos
+        end = self._end
+        stack = self._stack
+        find = buf.find
+        while True:
+            nl = find('\r\n', pos, end)
+            if nl < 0:
+                self._wanted = 0
+                break
+            byte = buf[pos]
+            if byte == 36: # ord('$')
+                length = int(buf[pos + 1:nl])
+                if length == -1:
+                    value = None
+                    pos = nl + 2
+                else:
+                    start = nl + 2
+                    stop = start + length
+                    if stop + 2 > end:
+                        self._wanted = stop + 2 - pos
+                        break
+                    if length < READ_CHUNK_SIZE:
+                        value = str(buf[start:stop])
+                    else:
+                        value = memoryview(buf)[start:stop].tobytes()
+                    pos = stop + 2
+            elif byte == 42: # ord('*')
+                length = int(buf[pos + 1:nl])
+                pos = nl + 2
+                if length > 0:
+                    stack.append([[], length])
+                    continue
+                value = None if length == -1 else []
+            elif byte == 58: # ord(':')
+                value = int(buf[pos + 1:nl])
+                pos = nl + 2
+            elif byte == 43: # ord('+')
+                value = str(buf[pos + 1:nl])
+                pos = nl + 2
+            elif byte == 45: # ord('-')
+                value = RedisError(str(buf[pos + 1:nl]))
+                pos = nl + 2
+            else:
+                raise RedisError('Protocol error, got %r as reply type byte' % chr(byte))
+            while stack:
+                frame = stack[-1]
+                frame[0].append(value)
+                frame[1] -= 1
+                if frame[1]:
+                    break
+                value = stack.pop()[0]
+            else:
+                self._pos = pos
+                return value
+        self._pos = pos
+        return False
+
+    def gets_header(self):
+        """
+        Consume the header of a multi-bulk reply and return its length, -1
+        for a nil multi-bulk.  Return None, consuming nothing, if the next
+        reply is not a multi-bulk, or False if the header is incomplete.
+        """
+        if self._stack:
+            raise RedisError('Cannot read a header in the middle of a reply')
+        buf = self._buf
+        pos = self._pos
+        nl = buf.find('\r\n', pos, self._end)
+        if nl < 0:
+            return False
+        if buf[pos] != 42: # ord('*')
+            return None
+        self._pos = nl + 2
+        return int(buf[pos + 1:nl])
+
+class HiredisReader(object):
+    """RESP parser backed by the hiredis C extension"""
+
+    def __init__(self):
+        if hiredis is None:
+            raise RedisError('hiredis is not installed')
+        reader = hiredis.Reader(protocolError=RedisError, replyError=RedisError)
+        self.feed = reader.feed
+        self.gets = reader.gets
+
 class RedisSocket(socket):
 
     def __init__(self, *args, **kwargs):
+        reader_class = kwargs.pop('reader_class', None) or PythonReader
         socket.__init__(self, *args, **kwargs)
-        self._rbuf = StringIO()
-
-    def _read(self, size):
-        buf = self._rbuf
-        buf.seek(0, 2)  # seek end
-        # Read until size bytes or EOF seen, whichever comes first
-        buf_len = buf.tell()
-        if buf_len >= size:
-            # Already have size bytes in our buffer?  Extract and return.
-            buf.seek(0)
-            rv = buf.read(size)
-            self._rbuf = StringIO()
-            self._rbuf.write(buf.read())
-            return rv
-
-        self._rbuf = StringIO()  # reset _rbuf.  we consume it via buf.
-        self_recv = self.recv
-        buf_write = buf.write
-        while True:
-            left = size - buf_len
-            try:
-                data = self_recv(left)
-            except error, e:
-                if e.args[0] == EINTR:
-                    continue
-                raise
-            if not data:
-                break
-            n = len(data)
-            if n == size and not buf_len:
-                return data
-            if n == left:
-                buf_write(data)
-                del data  # explicit free
-                break
-            assert n <= left, "recv(%d) returned %d bytes" % (left, n)
-            buf_write(data)
-            buf_len += n
-            del data  # explicit free
-            #assert buf_len == buf.tell()
-        return buf.getvalue()
-
-    def _readline(self):
-        buf = self._rbuf
-        buf.seek(0, 2)  # seek end
-        if buf.tell() > 0:
-            # check if we already have it in our buffer
-            buf.seek(0)
-            bline = buf.readline()
-            if bline.endswith('\n'):
-                self._rbuf = StringIO()
-                self._rbuf.write(buf.read())
-                return bline
-            del bline
-        # Read until \n or EOF, whichever comes first
-        buf.seek(0, 2)  # seek end
-        self._rbuf = StringIO()  # reset _rbuf.  we consume it via buf.
-        self__rbuf_write = self._rbuf.write
-        self_recv = self.recv
-        buf_write = buf.write
+        # Parsing is delegated to a reader with the feed()/gets() interface
+        # of hiredis.Reader. Readers providing recv_from() receive into
+        # their own buffer, the others are fed from a scratch buffer.
+        self._reader = reader_class()
+        self.bytes_received = 0
+        self._recv_from = getattr(self._reader, 'recv_from', None)
+        if self._recv_from is None:
+            self._rbuf = bytearray(READ_CHUNK_SIZE)
+
+    def _fill(self):
+        """Receive more data for the reader"""
+        recv_from = self._recv_from
         while True:
             try:
-                data = self_recv(8192)
+                if recv_from is not None:
+                    n = recv_from(self)
+                else:
+                    n = self.recv_into(self._rbuf)
             except error, e:
                 if e.args[0] == EINTR:
                     continue
                 raise
-            if not data:
-                break
-            nl = data.find('\n')
-            if nl >= 0:
-                nl += 1
-                buf_write(data[:nl])
-                self__rbuf_write(data[nl:])
-                del data
-                break
-            buf_write(data)
-        return buf.getvalue()
+            break
+        if not n:
+            raise error(ECONNRESET, 'Connection closed by server')
+        self.bytes_received += n
+        if recv_from is None:
+            self._reader.feed(self._rbuf, 0, n)
 
     def _read_response(self):
-        read = self._read
-        readline = self._readline
-        response = readline()
-        byte = ord(response[0])
-        if byte is 43: # ord('+')
-            return response[1:-2]
-        elif byte is 58: # ord(':')
-            return int(response[1:])
-        elif byte is 36: # ord('$')
-            number = int(response[1:])
-            if number == -1:
-                return None
-            else:
-                return read(number+2)[:-2]
-        elif byte is 42: # ord('*')
-            number = int(response[1:])
-            if number == -1:
-                return None
+        gets = self._reader.gets
+        reply = gets()
+        while reply is False:
+            self._fill()
+            reply = gets()
+        return reply
+
+    def _read_responses(self):
+        """
+        Wait for at least one reply, then return every complete reply that
+        is already buffered, without receiving more data
+        """
+        replies = [self._read_response()]
+        gets = self._reader.gets
+        reply = gets()
+        while reply is not False:
+            replies.append(reply)
+            reply = gets()
+        return replies
+
+    def iter_response(self):
+        """
+        Read a reply, yielding the elements of a multi-bulk reply one by one
+        as they are received instead of building the whole list.
+
+        A nil multi-bulk yields nothing, an error reply is raised and any
+        other reply is yielded as a single item.  The reply must be consumed
+        entirely before the connection is used again.  Readers that cannot
+        parse a multi-bulk header alone (hiredis) read the whole reply first.
+        """
+        gets_header = getattr(self._reader, 'gets_header', None)
+        number = None
+        if gets_header is not None:
+            number = gets_header()
+            while number is False:
+                self._fill()
+                number = gets_header()
+        if number is None:
+            for item in iter_reply(self._read_response()):
+                yield item
+            return
+        read_response = self._read_response
+        while number > 0:
+            yield read_response()
+            number -= 1
+
+    def _send_packed(self, buffers):
+        """
+        Write a list of packed buffers in full.  Consecutive small buffers
+        are coalesced into one write, large ones are written as they are.
+        """
+        sendall = self.sendall
+        pending = []
+        for buf in buffers:
+            if len(buf) > BUFFER_CUTOFF:
+                if pending:
+                    sendall(''.join(pending))
+                    pending = []
+                sendall(buf)
             else:
-                result = []
-                result_append = result.append
-                while number:
-                    response = readline()
-                    byte = ord(response[0])
-                    if byte is 36: # ord('$')
-                        result_append(read(int(response[1:])+2)[:-2])
-                    else:
-                        if byte is 58: # ord(':')
-                            result_append(int(response[1:]))
-                        else:
-                            result_append(response[1:-2])
-                    number -= 1
-                return result
-        elif byte is 45: #ord('-')
-            return RedisError(response[1:-2])
-        else:
-            raise RedisError('bulk cannot startswith %r' % byte)
+                pending.append(buf)
+        if pending:
+            sendall(''.join(pending))
 
     def _execute_command(self, *args):
         """Executes a redis command and return a result"""
-        data = '*%d\r\n' % len(args) + ''.join(['$%d\r\n%s\r\n' % (len(str(x)), x) for x in args])
-        self.send(data)
+        self._send_packed(pack_command(*args))
         return self._read_response()
 
+    def _execute_packed(self, buffers, count=None):
+        """
+        Sends already packed commands at once and return ``count`` results,
+        or a single result if ``count`` is None
+        """
+        self._send_packed(buffers)
+        read_response = self._read_response
+        if count is None:
+            return read_response()
+        return [read_response() for _ in xrange(count)]
+
+    def _execute_iter_command(self, *args):
+        """Executes a redis command and yield the elements of its result"""
+        self._send_packed(pack_command(*args))
+        return self.iter_response()
+
     def _execute_yield_command(self, *args):
         """Executes a redis command and yield multiple results"""
-        data = '*%d\r\n' % len(args) + ''.join(['$%d\r\n%s\r\n' % (len(str(x)), x) for x in args])
-        self.send(data)
+        self._send_packed(pack_command(*args))
         while 1:
             yield self._read_response()
-
-    def _execute_command_1(self, arg1):
-        data = '*1\r\n$%d\r\n%s\r\n' % (len(arg1), arg1)
-        self.send(data)
-        return self._read_response()
-
-    def _execute_command_2(self, arg1, arg2):
-        data = '*2\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n' % (len(arg1), arg1, len(str(arg2)), arg2)
-        self.send(data)
-        return self._read_response()
-
-    def _execute_command_3(self, arg1, arg2, arg3):
-        data = '*3\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n' % (len(arg1), arg1, len(str(arg2)), arg2, len(str(arg3)), arg3)
-        self.send(data)
-        return self._read_response()
-
-    def _execute_command_4(self, arg1, arg2, arg3, arg4):
-        data = '*4\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n' % (len(arg1), arg1, len(str(arg2)), arg2, len(str(arg3)), arg3, len(str(arg4)), arg4)
-        self.send(data)
-        return self._read_response()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Phus Lu
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compact sorted set ranges: members in a list, scores in an array"""
+
+from array import array
+from itertools import imap, islice, izip
+
+
+class ScoredMembers(object):
+    """Members of a sorted set with their scores, in rank order.
+
+    Example usage::
+
+        board = redis_client.zrevrange('leaderboard', 0, 99999, compact=True)
+        print board.members[:10], board.scores[:10]
+        qualified = board.score_range(1000)     # score >= 1000
+        redis_client.zadd('archive', board)
+
+    The members are a list and the scores an ``array('d')``, 8 bytes each
+    instead of a tuple and a float object per entry.  Slicing by rank and
+    ``score_range`` return ScoredMembers sharing nothing with the original
+    and create no object per entry; ``score_range`` finds its bounds by
+    bisection.  The scores support the buffer interface, e.g. for
+    ``numpy.frombuffer``.  Iterating or indexing yields (member, score)
+    pairs.
+
+    The scores must be sorted, ascending unless ``descending``, which
+    defaults to what they look like.
+    """
+
+    __slots__ = ('members', 'scores', 'descending')
+
+    def __init__(self, members, scores, descending=None):
+        if len(members) != len(scores):
+            raise ValueError('%d members but %d scores' % (len(members), len(scores)))
+        if not isinstance(scores, array):
+            scores = array('d', scores)
+        if descending is None:
+            descending = len(scores) > 1 and scores[0] > scores[-1]
+        self.members = members
+        self.scores = scores
+        self.descending = descending
+
+    @classmethod
+    def from_reply(cls, reply):
+        """Build from the flat [member, score...] reply of WITHSCORES"""
+        return cls(reply[::2], array('d', imap(float, islice(reply, 1, None, 2))))
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Build from (member, score) pairs sorted by score"""
+        pairs = list(pairs)
+        return cls([member for member, _ in pairs], array('d', [score for _, score in pairs]))
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return izip(self.members, self.scores)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ScoredMembers(self.members[index], self.scores[index], self.descending)
+        return self.members[index], self.scores[index]
+
+    def __repr__(self):
+        return 'ScoredMembers(%d members)' % len(self.members)
+
+    def _bisect(self, score, right):
+        # the first index whose score is past ``score`` in rank order,
+        # or reaches it unless ``right``
+        scores = self.scores
+        descending = self.descending
+        low, high = 0, len(scores)
+        while low < high:
+            middle = (low + high) // 2
+            value = scores[middle]
+            if descending:
+                before = value > score or (right and value == score)
+            else:
+                before = value < score or (right and value == score)
+            if before:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def score_range(self, min=float('-inf'), max=float('inf')):
+        """Return the members whose score is between ``min`` and ``max``"""
+        if self.descending:
+            start, stop = self._bisect(max, False), self._bisect(min, True)
+        else:
+            start, stop = self._bisect(min, False), self._bisect(max, True)
+        return self[start:stop]
+
+    def zadd_arguments(self):
+        """Return the [score, member...] arguments of ZADD"""
+        arguments = [None] * (2 * len(self.members))
+        arguments[::2] = self.scores
+        arguments[1::2] = self.members
+        return arguments
@@ -7,7 +7,7 @@ def test():
     redis_client = geventredis.connect()
     print redis_client.info()
     for msg in redis_client.monitor():
-        print msg
+        print geventredis.parse_monitor_line(msg) or msg
 
 if __name__ == '__main__':
     test()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import unittest
+
+from geventredis import RedisClusterClient, RedisError, key_slot
+from geventredis.fakeserver import FakeRedisCluster
+
+
+class ClusterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cluster = FakeRedisCluster(3)
+        self.cluster.start()
+        self.redis_client = RedisClusterClient([('127.0.0.1', self.cluster.nodes[0].port)])
+
+    def tearDown(self):
+        self.cluster.stop()
+
+    def node_of(self, key):
+        return self.cluster.slots[key_slot(key)]
+
+    def test_slot_map(self):
+        nodes = self.cluster.nodes
+        self.assertEqual(self.redis_client.slots[0], ('127.0.0.1', nodes[0].port))
+        self.assertEqual(self.redis_client.slots[-1], ('127.0.0.1', nodes[-1].port))
+        for i in xrange(30):
+            self.assertEqual(self.redis_client.set('key:%d' % i, i), 'OK')
+        for i in xrange(30):
+            key = 'key:%d' % i
+            self.assertEqual(self.node_of(key).data[key], str(i))
+            self.assertEqual(self.redis_client.get(key), str(i))
+        self.assertTrue(all([node.data for node in nodes]))
+
+    def test_moved(self):
+        redis_client = self.redis_client
+        redis_client.set('foo', 'bar')
+        slot = key_slot('foo')
+        owner = self.node_of('foo')
+        target = [node for node in self.cluster.nodes if node is not owner][0]
+        self.cluster.move_slot(slot, target)
+        self.assertEqual(redis_client.get('foo'), 'bar')
+        self.assertEqual(redis_client.slots[slot], ('127.0.0.1', target.port))
+        redis_client._refresher.join()
+        self.assertEqual(redis_client.slots[slot], ('127.0.0.1', target.port))
+
+    def test_ask(self):
+        redis_client = self.redis_client
+        slot = key_slot('foo')
+        owner = self.node_of('foo')
+        target = [node for node in self.cluster.nodes if node is not owner][0]
+        self.cluster.migrate_slot(slot, target)
+        # not on the owner yet: answered by the target behind ASKING
+        target.data['foo'] = 'migrated'
+        self.assertEqual(redis_client.get('foo'), 'migrated')
+        owner.data['foo'] = 'still here'
+        self.assertEqual(redis_client.get('foo'), 'still here')
+        # ASK does not change the slot map
+        self.assertEqual(redis_client.slots[slot], ('127.0.0.1', owner.port))
+
+    def test_split_commands(self):
+        redis_client = self.redis_client
+        keys = ['a', 'b', 'c', 'd', 'e', 'f']
+        self.assertTrue(len(set([self.node_of(key) for key in keys])) > 1)
+        self.assertEqual(redis_client.mset(dict([(key, key * 2) for key in keys])), 'OK')
+        self.assertEqual(redis_client.mget(keys), [key * 2 for key in keys])
+        self.assertEqual(redis_client.delete(*keys), len(keys))
+        self.assertEqual(redis_client.mget(keys), [None] * len(keys))
+
+    def test_cross_slot(self):
+        self.assertRaises(RedisError, self.redis_client.rename, 'a', 'b')
+        self.assertEqual(self.redis_client.rename('{a}x', '{a}y').args[0][:6], 'ERR no')
+
+    def test_too_many_redirects(self):
+        # a slot migrating to its own owner asks for itself forever
+        self.cluster.migrate_slot(key_slot('foo'), self.node_of('foo'))
+        self.assertRaises(RedisError, self.redis_client.get, 'foo')
+
+if __name__ == '__main__':
+    unittest.main()